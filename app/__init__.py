@@ -59,11 +59,69 @@ def create_app(config_name=None):
     app.logger.info(f"Template folder existe: {os.path.exists(app.template_folder)}")
     
     # Inicializar extensões
-    from app.models import db
+    from app.models import db, configure_engine_options, configure_sqlite_engine
+    configure_engine_options(app)
     db.init_app(app)
+    with app.app_context():
+        configure_sqlite_engine(app)
+        created_tables = []
+        if app.config.get('DB_AUTO_MIGRATE', True):
+            # Tabelas, restrições e índices novos nos bancos já existentes
+            from app.migrations import create_missing_tables, upgrade_indexes, upgrade_nullable_columns
+            upgrade_nullable_columns()
+            created_tables = create_missing_tables()
+            upgrade_indexes()
+    # Contadores das estatísticas atualizados a cada flush
+    from app.stats import register_stat_listeners
+    register_stat_listeners()
     mail.init_app(app)
+    
+    # Templates dos emails compilados uma vez; renderizados pelos workers de entrega
+    from app.email_templates import EmailRenderer
+    app.email_renderer = EmailRenderer(app)
+    
+    # Entrega dos emails da outbox por pool fixo de workers com conexões SMTP reutilizadas
+    from app.mail_worker import EmailWorkerPool
+    app.email_worker = EmailWorkerPool(app)
+    
+    # Avisos ao administrador agrupados em resumos por janela de tempo
+    from app.admin_digest import AdminDigest
+    app.admin_digest = AdminDigest(app)
+    
+    # Logs do sistema particionados por dia e gravados em lote por thread dedicada
+    from app.log_partitions import LogPartitions
+    app.log_partitions = LogPartitions(app)
+    from app.log_writer import SystemLogWriter
+    app.system_log_writer = SystemLogWriter(app)
+    if 'stat_counters' in created_tables:
+        # Contadores novos partem das contagens reais, não de zero
+        from app.stats import reconcile_counters
+        with app.app_context():
+            reconcile_counters(app.log_partitions)
+    
+    # Registro das requisições por nível/amostragem e contadores por minuto
+    from app.request_logging import RequestLogPolicy
+    app.request_log_policy = RequestLogPolicy(app)
+    
+    # Rate limiting com contadores compartilhados pelos workers do gunicorn (shared://)
+    from app.shared_limiter import shared_storage_uri
+    if app.config.get('RATELIMIT_STORAGE_URI', '').startswith('shared:'):
+        app.config['RATELIMIT_STORAGE_URI'] = shared_storage_uri(app)
+        app.config.setdefault('RATELIMIT_STORAGE_OPTIONS', {
+            'slots': app.config.get('RATELIMIT_SHARED_SLOTS', 65536),
+            'stripes': app.config.get('RATELIMIT_SHARED_STRIPES', 64),
+        })
     limiter.init_app(app)
     
+    # Cache das sessões validadas (evita consultar o banco em toda requisição)
+    if app.config.get('SESSION_CACHE_BACKEND', 'shared') == 'shared':
+        # Arquivo mapeado em memória compartilhado pelos workers do gunicorn
+        from app.shared_cache import SharedSessionCache
+        app.session_cache = SharedSessionCache(app)
+    else:
+        from app.session_cache import SessionCache
+        app.session_cache = SessionCache(app)
+    
     # Configurar captcha
     from app.captcha import captcha_manager
     captcha_manager.configure(app)
@@ -79,6 +137,10 @@ def create_app(config_name=None):
     app.firewall_manager = FirewallManager()
     app.firewall_manager.configure(app)
     
+    # Reconciliador: aplica alterações de regras no firewall assim que ocorrem
+    from app.reconciler import FirewallReconciler
+    app.firewall_reconciler = FirewallReconciler(app)
+    
     # Configurar tarefas em background
     setup_background_tasks(app)
     
@@ -89,7 +151,10 @@ def create_app(config_name=None):
 def setup_background_tasks(app):
     """Configura tarefas em background"""
     from apscheduler.schedulers.background import BackgroundScheduler
-    from app.tasks import cleanup_expired_sessions, sync_firewall_rules
+    from app.tasks import (cleanup_expired_sessions, sync_firewall_rules, cleanup_old_logs,
+                           checkpoint_database, optimize_database, reconcile_stats,
+                           cleanup_email_outbox)
+    from datetime import datetime
     
     if not app.debug:  # Apenas em produção
         scheduler = BackgroundScheduler()
@@ -97,19 +162,82 @@ def setup_background_tasks(app):
         # Limpar sessões expiradas a cada 5 minutos
         scheduler.add_job(
             func=cleanup_expired_sessions,
+            args=[app],
             trigger="interval",
             minutes=5,
             id='cleanup_sessions'
         )
         
-        # Sincronizar regras do firewall a cada 10 minutos
+        # Sincronização completa do firewall (rede de segurança do reconciliador)
         scheduler.add_job(
             func=sync_firewall_rules,
+            args=[app],
             trigger="interval",
-            minutes=10,
+            minutes=app.config.get('FIREWALL_SYNC_INTERVAL', 10),
             id='sync_firewall'
         )
         
+        # Retenção dos logs: descarta diariamente as partições antigas
+        scheduler.add_job(
+            func=cleanup_old_logs,
+            args=[app],
+            trigger="interval",
+            hours=24,
+            id='cleanup_logs'
+        )
+        
+        # Manutenção do SQLite: checkpoint do WAL e atualização das estatísticas
+        scheduler.add_job(
+            func=checkpoint_database,
+            args=[app],
+            trigger="interval",
+            minutes=app.config.get('SQLITE_CHECKPOINT_INTERVAL', 5),
+            id='checkpoint_database'
+        )
+        scheduler.add_job(
+            func=optimize_database,
+            args=[app],
+            trigger="interval",
+            hours=app.config.get('SQLITE_OPTIMIZE_INTERVAL', 6),
+            id='optimize_database'
+        )
+        
+        # Reconciliação dos contadores das estatísticas (corrige desvios); fora dos
+        # testes a primeira execução é imediata
+        first_run = {} if app.testing else {'next_run_time': datetime.now()}
+        scheduler.add_job(
+            func=reconcile_stats,
+            args=[app],
+            trigger="interval",
+            minutes=app.config.get('STATS_RECONCILE_INTERVAL', 60),
+            id='reconcile_stats',
+            **first_run
+        )
+        
+        # Outbox de emails: garante a entrega do que ficou pendente (ex.: após reinício)
+        # e remove periodicamente os emails já processados
+        scheduler.add_job(
+            func=app.email_worker.notify,
+            trigger="interval",
+            minutes=1,
+            id='email_outbox'
+        )
+        scheduler.add_job(
+            func=cleanup_email_outbox,
+            args=[app],
+            trigger="interval",
+            hours=24,
+            id='cleanup_email_outbox'
+        )
+        
+        # Resumos dos avisos ao administrador cujas janelas terminaram
+        scheduler.add_job(
+            func=app.admin_digest.flush,
+            trigger="interval",
+            minutes=1,
+            id='admin_digest'
+        )
+        
         scheduler.start()
         app.scheduler = scheduler
         app.logger.info('Tarefas em background configuradas')
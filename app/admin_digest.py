@@ -0,0 +1,130 @@
+"""
+Resumos periódicos dos emails destinados ao administrador
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func
+
+logger = logging.getLogger(__name__)
+
+# Tipos de email agrupados e o título usado no resumo
+DIGEST_TYPES = {
+    'admin_new_registration': 'novos pedidos de registro',
+    'blacklist_admin': 'bloqueios por tentativas de login (blacklist)',
+}
+
+
+class AdminDigest:
+    """Agrupa os avisos ao administrador em um email por tipo a cada janela
+
+    O primeiro evento de um tipo é enviado imediatamente (email individual
+    de sempre); os eventos seguintes dentro de ADMIN_DIGEST_WINDOW_S
+    segundos ficam em admin_digest_events e, quando o mais antigo deles
+    completa a janela, viram um único email de resumo com a contagem, os
+    IPs mais frequentes e as contas afetadas (ADMIN_DIGEST_TOP de cada).
+    Os eventos e os emails são gravados na transação do chamador, como a
+    outbox. O resumo sai no próximo evento do tipo ou pela tarefa
+    periódica (flush), o que vier antes. Com janela 0 todos os eventos são
+    enviados individualmente.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.window = 300
+        self.top = 10
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura o agrupamento com as configurações da aplicação"""
+        self.app = app
+        self.window = app.config.get('ADMIN_DIGEST_WINDOW_S', 300)
+        self.top = app.config.get('ADMIN_DIGEST_TOP', 10)
+
+    def record(self, digest_type: str, user_email: str, ip_address: Optional[str], send_now) -> bool:
+        """Registra o evento; chama send_now() se for o primeiro da janela. Retorna se enviou"""
+        from app.models import AdminDigestEvent, db
+
+        if self.window <= 0:
+            send_now()
+            return True
+
+        now = datetime.utcnow()
+        recent = db.session.query(AdminDigestEvent.id).filter(
+            AdminDigestEvent.digest_type == digest_type,
+            AdminDigestEvent.created_at >= now - timedelta(seconds=self.window)
+        ).first() is not None
+        db.session.add(AdminDigestEvent(
+            digest_type=digest_type, user_email=user_email, ip_address=ip_address,
+            status='pending' if recent else 'immediate', created_at=now
+        ))
+        if not recent:
+            send_now()
+            return True
+        self._flush_type(digest_type, now)
+        return False
+
+    def flush(self, now: Optional[datetime] = None) -> int:
+        """Envia os resumos cujas janelas terminaram; retorna quantos foram gravados na outbox"""
+        from app.models import db
+
+        with self.app.app_context():
+            now = now or datetime.utcnow()
+            try:
+                sent = sum(self._flush_type(digest_type, now) for digest_type in DIGEST_TYPES)
+                db.session.commit()
+                return sent
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Erro ao gerar resumos para o administrador: {str(e)}")
+                return 0
+
+    def purge(self, before: datetime) -> int:
+        """Remove os eventos já enviados (immediate/digested) criados antes de before"""
+        from app.models import AdminDigestEvent, db
+
+        table = AdminDigestEvent.__table__
+        with db.engine.begin() as connection:
+            return connection.execute(table.delete().where(
+                table.c.status.in_(['immediate', 'digested']), table.c.created_at < before
+            )).rowcount
+
+    def _flush_type(self, digest_type: str, now: datetime) -> int:
+        """Grava na outbox o resumo do tipo se o evento pendente mais antigo completou a janela"""
+        from app.email import send_template_email
+        from app.models import AdminDigestEvent, db
+
+        pending = db.session.query(AdminDigestEvent).filter(
+            AdminDigestEvent.digest_type == digest_type,
+            AdminDigestEvent.status == 'pending'
+        )
+        since, until, last_id, count = pending.with_entities(
+            func.min(AdminDigestEvent.created_at), func.max(AdminDigestEvent.created_at),
+            func.max(AdminDigestEvent.id), func.count(AdminDigestEvent.id)
+        ).one()
+        if not count or since > now - timedelta(seconds=self.window):
+            return 0
+
+        batch = pending.filter(AdminDigestEvent.id <= last_id)
+        top_ips = batch.with_entities(AdminDigestEvent.ip_address, func.count()).filter(
+            AdminDigestEvent.ip_address.isnot(None)
+        ).group_by(AdminDigestEvent.ip_address).order_by(func.count().desc()).limit(self.top).all()
+        accounts = batch.with_entities(AdminDigestEvent.user_email, func.count()).group_by(
+            AdminDigestEvent.user_email
+        ).order_by(func.count().desc()).limit(self.top).all()
+        account_count = batch.with_entities(func.count(func.distinct(AdminDigestEvent.user_email))).scalar()
+
+        send_template_email('admin_digest', [self.app.config.get('ADMIN_EMAIL', 'admin@localhost')], {
+            'title': DIGEST_TYPES[digest_type],
+            'count': count,
+            'since': since.strftime('%d/%m/%Y %H:%M:%S'),
+            'until': until.strftime('%d/%m/%Y %H:%M:%S'),
+            'top_ips': [list(row) for row in top_ips],
+            'accounts': [list(row) for row in accounts],
+            'account_count': account_count
+        }, email_type=f"resumo {digest_type}")
+        batch.update({AdminDigestEvent.status: 'digested'}, synchronize_session=False)
+        logger.info(f"Resumo {digest_type} gravado na outbox: {count} eventos")
+        return 1
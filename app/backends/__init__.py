@@ -0,0 +1,23 @@
+"""
+Backends de firewall selecionáveis via FIREWALL_BACKEND
+"""
+from app.backends.base import FirewallBackend, RuleChange
+from app.backends.iptables import IptablesBackend
+from app.backends.nftables import NftablesBackend
+from app.backends.fake import FakeBackend
+from app.backends.helper import HelperBackend, FirewallHelperError
+
+BACKENDS = {
+    'iptables': IptablesBackend,
+    'nftables': NftablesBackend,
+    'fake': FakeBackend,
+    'helper': HelperBackend,
+}
+
+
+def create_backend(name: str) -> FirewallBackend:
+    """Instancia o backend pelo nome configurado"""
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Backend de firewall desconhecido: {name} (opções: {', '.join(BACKENDS)})")
@@ -0,0 +1,140 @@
+"""
+Interface comum dos backends de firewall
+"""
+import logging
+import subprocess
+from collections import namedtuple
+from typing import Iterator, List, Optional, Tuple
+
+from app.ruleset import Network
+
+logger = logging.getLogger(__name__)
+
+# Alteração já filtrada pelo índice do FirewallManager: action é 'add' ou 'remove',
+# tipo é 'whitelist' ou 'blacklist', network é um objeto ipaddress e timeout é o
+# tempo de vida em segundos da entrada no kernel (None = permanente). Um 'add' com
+# timeout de uma entrada já presente apenas renova o prazo.
+RuleChange = namedtuple('RuleChange', ['action', 'tipo', 'network', 'timeout'], defaults=(None,))
+
+
+class FirewallBackend:
+    """Backend que aplica no kernel as alterações decididas pelo FirewallManager
+
+    O FirewallManager mantém o índice, as transações e a sincronização com o
+    banco; o backend só sabe preparar a estrutura base, aplicar um lote de
+    alterações, ler o estado atual e informar o que deve ser persistido.
+    """
+
+    name = 'base'
+    # Backends remotos mantêm o próprio índice autoritativo e recebem as
+    # operações sem filtragem pelo índice local (ver HelperBackend)
+    remote = False
+
+    def __init__(self):
+        self.enabled = True
+        self.chain_name = 'FIREWALL_LOGIN_ALLOW'
+        self.blacklist_chain = 'BLACKLIST'
+        self.session_timeouts = True
+
+    def configure(self, app):
+        """Configura o backend com as configurações da aplicação"""
+        self.enabled = app.config.get('FIREWALL_ENABLED', True)
+        self.chain_name = app.config.get('FIREWALL_CHAIN', 'FIREWALL_LOGIN_ALLOW')
+        self.blacklist_chain = app.config.get('FIREWALL_BLACK', 'BLACKLIST')
+        self.session_timeouts = app.config.get('FIREWALL_SESSION_TIMEOUTS', True)
+
+    @property
+    def supports_timeouts(self) -> bool:
+        """Indica se as entradas da whitelist podem expirar sozinhas no kernel"""
+        return False
+
+    def idempotent(self, tipo: str) -> bool:
+        """Indica se adicionar um IP presente ou remover um ausente é inofensivo
+
+        Operações idempotentes podem ser enviadas sem consultar o índice;
+        as demais (regras -A/-D do iptables) dependem do estado real.
+        """
+        return False
+
+    def setup(self) -> bool:
+        """Cria a estrutura base (chains, sets, regras fixas)"""
+        raise NotImplementedError
+
+    def apply(self, changes: List[RuleChange]) -> Tuple[bool, List[RuleChange]]:
+        """Aplica um lote de alterações
+
+        Retorna (sucesso, alterações efetivamente aplicadas). Em backends que
+        aplicam cada família separadamente, uma família pode falhar sem
+        afetar a outra.
+        """
+        raise NotImplementedError
+
+    def read_state(self) -> Tuple[bool, List[Tuple[str, Network]]]:
+        """Lê do kernel as entradas (tipo, rede) gerenciadas pela aplicação"""
+        raise NotImplementedError
+
+    def flush(self, tipo: str = 'whitelist') -> bool:
+        """Remove todas as entradas de um tipo"""
+        raise NotImplementedError
+
+    def persist_targets(self, app) -> List[Tuple[List[str], str]]:
+        """Comandos de dump e arquivos de destino usados pelo RulesetPersister"""
+        return []
+
+    def _run_command(self, command: List[str], input_data: Optional[str] = None) -> Tuple[bool, str]:
+        """Executa comando do sistema e retorna resultado
+
+        input_data é enviado pela entrada padrão (usado pelos comandos *-restore e nft -f -).
+        """
+        if not self.enabled:
+            logger.info(f"[SIMULAÇÃO - FIREWALL DESLIGADO] Comando: {' '.join(command)}")
+            if input_data:
+                logger.info(f"[SIMULAÇÃO - FIREWALL DESLIGADO] Entrada:\n{input_data}")
+            return True, '[Simulação] Comando não executado.'
+        try:
+            result = subprocess.run(
+                command,
+                input=input_data,
+                capture_output=True,
+                text=True,
+                timeout=30,
+                check=False
+            )
+
+            if result.returncode == 0:
+                logger.info(f"Comando executado com sucesso: {' '.join(command)}")
+                return True, result.stdout.strip()
+            else:
+                logger.error(f"Erro ao executar comando: {' '.join(command)} - {result.stderr}")
+                return False, result.stderr.strip()
+
+        except subprocess.TimeoutExpired:
+            logger.error(f"Timeout ao executar comando: {' '.join(command)}")
+            return False, "Timeout na execução do comando"
+        except Exception as e:
+            logger.error(f"Exceção ao executar comando: {' '.join(command)} - {str(e)}")
+            return False, str(e)
+
+    def _stream_command(self, command: List[str]) -> Iterator[str]:
+        """Executa comando e entrega a saída linha a linha, sem acumulá-la em memória"""
+        if not self.enabled:
+            logger.info(f"[SIMULAÇÃO - FIREWALL DESLIGADO] Comando: {' '.join(command)}")
+            return
+
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        try:
+            for line in process.stdout:
+                yield line
+        finally:
+            process.stdout.close()
+            stderr = process.stderr.read()
+            process.stderr.close()
+            returncode = process.wait(timeout=30)
+
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, stderr=stderr)
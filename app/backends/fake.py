@@ -0,0 +1,65 @@
+"""
+Backend em memória para testes e desenvolvimento
+"""
+import logging
+from typing import Dict, List, Set, Tuple
+
+from app.backends.base import FirewallBackend, RuleChange
+from app.ruleset import Network
+
+logger = logging.getLogger(__name__)
+
+
+class FakeBackend(FirewallBackend):
+    """Simula o kernel em memória, sem executar nenhum comando
+
+    Registra cada lote aplicado em 'batches' e permite forçar a falha do
+    próximo lote com 'fail_next', para testar o comportamento do
+    FirewallManager diante de divergências.
+    """
+
+    name = 'fake'
+
+    def __init__(self):
+        super().__init__()
+        self.entries: Dict[str, Set[Network]] = {'whitelist': set(), 'blacklist': set()}
+        # Timeout (segundos) informado na última adição de cada rede
+        self.timeouts: Dict[Network, int] = {}
+        self.batches: List[List[RuleChange]] = []
+        self.fail_next = False
+        self.setup_calls = 0
+
+    @property
+    def supports_timeouts(self) -> bool:
+        return self.session_timeouts
+
+    def idempotent(self, tipo: str) -> bool:
+        return True
+
+    def setup(self) -> bool:
+        self.setup_calls += 1
+        return True
+
+    def apply(self, changes: List[RuleChange]) -> Tuple[bool, List[RuleChange]]:
+        if self.fail_next:
+            self.fail_next = False
+            logger.info(f"[FAKE] Falha simulada em lote de {len(changes)} alterações")
+            return False, []
+
+        for change in changes:
+            if change.action == 'add':
+                self.entries[change.tipo].add(change.network)
+                if change.timeout is not None:
+                    self.timeouts[change.network] = change.timeout
+            else:
+                self.entries[change.tipo].discard(change.network)
+                self.timeouts.pop(change.network, None)
+        self.batches.append(list(changes))
+        return True, list(changes)
+
+    def read_state(self) -> Tuple[bool, List[Tuple[str, Network]]]:
+        return True, [(tipo, network) for tipo, networks in self.entries.items() for network in networks]
+
+    def flush(self, tipo: str = 'whitelist') -> bool:
+        self.entries[tipo] = set()
+        return True
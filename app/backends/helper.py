@@ -0,0 +1,117 @@
+"""
+Backend cliente do processo auxiliar privilegiado (socket Unix)
+"""
+import json
+import socket
+import logging
+from typing import List, Optional, Tuple
+
+from app.backends.base import FirewallBackend, RuleChange
+from app.ruleset import Network, format_network, to_network
+
+logger = logging.getLogger(__name__)
+
+
+class FirewallHelperError(Exception):
+    """Falha de comunicação com o processo auxiliar do firewall"""
+
+
+class HelperBackend(FirewallBackend):
+    """Encaminha as operações ao processo auxiliar (app/firewall_helper.py)
+
+    Nenhum binário é executado no worker do Flask. O índice de regras
+    autoritativo fica no processo auxiliar, compartilhado por todos os
+    workers: por isso as operações são enviadas sem filtragem pelo índice
+    local (remote = True) e o estado é lido do índice do auxiliar.
+    """
+
+    name = 'helper'
+    remote = True
+
+    def __init__(self):
+        super().__init__()
+        self.socket_path = '/run/firewall_login/helper.sock'
+        self.timeout = 30.0
+        self._supports_timeouts: Optional[bool] = None
+
+    def configure(self, app):
+        super().configure(app)
+        self.socket_path = app.config.get('FIREWALL_HELPER_SOCKET', '/run/firewall_login/helper.sock')
+        self.timeout = app.config.get('FIREWALL_HELPER_TIMEOUT', 30.0)
+        self._supports_timeouts = None
+
+    def _request(self, payload: dict) -> dict:
+        """Envia uma requisição e aguarda a resposta (uma linha JSON cada)"""
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                sock.sendall((json.dumps(payload) + '\n').encode('utf-8'))
+                with sock.makefile('r', encoding='utf-8') as stream:
+                    line = stream.readline()
+        except OSError as e:
+            raise FirewallHelperError(f"Processo auxiliar indisponível em {self.socket_path}: {str(e)}")
+        if not line:
+            raise FirewallHelperError("Processo auxiliar encerrou a conexão sem resposta")
+        return json.loads(line)
+
+    @property
+    def supports_timeouts(self) -> bool:
+        if not self.session_timeouts:
+            return False
+        if self._supports_timeouts is None:
+            if not self.enabled:
+                return True
+            try:
+                self._supports_timeouts = bool(self._request({'op': 'info'}).get('supports_timeouts'))
+            except FirewallHelperError as e:
+                logger.error(str(e))
+                return False
+        return self._supports_timeouts
+
+    def apply_operations(self, operations: List[tuple]) -> Tuple[bool, List[bool]]:
+        """Envia operações (acao, tipo, ip[, timeout]) e retorna o resultado de cada uma"""
+        if not self.enabled:
+            logger.info(f"[SIMULAÇÃO - FIREWALL DESLIGADO] {len(operations)} operações para o processo auxiliar")
+            return True, [True] * len(operations)
+        try:
+            response = self._request({'op': 'apply', 'operations': [list(operation) for operation in operations]})
+        except FirewallHelperError as e:
+            logger.error(str(e))
+            return False, [False] * len(operations)
+        results = response.get('results') or [False] * len(operations)
+        return bool(response.get('ok')), results
+
+    def apply(self, changes: List[RuleChange]) -> Tuple[bool, List[RuleChange]]:
+        operations = [
+            (change.action, change.tipo, format_network(change.network), change.timeout)
+            for change in changes
+        ]
+        success, results = self.apply_operations(operations)
+        return success, [change for change, result in zip(changes, results) if result]
+
+    def read_state(self) -> Tuple[bool, List[Tuple[str, Network]]]:
+        if not self.enabled:
+            return True, []
+        try:
+            response = self._request({'op': 'read_state'})
+        except FirewallHelperError as e:
+            logger.error(str(e))
+            return False, []
+        return bool(response.get('ok')), [(tipo, to_network(value)) for tipo, value in response.get('entries', [])]
+
+    def _simple_request(self, payload: dict) -> bool:
+        if not self.enabled:
+            logger.info(f"[SIMULAÇÃO - FIREWALL DESLIGADO] Processo auxiliar: {payload}")
+            return True
+        try:
+            return bool(self._request(payload).get('ok'))
+        except FirewallHelperError as e:
+            logger.error(str(e))
+            return False
+
+    def setup(self) -> bool:
+        return self._simple_request({'op': 'setup'})
+
+    def flush(self, tipo: str = 'whitelist') -> bool:
+        return self._simple_request({'op': 'flush', 'tipo': tipo})
@@ -0,0 +1,300 @@
+"""
+Backend iptables/ip6tables (com whitelist opcional em ipset)
+"""
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.backends.base import FirewallBackend, RuleChange
+from app.ruleset import Network, RuleRecord, format_network, parse_save_lines, to_network
+
+logger = logging.getLogger(__name__)
+
+
+class IptablesBackend(FirewallBackend):
+    """Aplica as regras com iptables-restore/ip6tables-restore
+
+    Com FIREWALL_WHITELIST_MODE=ipset, a whitelist fica em sets hash:net
+    (v4 e v6) referenciados por uma única regra '-m set --match-set' por
+    família, e suas alterações são aplicadas com 'ipset restore'.
+    """
+
+    name = 'iptables'
+
+    def __init__(self):
+        super().__init__()
+        self.iptables_path = '/sbin/iptables'
+        self.ip6tables_path = '/sbin/ip6tables'
+        self.iptables_restore_path = '/sbin/iptables-restore'
+        self.ip6tables_restore_path = '/sbin/ip6tables-restore'
+        self.iptables_save_path = '/sbin/iptables-save'
+        self.ip6tables_save_path = '/sbin/ip6tables-save'
+        # Modo da whitelist: 'rules' (uma regra por IP) ou 'ipset' (sets hash:ip/hash:net)
+        self.whitelist_mode = 'rules'
+        self.ipset_path = '/sbin/ipset'
+        self.ipset_type = 'hash:net'
+        self.ipset_v4 = 'FIREWALL_LOGIN_ALLOW_V4'
+        self.ipset_v6 = 'FIREWALL_LOGIN_ALLOW_V6'
+
+    def configure(self, app):
+        super().configure(app)
+        self.iptables_path = app.config.get('IPTABLES_PATH', '/sbin/iptables')
+        self.ip6tables_path = app.config.get('IP6TABLES_PATH', '/sbin/ip6tables')
+        self.iptables_restore_path = app.config.get('IPTABLES_RESTORE_PATH', '/sbin/iptables-restore')
+        self.ip6tables_restore_path = app.config.get('IP6TABLES_RESTORE_PATH', '/sbin/ip6tables-restore')
+        self.iptables_save_path = app.config.get('IPTABLES_SAVE_PATH', '/sbin/iptables-save')
+        self.ip6tables_save_path = app.config.get('IP6TABLES_SAVE_PATH', '/sbin/ip6tables-save')
+        self.whitelist_mode = app.config.get('FIREWALL_WHITELIST_MODE', 'rules')
+        self.ipset_path = app.config.get('IPSET_PATH', '/sbin/ipset')
+        self.ipset_type = app.config.get('FIREWALL_IPSET_TYPE', 'hash:net')
+        self.ipset_v4 = app.config.get('FIREWALL_IPSET_V4', f'{self.chain_name}_V4')
+        self.ipset_v6 = app.config.get('FIREWALL_IPSET_V6', f'{self.chain_name}_V6')
+
+    def _use_ipset(self) -> bool:
+        """Indica se a whitelist está armazenada em ipsets"""
+        return self.whitelist_mode == 'ipset'
+
+    @property
+    def supports_timeouts(self) -> bool:
+        # Regras comuns do iptables não expiram; membros de ipset criado com 'timeout' sim
+        return self.session_timeouts and self._use_ipset()
+
+    def idempotent(self, tipo: str) -> bool:
+        # 'add/del -exist' do ipset são idempotentes; o -D de uma regra ausente falha o lote
+        return tipo == 'whitelist' and self._use_ipset()
+
+    def persist_targets(self, app) -> List[Tuple[List[str], str]]:
+        targets = [
+            ([self.iptables_save_path], app.config.get('IPTABLES_RULES_V4', '/etc/iptables/rules.v4')),
+            ([self.ip6tables_save_path], app.config.get('IPTABLES_RULES_V6', '/etc/iptables/rules.v6')),
+        ]
+        if self._use_ipset():
+            # Os sets precisam ser restaurados antes das regras que os referenciam
+            targets.append(([self.ipset_path, 'save'], app.config.get('IPSET_RULES', '/etc/iptables/ipsets')))
+        return targets
+
+    def setup(self) -> bool:
+        """Configura as regras base do firewall"""
+        # Criar chain personalizada se não existir (fora da transação: declarar
+        # uma chain existente no iptables-restore esvaziaria a whitelist)
+        for iptables_bin in (self.iptables_path, self.ip6tables_path):
+            result, output = self._run_command([iptables_bin, '-t', 'filter', '-N', self.chain_name])
+            if not result and "Chain already exists" not in output:
+                logger.warning(f"Falha ao criar chain {self.chain_name} com {iptables_bin}: {output}")
+
+        # Regras base da chain INPUT, aplicadas em uma única transação por família
+        base_rules = [
+            # Permitir tráfego de loopback
+            '-A INPUT -i lo -j ACCEPT',
+
+            # Permitir conexões estabelecidas e relacionadas
+            '-A INPUT -m state --state ESTABLISHED,RELATED -j ACCEPT',
+
+            # Permitir HTTPS (443) para todos (necessário para login)
+            '-A INPUT -p tcp --dport 443 -j ACCEPT',
+
+            # Permitir SSH apenas de IPs autorizados (opcional - configure conforme necessário)
+            # '-A INPUT -p tcp --dport 22 -s SEU_IP_ADMIN -j ACCEPT',
+
+            # Usar nossa chain personalizada
+            f'-A INPUT -j {self.chain_name}',
+
+            # Bloquear todo o resto por padrão
+            '-A INPUT -j DROP',
+        ]
+
+        success = True
+        for restore_bin in (self.iptables_restore_path, self.ip6tables_restore_path):
+            result, output = self._run_restore(restore_bin, base_rules)
+            if not result:
+                logger.warning(f"Falha ao aplicar regras base com {restore_bin}: {output}")
+                # Não marcar como falha total, algumas regras podem já existir
+
+        if self._use_ipset():
+            success = self._setup_ipsets()
+
+        return success
+
+    def _setup_ipsets(self) -> bool:
+        """Cria os ipsets da whitelist e a regra única que os referencia"""
+        logger.info(f"Configurando ipsets da whitelist: {self.ipset_v4}, {self.ipset_v6}")
+
+        success = True
+        for set_name, family, iptables_bin in [
+            (self.ipset_v4, 'inet', self.iptables_path),
+            (self.ipset_v6, 'inet6', self.ip6tables_path),
+        ]:
+            # Criar set se não existir (-exist evita erro quando já existe).
+            # 'timeout 0' habilita prazo por membro sem impor um prazo padrão
+            command = [self.ipset_path, 'create', set_name, self.ipset_type, 'family', family]
+            if self.supports_timeouts:
+                command += ['timeout', '0']
+            result, output = self._run_command(command + ['-exist'])
+            if not result:
+                logger.error(f"Falha ao criar ipset {set_name}: {output}")
+                if self.supports_timeouts:
+                    logger.error(
+                        f"Um ipset {set_name} criado sem suporte a timeout precisa ser recriado "
+                        f"(ou defina FIREWALL_SESSION_TIMEOUTS=false)"
+                    )
+                success = False
+                continue
+
+            # Uma única regra por família, independente do número de IPs liberados
+            match_rule = ['-m', 'set', '--match-set', set_name, 'src', '-j', 'ACCEPT']
+            exists, _ = self._run_command([iptables_bin, '-C', self.chain_name] + match_rule)
+            if not exists:
+                result, output = self._run_command([iptables_bin, '-A', self.chain_name] + match_rule)
+                if not result:
+                    logger.error(f"Falha ao referenciar ipset {set_name} na chain {self.chain_name}: {output}")
+                    success = False
+
+        return success
+
+    def _run_restore(self, restore_bin: str, rule_lines: List[str]) -> Tuple[bool, str]:
+        """Aplica linhas de regra na tabela filter via *-restore --noflush (atômico)"""
+        payload = '*filter\n' + '\n'.join(rule_lines) + '\nCOMMIT\n'
+        return self._run_command([restore_bin, '--noflush'], input_data=payload)
+
+    def _build_rule_line(self, action: str, tipo: str, address: str) -> str:
+        """Monta a linha de regra no formato do iptables-save"""
+        flag = '-A' if action == 'add' else '-D'
+        if tipo == 'blacklist':
+            return f'{flag} {self.blacklist_chain} -s {address} -j DROP'
+        return f'{flag} {self.chain_name} -s {address} -j ACCEPT'
+
+    def apply(self, changes: List[RuleChange]) -> Tuple[bool, List[RuleChange]]:
+        """Aplica o lote com uma invocação de iptables-restore, ip6tables-restore e ipset restore"""
+        lines: Dict[object, List[str]] = {'ipset': [], 4: [], 6: []}
+        grouped: Dict[object, List[RuleChange]] = {'ipset': [], 4: [], 6: []}
+
+        for change in changes:
+            address = format_network(change.network)
+            if change.tipo == 'whitelist' and self._use_ipset():
+                group = 'ipset'
+                set_name = self.ipset_v6 if change.network.version == 6 else self.ipset_v4
+                if change.action == 'add':
+                    # Com -exist, adicionar um membro existente renova o timeout
+                    timeout = f' timeout {change.timeout}' if change.timeout is not None and self.supports_timeouts else ''
+                    lines[group].append(f'add {set_name} {address}{timeout} -exist')
+                else:
+                    lines[group].append(f'del {set_name} {address} -exist')
+            else:
+                group = change.network.version
+                lines[group].append(self._build_rule_line(change.action, change.tipo, address))
+            grouped[group].append(change)
+
+        success = True
+        applied: List[RuleChange] = []
+        restore_bins = {4: self.iptables_restore_path, 6: self.ip6tables_restore_path}
+        for group, group_lines in lines.items():
+            if not group_lines:
+                continue
+            if group == 'ipset':
+                result, output = self._run_command(
+                    [self.ipset_path, 'restore', '-exist'],
+                    input_data='\n'.join(group_lines) + '\n'
+                )
+            else:
+                result, output = self._run_restore(restore_bins[group], group_lines)
+
+            if result:
+                applied.extend(grouped[group])
+            else:
+                label = 'ipset' if group == 'ipset' else f'IPv{group}'
+                logger.error(f"Falha ao aplicar transação {label} ({len(group_lines)} regras): {output}")
+                success = False
+
+        return success, applied
+
+    def iter_rules(self, family: int) -> Iterator[RuleRecord]:
+        """Itera as regras da tabela filter de uma família a partir do iptables-save"""
+        save_bin = self.ip6tables_save_path if family == 6 else self.iptables_save_path
+        return parse_save_lines(self._stream_command([save_bin, '-t', 'filter']), family)
+
+    def read_rules(self, chains: Optional[Iterable[str]] = None) -> Tuple[bool, List[RuleRecord]]:
+        """Lê as regras das duas famílias em paralelo
+
+        Apenas as regras das chains informadas são mantidas em memória.
+        Retorna (sucesso, regras); sucesso é False se alguma leitura falhou.
+        """
+        chains = set(chains) if chains is not None else None
+
+        def read_family(family: int) -> Tuple[bool, List[RuleRecord]]:
+            try:
+                records = [
+                    record for record in self.iter_rules(family)
+                    if chains is None or record.chain in chains
+                ]
+                return True, records
+            except subprocess.CalledProcessError as e:
+                logger.error(f"Falha ao ler regras IPv{family}: {(e.stderr or '').strip()}")
+            except Exception as e:
+                logger.error(f"Erro ao ler regras IPv{family}: {str(e)}")
+            return False, []
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(read_family, (4, 6)))
+
+        success = all(result for result, _ in results)
+        records = [record for _, family_records in results for record in family_records]
+        return success, records
+
+    def _list_ipset_members(self) -> List[str]:
+        """Lista os membros dos ipsets da whitelist (v4 e v6)"""
+        members = []
+        for set_name in (self.ipset_v4, self.ipset_v6):
+            success, output = self._run_command([self.ipset_path, 'save', set_name])
+            if success:
+                members.extend(self._parse_ipset_output(output, set_name))
+        return members
+
+    def _parse_ipset_output(self, output: str, set_name: str) -> List[str]:
+        """Extrai membros da saída do 'ipset save' (linhas 'add SET MEMBRO ...')"""
+        members = []
+        for line in output.split('\n'):
+            parts = line.split()
+            if len(parts) >= 3 and parts[0] == 'add' and parts[1] == set_name:
+                members.append(parts[2])
+        return members
+
+    def read_state(self) -> Tuple[bool, List[Tuple[str, Network]]]:
+        """Lê as regras simples '-A CHAIN -s REDE -j ALVO' das chains gerenciadas"""
+        success, records = self.read_rules([self.chain_name, self.blacklist_chain])
+        entries = [
+            ('blacklist' if record.chain == self.blacklist_chain else 'whitelist', record.source)
+            for record in records
+            if record.source is not None and not record.matches
+        ]
+
+        if self._use_ipset():
+            for member in self._list_ipset_members():
+                try:
+                    entries.append(('whitelist', to_network(member)))
+                except ValueError:
+                    logger.warning(f"Membro inválido ignorado no ipset: {member}")
+
+        return success, entries
+
+    def flush(self, tipo: str = 'whitelist') -> bool:
+        if tipo == 'whitelist' and self._use_ipset():
+            # A regra de match do set permanece; apenas os membros são removidos
+            commands = [
+                [self.ipset_path, 'flush', self.ipset_v4],
+                [self.ipset_path, 'flush', self.ipset_v6]
+            ]
+        else:
+            chain = self.blacklist_chain if tipo == 'blacklist' else self.chain_name
+            commands = [
+                [self.iptables_path, '-F', chain],
+                [self.ip6tables_path, '-F', chain]
+            ]
+
+        success = True
+        for command in commands:
+            result, output = self._run_command(command)
+            if not result:
+                success = False
+                logger.error(f"Falha ao limpar chain: {' '.join(command)}")
+        return success
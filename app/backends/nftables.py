@@ -0,0 +1,239 @@
+"""
+Backend nftables nativo (tabela inet única com sets nomeados)
+"""
+import json
+import logging
+import ipaddress
+from typing import List, Tuple
+
+from app.backends.base import FirewallBackend, RuleChange
+from app.ruleset import Network, format_network, to_network
+
+logger = logging.getLogger(__name__)
+
+
+class NftablesBackend(FirewallBackend):
+    """Aplica as regras diretamente no nftables, sem a camada de tradução do iptables
+
+    Uma única tabela 'inet' cobre IPv4 e IPv6. Whitelist e blacklist são
+    sets nomeados referenciados por regras fixas da chain de entrada;
+    liberar ou bloquear um IP é apenas adicionar um elemento ao set. Cada
+    lote é enviado como um único script 'nft -f -', aplicado atomicamente.
+
+    IPs simples e redes ficam em sets separados (por tipo e família): os
+    IPs em um set de endereços exatos, as redes em um set com flag
+    interval. Assim um IP dentro de uma rede liberada não conflita com ela,
+    cada elemento mantém o próprio timeout e remover um não afeta o outro.
+    Os sets não usam auto-merge, que fundiria os elementos e tornaria
+    impossível removê-los individualmente.
+    """
+
+    name = 'nftables'
+
+    def __init__(self):
+        super().__init__()
+        self.nft_path = '/usr/sbin/nft'
+        self.table = 'firewall_login'
+
+    def configure(self, app):
+        super().configure(app)
+        self.nft_path = app.config.get('NFT_PATH', '/usr/sbin/nft')
+        self.table = app.config.get('FIREWALL_NFT_TABLE', 'firewall_login')
+
+    @property
+    def supports_timeouts(self) -> bool:
+        # Os sets são criados com a flag timeout
+        return self.session_timeouts
+
+    def idempotent(self, tipo: str) -> bool:
+        # Cada remoção é precedida de um 'add element' (ver apply)
+        return True
+
+    @staticmethod
+    def _set_name(tipo: str, version: int, kind: str) -> str:
+        """Nome do set para o tipo de regra, o formato ('ip' ou 'net') e a família"""
+        return f"{'blacklist' if tipo == 'blacklist' else 'whitelist'}_{kind}_v{version}"
+
+    def _set_for(self, tipo: str, network: Network) -> str:
+        """Set que guarda a rede: IP simples no set exato, demais no set de intervalos"""
+        return self._set_name(tipo, network.version, 'ip' if network.num_addresses == 1 else 'net')
+
+    def _set_names(self):
+        """Todos os sets gerenciados: (tipo, versão, formato, nome)"""
+        return [
+            (tipo, version, kind, self._set_name(tipo, version, kind))
+            for tipo in ('whitelist', 'blacklist')
+            for version in (4, 6)
+            for kind in ('ip', 'net')
+        ]
+
+    def persist_targets(self, app) -> List[Tuple[List[str], str]]:
+        return [
+            ([self.nft_path, 'list', 'table', 'inet', self.table],
+             app.config.get('FIREWALL_NFT_RULES', '/etc/nftables.d/firewall_login.nft')),
+        ]
+
+    def _run_script(self, lines: List[str]) -> Tuple[bool, str]:
+        """Executa um script nft em uma única transação atômica"""
+        return self._run_command([self.nft_path, '-f', '-'], input_data='\n'.join(lines) + '\n')
+
+    def setup(self) -> bool:
+        """Cria tabela, sets e chain de entrada com as regras base"""
+        table = f'inet {self.table}'
+        lines = [f'add table {table}']
+        for tipo, version, kind, set_name in self._set_names():
+            flags = 'interval, timeout' if kind == 'net' else 'timeout'
+            lines.append(f'add set {table} {set_name} {{ type ipv{version}_addr; flags {flags}; }}')
+        lines += [
+            f'add chain {table} input {{ type filter hook input priority 0; policy drop; }}',
+            # Recriar apenas as regras fixas; o conteúdo dos sets é preservado
+            f'flush chain {table} input',
+            # Permitir tráfego de loopback
+            f'add rule {table} input iif lo accept',
+            # Permitir conexões estabelecidas e relacionadas
+            f'add rule {table} input ct state established,related accept',
+            # Blacklist antes de qualquer liberação
+            f'add rule {table} input ip saddr @blacklist_ip_v4 drop',
+            f'add rule {table} input ip saddr @blacklist_net_v4 drop',
+            f'add rule {table} input ip6 saddr @blacklist_ip_v6 drop',
+            f'add rule {table} input ip6 saddr @blacklist_net_v6 drop',
+            # Permitir HTTPS (443) para todos (necessário para login)
+            f'add rule {table} input tcp dport 443 accept',
+            # IPs liberados pelo login
+            f'add rule {table} input ip saddr @whitelist_ip_v4 accept',
+            f'add rule {table} input ip saddr @whitelist_net_v4 accept',
+            f'add rule {table} input ip6 saddr @whitelist_ip_v6 accept',
+            f'add rule {table} input ip6 saddr @whitelist_net_v6 accept',
+        ]
+
+        success, output = self._run_script(lines)
+        if not success:
+            logger.error(f"Falha ao configurar tabela nftables {self.table}: {output}")
+        return success
+
+    def apply(self, changes: List[RuleChange]) -> Tuple[bool, List[RuleChange]]:
+        """Aplica o lote inteiro (v4 e v6) em um único 'nft -f -'
+
+        'add element' não altera um elemento existente e 'delete element'
+        falha se ele não existir (por exemplo, se já expirou). Por isso cada
+        remoção e cada renovação de timeout é precedida de um 'add' que
+        garante a existência do elemento; como o script é atômico, o estado
+        intermediário nunca é visível.
+
+        Redes que se sobrepõem a outra rede do mesmo set seriam rejeitadas
+        pelo nft e derrubariam o lote inteiro: são ignoradas e registradas
+        no log (ver _skip_overlapping), e o restante do lote é aplicado.
+        """
+        changes, absent = self._skip_overlapping(changes)
+        lines = []
+        for change in changes:
+            prefix = f'inet {self.table} {self._set_for(change.tipo, change.network)}'
+            address = format_network(change.network)
+            if change.action == 'add' and (change.timeout is None or not self.supports_timeouts):
+                lines.append(f'add element {prefix} {{ {address} }}')
+                continue
+            lines.append(f'add element {prefix} {{ {address} }}')
+            lines.append(f'delete element {prefix} {{ {address} }}')
+            if change.action == 'add':
+                lines.append(f'add element {prefix} {{ {address} timeout {change.timeout}s }}')
+
+        if not lines:
+            return True, absent
+        success, output = self._run_script(lines)
+        if not success:
+            logger.error(f"Falha ao aplicar transação nftables ({len(lines)} elementos): {output}")
+            return False, []
+        return True, list(changes) + absent
+
+    def _skip_overlapping(self, changes: List[RuleChange]) -> Tuple[List[RuleChange], List[RuleChange]]:
+        """Separa as alterações de redes que o set de intervalos não aceitaria
+
+        Só consulta o kernel quando o lote altera redes (ações do painel
+        admin). Uma rede que se sobrepõe a outra já presente (ou adicionada
+        antes no mesmo lote) é ignorada; remover uma rede ausente não gera
+        comando, pois o 'add' que precede o 'delete' poderia conflitar.
+        Retorna (alterações a aplicar, remoções já refletidas sem comando).
+        """
+        if all(change.network.num_addresses == 1 for change in changes):
+            return changes, []
+        success, entries = self.read_state()
+        if not success:
+            return changes, []
+
+        present = {(tipo, network) for tipo, network in entries if network.num_addresses > 1}
+        kept, absent = [], []
+        for change in changes:
+            key = (change.tipo, change.network)
+            if change.network.num_addresses == 1:
+                kept.append(change)
+            elif change.action == 'remove':
+                if key in present:
+                    present.discard(key)
+                    kept.append(change)
+                else:
+                    absent.append(change)
+            elif key not in present and any(
+                tipo == change.tipo and network.version == change.network.version
+                and network.overlaps(change.network)
+                for tipo, network in present
+            ):
+                logger.error(
+                    f"Rede {format_network(change.network)} ({change.tipo}) sobreposta a outra rede "
+                    f"já presente no nftables: ignorada"
+                )
+            else:
+                present.add(key)
+                kept.append(change)
+        return kept, absent
+
+    @staticmethod
+    def _parse_element(element) -> List[Network]:
+        """Converte um elemento do 'nft -j' (IP, prefixo, intervalo ou elem com timeout) em redes"""
+        if isinstance(element, dict) and 'elem' in element:
+            element = element['elem'].get('val')
+        if isinstance(element, str):
+            return [to_network(element)]
+        if isinstance(element, dict) and 'prefix' in element:
+            prefix = element['prefix']
+            return [to_network(f"{prefix['addr']}/{prefix['len']}")]
+        if isinstance(element, dict) and 'range' in element:
+            start, end = (ipaddress.ip_address(value) for value in element['range'])
+            return list(ipaddress.summarize_address_range(start, end))
+        return []
+
+    def read_state(self) -> Tuple[bool, List[Tuple[str, Network]]]:
+        """Lê os elementos dos sets da tabela via 'nft -j list table'"""
+        success, output = self._run_command([self.nft_path, '-j', 'list', 'table', 'inet', self.table])
+        if not success:
+            return False, []
+        if not self.enabled:
+            return True, []
+
+        # Apenas os sets gerenciados (sets de versões anteriores são ignorados)
+        tipos = {set_name: tipo for tipo, _, _, set_name in self._set_names()}
+        entries = []
+        try:
+            for item in json.loads(output).get('nftables', []):
+                nft_set = item.get('set')
+                if not nft_set or nft_set.get('name') not in tipos:
+                    continue
+                tipo = tipos[nft_set['name']]
+                for element in nft_set.get('elem', []):
+                    for network in self._parse_element(element):
+                        entries.append((tipo, network))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Erro ao interpretar estado do nftables: {str(e)}")
+            return False, []
+
+        return True, entries
+
+    def flush(self, tipo: str = 'whitelist') -> bool:
+        lines = [
+            f'flush set inet {self.table} {set_name}'
+            for set_tipo, _, _, set_name in self._set_names()
+            if set_tipo == tipo
+        ]
+        success, output = self._run_script(lines)
+        if not success:
+            logger.error(f"Falha ao limpar sets {tipo}: {output}")
+        return success
@@ -0,0 +1,114 @@
+"""
+Compilador da blacklist: deduplicação e agregação em CIDRs mínimos
+"""
+import ipaddress
+import logging
+import threading
+from typing import Dict, Hashable, Iterable, List, Set, Tuple
+
+from app.ruleset import Network, to_network
+
+logger = logging.getLogger(__name__)
+
+
+def collapse_networks(networks: Iterable[Network]) -> List[Network]:
+    """Agrega redes em CIDRs mínimos (IPv4 e IPv6 separadamente)
+
+    Endereços repetidos, redes contidas em outras e blocos adjacentes são
+    fundidos por ipaddress.collapse_addresses.
+    """
+    by_version: Dict[int, List[Network]] = {4: [], 6: []}
+    for network in networks:
+        by_version[network.version].append(network)
+    result = []
+    for version in (4, 6):
+        result.extend(ipaddress.collapse_addresses(by_version[version]))
+    return result
+
+
+class BlacklistCompiler:
+    """Mantém as entradas da blacklist por regra de origem e compila o set aplicado
+
+    Cada FirewallRule ativa do tipo blacklist (IP ou rede informada pelo
+    admin) é uma fonte. Uma rede é bloqueada enquanto houver ao menos uma
+    fonte que a referencie (contagem de referências), e o conjunto enviado
+    ao kernel é a agregação mínima de todas as redes referenciadas: remover
+    uma regra não reabre um intervalo ainda coberto por outra.
+    """
+
+    def __init__(self):
+        self._sources: Dict[Hashable, Network] = {}
+        self._refcount: Dict[Network, int] = {}
+        self._compiled: List[Network] = []
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def add(self, source: Hashable, value) -> bool:
+        """Registra a rede bloqueada pela fonte (id da FirewallRule)
+
+        Retorna False se o valor não for um IP/CIDR válido.
+        """
+        try:
+            network = to_network(value)
+        except ValueError:
+            logger.warning(f"Entrada inválida ignorada na blacklist: {value}")
+            return False
+
+        with self._lock:
+            if self._sources.get(source) == network:
+                return True
+            self.remove(source)
+            self._sources[source] = network
+            self._refcount[network] = self._refcount.get(network, 0) + 1
+            self._dirty = True
+        return True
+
+    def remove(self, source: Hashable):
+        """Remove a fonte; a rede continua bloqueada se outra fonte a referenciar"""
+        with self._lock:
+            network = self._sources.pop(source, None)
+            if network is None:
+                return
+            count = self._refcount[network] - 1
+            if count:
+                self._refcount[network] = count
+            else:
+                del self._refcount[network]
+            self._dirty = True
+
+    def load(self, sources: Iterable[Tuple[Hashable, str]]):
+        """Substitui todas as fontes (ex.: regras ativas lidas do banco)"""
+        with self._lock:
+            self._sources = {}
+            self._refcount = {}
+            self._dirty = True
+            for source, value in sources:
+                self.add(source, value)
+
+    def refcount(self, value) -> int:
+        """Número de fontes que referenciam exatamente esta rede"""
+        with self._lock:
+            return self._refcount.get(to_network(value), 0)
+
+    def covers(self, value) -> bool:
+        """Indica se o IP/rede está contido no set compilado"""
+        network = to_network(value)
+        return any(
+            compiled.version == network.version and network.subnet_of(compiled)
+            for compiled in self.compile()
+        )
+
+    def compile(self) -> List[Network]:
+        """Set mínimo de CIDRs que cobre todas as redes referenciadas"""
+        with self._lock:
+            if self._dirty:
+                self._compiled = collapse_networks(self._refcount)
+                self._dirty = False
+            return list(self._compiled)
+
+    def networks(self) -> Set[Network]:
+        return set(self.compile())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sources)
@@ -0,0 +1,280 @@
+"""
+Templates dos emails pré-compilados, renderizados pelos workers de entrega
+"""
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from typing import Dict, Tuple
+
+from jinja2 import Environment, StrictUndefined
+
+logger = logging.getLogger(__name__)
+
+# Assunto e corpo em texto são templates Jinja (sem escape de HTML); o corpo
+# HTML vem de templates/emails/. Só as variáveis listadas mudam a cada email.
+EmailType = namedtuple('EmailType', ['subject', 'html', 'text', 'variables'])
+
+EMAIL_TYPES = {
+    'confirmation': EmailType(
+        subject='[{{ app_name }}] Confirme seu email',
+        html='emails/confirmation.html',
+        text="""
+Olá!
+
+Obrigado por se registrar no {{ app_name }}.
+
+Para ativar sua conta, clique no link abaixo:
+{{ confirm_url }}
+
+Este link é válido por 1 hora.
+
+Se você não se registrou em nosso sistema, ignore este email.
+
+Atenciosamente,
+Equipe {{ app_name }}
+""",
+        variables=('confirm_url',)
+    ),
+    'welcome': EmailType(
+        subject='[{{ app_name }}] Bem-vindo! Sua conta foi ativada',
+        html='emails/welcome.html',
+        text="""
+Olá!
+
+Sua conta no {{ app_name }} foi ativada com sucesso!
+
+Agora você pode fazer login em nosso sistema e ter acesso seguro aos nossos serviços.
+
+Lembre-se:
+- Suas sessões são válidas por 24 horas
+- Seu IP será automaticamente liberado no firewall quando você fizer login
+- Sempre faça logout quando terminar de usar o sistema
+
+Para fazer login, acesse: {{ login_url }}
+
+Atenciosamente,
+Equipe {{ app_name }}
+""",
+        variables=('login_url',)
+    ),
+    'login_notification': EmailType(
+        subject='[{{ app_name }}] Login realizado em sua conta',
+        html='emails/login_notification.html',
+        text="""
+Olá!
+
+Um login foi realizado em sua conta do {{ app_name }}.
+
+Detalhes do login:
+- Data e hora: {{ login_time }}
+- IP: {{ ip_address }}
+- Navegador: {{ user_agent }}
+
+Se este login foi feito por você, pode ignorar este email.
+
+Se você não fez este login, entre em contato conosco imediatamente.
+
+Atenciosamente,
+Equipe {{ app_name }}
+""",
+        variables=('login_time', 'ip_address', 'user_agent')
+    ),
+    'password_reset': EmailType(
+        subject='[{{ app_name }}] Recuperação de senha',
+        html='emails/password_reset.html',
+        text="""
+Olá!
+
+Recebemos uma solicitação para redefinir a senha de sua conta no {{ app_name }}.
+
+Para redefinir sua senha, clique no link abaixo:
+{{ reset_url }}
+
+Este link é válido por 1 hora.
+
+Se você não solicitou a redefinição de senha, ignore este email.
+
+Atenciosamente,
+Equipe {{ app_name }}
+""",
+        variables=('reset_url',)
+    ),
+    'registration_received': EmailType(
+        subject='[{{ app_name }}] Registro recebido - Aguardando aprovação',
+        html='emails/registration_received.html',
+        text="""
+Olá, {{ user.email }}!
+
+Recebemos seu pedido de registro no {{ app_name }}.
+Seu cadastro está aguardando aprovação do administrador.
+Você receberá um email assim que for aprovado.
+
+Atenciosamente,
+Equipe {{ app_name }}
+""",
+        variables=('user',)
+    ),
+    'admin_new_registration': EmailType(
+        subject='[{{ app_name }}] Novo pedido de registro de usuário',
+        html='emails/admin_new_registration.html',
+        text="""
+Olá, administrador!
+
+Um novo pedido de registro foi realizado no {{ app_name }}.
+
+Email do usuário: {{ user.email }}
+Data/hora: {{ user.created_at }}
+
+Acesse o painel administrativo para aprovar ou rejeitar o cadastro.
+
+Atenciosamente,
+Equipe {{ app_name }}
+""",
+        variables=('user',)
+    ),
+    'rejection': EmailType(
+        subject='[{{ app_name }}] Cadastro Rejeitado',
+        html='emails/rejection.html',
+        text="""
+Olá, {{ user.email }}!
+
+Seu pedido de cadastro no {{ app_name }} foi analisado e infelizmente não foi aprovado.
+
+Se acredita que isso foi um engano, entre em contato com o administrador.
+
+Atenciosamente,
+Equipe {{ app_name }}
+""",
+        variables=('user',)
+    ),
+    'blacklist_user': EmailType(
+        subject='[{{ app_name }}] Sua conta/IP foi bloqueado (blacklist)',
+        html='emails/blacklist_user.html',
+        text="""
+Olá!
+
+Sua conta ou IP ({{ ip_address }}) foi bloqueado temporariamente devido a múltiplas tentativas de login incorretas.
+
+Se você acredita que isso foi um engano, entre em contato com o administrador do sistema.
+
+Atenciosamente,
+Equipe {{ app_name }}
+""",
+        variables=('ip_address',)
+    ),
+    'blacklist_admin': EmailType(
+        subject='[{{ app_name }}] Usuário/IP bloqueado (blacklist)',
+        html='emails/blacklist_admin.html',
+        text="""
+Atenção!
+
+O usuário {{ user.email }} e/ou o IP {{ ip_address }} foi colocado na blacklist após múltiplas tentativas de login incorretas.
+
+Verifique se há necessidade de intervenção manual.
+
+Atenciosamente,
+Sistema {{ app_name }}
+""",
+        variables=('user', 'ip_address')
+    ),
+    'admin_digest': EmailType(
+        subject='[{{ app_name }}] Resumo: {{ count }} {{ title }}',
+        html='emails/admin_digest.html',
+        text="""
+Olá, administrador!
+
+Resumo de {{ title }} no {{ app_name }} entre {{ since }} e {{ until }}: {{ count }} eventos.
+{% if top_ips %}
+IPs mais frequentes:
+{% for ip, total in top_ips %}- {{ ip }} ({{ total }})
+{% endfor %}{% endif %}
+Contas afetadas ({{ account_count }}):
+{% for email, total in accounts %}- {{ email }} ({{ total }})
+{% endfor %}{% if account_count > accounts|length %}... e mais {{ account_count - accounts|length }} contas.
+{% endif %}
+Acesse o painel administrativo para os detalhes.
+
+Atenciosamente,
+Sistema {{ app_name }}
+""",
+        variables=('title', 'count', 'since', 'until', 'top_ips', 'accounts', 'account_count')
+    ),
+}
+
+Rendered = namedtuple('Rendered', ['subject', 'text', 'html'])
+
+
+def _freeze(value):
+    """Chave imutável do contexto (dicionários aninhados viram tuplas ordenadas)"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class EmailRenderer:
+    """Templates dos emails compilados uma única vez, na inicialização
+
+    Para cada tipo, o assunto, o texto e o HTML (templates/emails/) são
+    compilados com as partes invariáveis (app_name, admin_email) já ligadas
+    como globais do template; a renderização recebe apenas as variáveis do
+    email (ex.: confirm_url, ip_address). O resultado fica em um cache LRU
+    por tipo (EMAIL_RENDER_CACHE_SIZE entradas), útil para emails repetidos
+    como avisos de blacklist. Os templates não são recarregados do disco:
+    alterações exigem reiniciar a aplicação.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.cache_size = 128
+        self._compiled: Dict[str, Tuple] = {}
+        self._cache: Dict[str, OrderedDict] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Compila os templates de todos os tipos de email"""
+        self.app = app
+        self.cache_size = app.config.get('EMAIL_RENDER_CACHE_SIZE', 128)
+        invariants = {
+            'app_name': app.config.get('APP_NAME'),
+            'admin_email': app.config.get('ADMIN_EMAIL', 'admin@localhost'),
+        }
+        # Texto e assunto sem escape de HTML; o HTML usa o ambiente do Flask (com escape)
+        text_env = Environment(autoescape=False, undefined=StrictUndefined, keep_trailing_newline=True)
+        self._compiled = {
+            name: (
+                text_env.from_string(email_type.subject, globals=invariants),
+                text_env.from_string(email_type.text, globals=invariants),
+                app.jinja_env.get_template(email_type.html, globals=invariants),
+            )
+            for name, email_type in EMAIL_TYPES.items()
+        }
+        self._cache = {name: OrderedDict() for name in EMAIL_TYPES}
+        logger.info(f"Templates de email compilados: {len(self._compiled)} tipos")
+
+    def render(self, name: str, context: dict) -> Rendered:
+        """Assunto, texto e HTML do email do tipo name com as variáveis do contexto"""
+        subject, text, html = self._compiled[name]
+        variables = {key: context[key] for key in EMAIL_TYPES[name].variables}
+        key = _freeze(variables)
+        cache = self._cache[name]
+        with self._lock:
+            rendered = cache.get(key)
+            if rendered is not None:
+                cache.move_to_end(key)
+                self.hits += 1
+                return rendered
+            self.misses += 1
+
+        rendered = Rendered(subject.render(variables).strip(), text.render(variables), html.render(variables))
+        if self.cache_size > 0:
+            with self._lock:
+                cache[key] = rendered
+                while len(cache) > self.cache_size:
+                    cache.popitem(last=False)
+        return rendered
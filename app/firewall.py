@@ -1,284 +1,413 @@
 """
-Módulo para gerenciamento do firewall iptables
+Módulo para gerenciamento do firewall
 """
-import subprocess
+import math
 import logging
-import ipaddress
-from typing import List, Tuple, Optional
-from flask import current_app
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Set, Tuple, Optional
+from app.backends import FirewallBackend, IptablesBackend, RuleChange, create_backend
+from app.blacklist import BlacklistCompiler
+from app.persistence import RulesetPersister
+from app.ruleset import RuleIndex, Network, to_network, format_network
 
 logger = logging.getLogger(__name__)
 
+
+def session_timeout(expires_at: datetime, now: Optional[datetime] = None) -> int:
+    """Tempo de vida restante (segundos, no mínimo 1) de uma sessão que vence em expires_at"""
+    now = now or datetime.utcnow()
+    return max(1, math.ceil((expires_at - now).total_seconds()))
+
+
+class FirewallTransaction:
+    """Agrupa adições e remoções de IPs para aplicação atômica no firewall
+    
+    As operações são acumuladas em memória e aplicadas no commit como um
+    único lote do backend (iptables-restore --noflush por família, ou um
+    único script nft).
+    """
+    
+    def __init__(self, manager):
+        self.manager = manager
+        self.operations: List[Tuple] = []
+        self.success: Optional[bool] = None
+    
+    def _queue(self, action: str, ip_address: str, tipo: str, timeout: Optional[int] = None):
+        operation = (action, tipo, ip_address) if timeout is None else (action, tipo, ip_address, timeout)
+        # Operações idênticas repetidas são aplicadas uma única vez
+        if operation not in self.operations:
+            self.operations.append(operation)
+    
+    def add_ip(self, ip_address: str, tipo: str = 'whitelist', timeout: Optional[int] = None):
+        """Agenda a liberação (whitelist) ou bloqueio (blacklist) de um IP
+        
+        Com timeout (segundos), a entrada expira sozinha no kernel quando o
+        backend suporta prazos; se o IP já estiver liberado, o prazo é renovado.
+        """
+        self._queue('add', ip_address, tipo, timeout)
+    
+    def remove_ip(self, ip_address: str, tipo: str = 'whitelist'):
+        """Agenda a remoção de um IP da whitelist ou blacklist"""
+        self._queue('remove', ip_address, tipo)
+    
+    def __len__(self):
+        return len(self.operations)
+    
+    def commit(self) -> bool:
+        """Aplica todas as operações agendadas"""
+        self.success = self.manager.apply_operations(self.operations)
+        self.operations = []
+        return self.success
+
 class FirewallManager:
-    """Gerenciador do firewall iptables"""
+    """Gerenciador do firewall
+    
+    Mantém o índice em memória, as transações e a sincronização com o banco;
+    a aplicação no kernel é delegada ao backend configurado em
+    FIREWALL_BACKEND (iptables, nftables ou fake).
+    
+    O kernel é compartilhado pelos workers do gunicorn e pelo processo que
+    executa o agendador, então o índice de um processo pode não refletir as
+    alterações feitas pelos outros. Só o processo auxiliar, único dono do
+    ruleset, marca o gerenciador como exclusive e confia no índice.
+    """
     
     def __init__(self):
         self.chain_name = 'FIREWALL_LOGIN_ALLOW'
-        self.iptables_path = '/sbin/iptables'
-        self.ip6tables_path = '/sbin/ip6tables'
+        self.blacklist_chain = 'BLACKLIST'
         self.enabled = True
+        self.backend: FirewallBackend = IptablesBackend()
+        self.persister = RulesetPersister()
+        # Índice em memória do que está aplicado no kernel
+        self.index = RuleIndex()
+        # True apenas quando nenhum outro processo altera as regras (processo auxiliar)
+        self.exclusive = False
+        self._apply_lock = threading.RLock()
+        self._index_fresh = False
+        # Fontes da blacklist (regras ativas) e o set compilado aplicado no kernel
+        self.blacklist = BlacklistCompiler()
     
     def configure(self, app):
         """Configura o gerenciador com as configurações da aplicação"""
         self.chain_name = app.config.get('FIREWALL_CHAIN', 'FIREWALL_LOGIN_ALLOW')
-        self.iptables_path = app.config.get('IPTABLES_PATH', '/sbin/iptables')
-        self.ip6tables_path = app.config.get('IP6TABLES_PATH', '/sbin/ip6tables')
+        self.blacklist_chain = app.config.get('FIREWALL_BLACK', 'BLACKLIST')
         self.enabled = app.config.get('FIREWALL_ENABLED', True)
+        self.backend = create_backend(app.config.get('FIREWALL_BACKEND', 'iptables'))
+        self.backend.configure(app)
+        self.index = RuleIndex()
+        logger.info(f"Backend do firewall: {self.backend.name}")
+        
+        # Persistência agrupada: no máximo uma gravação por janela
+        self.persister.configure(
+            self.backend.persist_targets(app),
+            interval=app.config.get('FIREWALL_SAVE_INTERVAL', 5.0),
+            enabled=self.enabled
+        )
     
-    def _run_command(self, command: List[str]) -> Tuple[bool, str]:
-        """Executa comando do sistema e retorna resultado"""
-        if not self.enabled:
-            logger.info(f"[SIMULAÇÃO - FIREWALL DESLIGADO] Comando: {' '.join(command)}")
-            return True, '[Simulação] Comando não executado.'
-        try:
-            result = subprocess.run(
-                command,
-                capture_output=True,
-                text=True,
-                timeout=30,
-                check=False
-            )
-            
-            if result.returncode == 0:
-                logger.info(f"Comando executado com sucesso: {' '.join(command)}")
-                return True, result.stdout.strip()
-            else:
-                logger.error(f"Erro ao executar comando: {' '.join(command)} - {result.stderr}")
-                return False, result.stderr.strip()
-                
-        except subprocess.TimeoutExpired:
-            logger.error(f"Timeout ao executar comando: {' '.join(command)}")
-            return False, "Timeout na execução do comando"
-        except Exception as e:
-            logger.error(f"Exceção ao executar comando: {' '.join(command)} - {str(e)}")
-            return False, str(e)
-    
-    def _get_iptables_binary(self, ip_address: str) -> str:
-        """Retorna o binário correto do iptables baseado no tipo de IP"""
-        try:
-            ip_obj = ipaddress.ip_address(ip_address)
-            if ip_obj.version == 6:
-                return self.ip6tables_path
-            else:
-                return self.iptables_path
-        except ValueError:
-            logger.error(f"Endereço IP inválido: {ip_address}")
-            return self.iptables_path
+    @property
+    def supports_timeouts(self) -> bool:
+        """Indica se a whitelist expira no kernel (ipset/nftables com timeout)"""
+        return self.backend.supports_timeouts
     
     def setup_firewall_base(self) -> bool:
         """Configura as regras base do firewall"""
-        logger.info("Configurando regras base do firewall")
-        
-        # Comandos para configurar firewall base
-        commands = [
-            # Criar chain personalizada se não existir
-            [self.iptables_path, '-t', 'filter', '-N', self.chain_name],
-            [self.ip6tables_path, '-t', 'filter', '-N', self.chain_name],
-            
-            # Permitir tráfego de loopback
-            [self.iptables_path, '-A', 'INPUT', '-i', 'lo', '-j', 'ACCEPT'],
-            [self.ip6tables_path, '-A', 'INPUT', '-i', 'lo', '-j', 'ACCEPT'],
-            
-            # Permitir conexões estabelecidas e relacionadas
-            [self.iptables_path, '-A', 'INPUT', '-m', 'state', '--state', 'ESTABLISHED,RELATED', '-j', 'ACCEPT'],
-            [self.ip6tables_path, '-A', 'INPUT', '-m', 'state', '--state', 'ESTABLISHED,RELATED', '-j', 'ACCEPT'],
-            
-            # Permitir HTTPS (443) para todos (necessário para login)
-            [self.iptables_path, '-A', 'INPUT', '-p', 'tcp', '--dport', '443', '-j', 'ACCEPT'],
-            [self.ip6tables_path, '-A', 'INPUT', '-p', 'tcp', '--dport', '443', '-j', 'ACCEPT'],
-            
-            # Permitir SSH apenas de IPs autorizados (opcional - configure conforme necessário)
-            # [self.iptables_path, '-A', 'INPUT', '-p', 'tcp', '--dport', '22', '-s', 'SEU_IP_ADMIN', '-j', 'ACCEPT'],
-            
-            # Usar nossa chain personalizada
-            [self.iptables_path, '-A', 'INPUT', '-j', self.chain_name],
-            [self.ip6tables_path, '-A', 'INPUT', '-j', self.chain_name],
-            
-            # Bloquear todo o resto por padrão
-            [self.iptables_path, '-A', 'INPUT', '-j', 'DROP'],
-            [self.ip6tables_path, '-A', 'INPUT', '-j', 'DROP'],
-        ]
-        
-        success = True
-        for command in commands:
-            result, output = self._run_command(command)
-            # Ignorar erro se chain já existir
-            if not result and "Chain already exists" not in output:
-                logger.warning(f"Falha ao executar comando de configuração base: {' '.join(command)}")
-                # Não marcar como falha total, algumas regras podem já existir
-        
+        logger.info(f"Configurando regras base do firewall ({self.backend.name})")
+        success = self.backend.setup()
         logger.info("Configuração base do firewall concluída")
         return success
     
-    def add_ip_to_firewall(self, ip_address: str) -> bool:
-        """Adiciona IP às regras de permissão do firewall"""
-        logger.info(f"Adicionando IP {ip_address} ao firewall")
-        
+    def _apply_single(self, action: str, tipo: str, ip_address: str) -> bool:
+        """Aplica uma única operação validando o IP antes"""
         try:
-            # Validar IP
-            ip_obj = ipaddress.ip_address(ip_address)
-            iptables_bin = self._get_iptables_binary(ip_address)
-            
-            # Comando para adicionar IP
-            command = [
-                iptables_bin, '-A', self.chain_name,
-                '-s', ip_address,
-                '-j', 'ACCEPT'
-            ]
-            
-            success, output = self._run_command(command)
-            
-            if success:
-                logger.info(f"IP {ip_address} adicionado com sucesso ao firewall")
-                self._save_iptables_rules()
-                return True
-            else:
-                logger.error(f"Falha ao adicionar IP {ip_address}: {output}")
-                return False
-                
+            to_network(ip_address)
         except ValueError as e:
             logger.error(f"IP inválido {ip_address}: {str(e)}")
             return False
-        except Exception as e:
-            logger.error(f"Erro ao adicionar IP {ip_address}: {str(e)}")
-            return False
+        return self.apply_operations([(action, tipo, ip_address)])
+    
+    def add_ip_to_firewall(self, ip_address: str) -> bool:
+        """Adiciona IP às regras de permissão do firewall"""
+        logger.info(f"Adicionando IP {ip_address} ao firewall")
+        return self._apply_single('add', 'whitelist', ip_address)
     
     def remove_ip_from_firewall(self, ip_address: str) -> bool:
         """Remove IP das regras de permissão do firewall"""
         logger.info(f"Removendo IP {ip_address} do firewall")
-        
-        try:
-            # Validar IP
-            ip_obj = ipaddress.ip_address(ip_address)
-            iptables_bin = self._get_iptables_binary(ip_address)
-            
-            # Comando para remover IP
-            command = [
-                iptables_bin, '-D', self.chain_name,
-                '-s', ip_address,
-                '-j', 'ACCEPT'
-            ]
-            
-            success, output = self._run_command(command)
-            
-            if success:
-                logger.info(f"IP {ip_address} removido com sucesso do firewall")
-                self._save_iptables_rules()
-                return True
-            else:
-                # Verificar se regra não existe (não é erro crítico)
-                if "No chain/target/match" in output or "does not exist" in output:
-                    logger.warning(f"Regra para IP {ip_address} não encontrada no firewall")
-                    return True
-                else:
-                    logger.error(f"Falha ao remover IP {ip_address}: {output}")
-                    return False
-                    
-        except ValueError as e:
-            logger.error(f"IP inválido {ip_address}: {str(e)}")
-            return False
-        except Exception as e:
-            logger.error(f"Erro ao remover IP {ip_address}: {str(e)}")
-            return False
+        return self._apply_single('remove', 'whitelist', ip_address)
     
     def list_allowed_ips(self) -> List[str]:
         """Lista todos os IPs permitidos no firewall"""
         try:
-            allowed_ips = []
-            
-            # Listar regras IPv4
-            command_v4 = [self.iptables_path, '-L', self.chain_name, '-n']
-            success, output = self._run_command(command_v4)
-            
-            if success:
-                allowed_ips.extend(self._parse_iptables_output(output))
-            
-            # Listar regras IPv6
-            command_v6 = [self.ip6tables_path, '-L', self.chain_name, '-n']
-            success, output = self._run_command(command_v6)
-            
-            if success:
-                allowed_ips.extend(self._parse_iptables_output(output))
-            
-            return allowed_ips
+            _, entries = self.backend.read_state()
+            return [format_network(network) for tipo, network in entries if tipo == 'whitelist']
             
         except Exception as e:
             logger.error(f"Erro ao listar IPs permitidos: {str(e)}")
             return []
     
-    def _parse_iptables_output(self, output: str) -> List[str]:
-        """Extrai IPs das regras do iptables"""
-        ips = []
-        lines = output.split('\n')
+    def _save_iptables_rules(self) -> bool:
+        """Agenda a gravação das regras para persistir após reboot
+        
+        A gravação é agrupada pelo RulesetPersister: várias alterações dentro
+        da janela FIREWALL_SAVE_INTERVAL resultam em um único dump.
+        """
+        try:
+            self.persister.mark_dirty()
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao agendar gravação das regras do firewall: {str(e)}")
+            return False
+    
+    def flush_saved_rules(self) -> bool:
+        """Grava imediatamente as alterações pendentes do ruleset"""
+        return self.persister.flush()
+
+    @contextmanager
+    def transaction(self):
+        """Context manager que agrupa alterações e as aplica atomicamente na saída
         
-        for line in lines:
-            if 'ACCEPT' in line and line.strip():
-                parts = line.split()
-                if len(parts) >= 4:
-                    source = parts[3]  # Campo source
-                    if source != '0.0.0.0/0' and source != '::/0' and source != 'anywhere':
-                        ips.append(source)
+        Exemplo:
+            with firewall_manager.transaction() as tx:
+                tx.add_ip('192.0.2.10')
+                tx.remove_ip('192.0.2.20')
+            if not tx.success: ...
         
-        return ips
+        Se o bloco levantar exceção, nenhuma operação é aplicada.
+        """
+        tx = FirewallTransaction(self)
+        yield tx
+        tx.commit()
     
-    def _save_iptables_rules(self) -> bool:
-        """Salva as regras do iptables para persistir após reboot"""
-        if not self.enabled:
-            logger.info("[SIMULAÇÃO - FIREWALL DESLIGADO] Salvando regras do firewall (simulado)")
+    def _chain_for(self, tipo: str) -> str:
+        """Chain (chave do índice) usada para o tipo de regra"""
+        return self.blacklist_chain if tipo == 'blacklist' else self.chain_name
+    
+    def rehydrate_index(self) -> bool:
+        """Reconstrói o índice em memória a partir do estado lido pelo backend"""
+        logger.info("Reconstruindo índice de regras a partir do firewall")
+        
+        success, entries = self.backend.read_state()
+        self.index.replace((self._chain_for(tipo), network) for tipo, network in entries)
+        logger.info(f"Índice de regras reconstruído: {len(self.index)} entradas")
+        return success
+    
+    def _ensure_index(self, fresh: bool = False):
+        """Reidrata o índice na primeira utilização ou após divergência
+        
+        Com backend remoto o índice autoritativo é o do processo auxiliar
+        (compartilhado entre os workers), então ele é sempre relido. Com
+        fresh, o índice também é relido sempre que o kernel é compartilhado
+        com outros processos (gerenciador não exclusivo).
+        """
+        if self.backend.remote or not self.index.loaded:
+            self.rehydrate_index()
+        elif fresh and not self.exclusive and not self._index_fresh:
+            self.rehydrate_index()
+    
+    @contextmanager
+    def _fresh_index(self):
+        """Relê o índice e o usa sem nova leitura até o fim do bloco (com o lock)"""
+        with self._apply_lock:
+            self._ensure_index(fresh=True)
+            self._index_fresh = True
+            try:
+                yield
+            finally:
+                self._index_fresh = False
+    
+    def apply_operations(self, operations: List[Tuple]) -> bool:
+        """Aplica uma lista de operações (acao, tipo, ip[, timeout]) em lote
+        
+        As operações são comparadas com o índice em memória: adicionar um IP
+        já presente ou remover um IP ausente não gera comando, exceto a adição
+        com timeout, que renova o prazo da entrada no kernel. Sem exclusividade
+        o índice não decide sozinho: operações idempotentes no backend são
+        sempre enviadas e, para as demais, o índice é relido do kernel antes
+        da comparação. O restante é
+        entregue ao backend como um único lote (uma invocação de *-restore
+        por família, ou um único 'nft -f -'). Uma falha indica divergência
+        entre índice e kernel, e o índice é reconstruído no próximo uso.
+        """
+        if not operations:
             return True
-        try:
-            # Para Ubuntu/Debian, usar iptables-save
-            commands = [
-                'iptables-save > /etc/iptables/rules.v4',
-                'ip6tables-save > /etc/iptables/rules.v6'
-            ]
+        
+        if self.backend.remote:
+            # O processo auxiliar filtra pelo índice dele e funde lotes concorrentes
+            success, results = self.backend.apply_operations(operations)
+            logger.info(
+                f"Transação do firewall enviada ao processo auxiliar: {len(operations)} operações, "
+                f"{sum(1 for result in results if result)} aplicadas, sucesso={success}"
+            )
+            return success
+        
+        with self._apply_lock:
+            self._ensure_index(fresh=any(not self.backend.idempotent(operation[1]) for operation in operations))
             
-            for command in commands:
-                result = subprocess.run(
-                    command,
-                    shell=True,
-                    capture_output=True,
-                    text=True,
-                    timeout=10
-                )
+            # Estado resultante de cada (chain, rede) ao longo do lote
+            present: Dict[Tuple[str, Network], bool] = {}
+            changes: List[RuleChange] = []
+            
+            for operation in operations:
+                action, tipo, ip_address = operation[:3]
+                timeout = operation[3] if len(operation) > 3 and self.supports_timeouts else None
+                try:
+                    network = to_network(ip_address)
+                except ValueError as e:
+                    logger.error(f"IP inválido ignorado na transação {ip_address}: {str(e)}")
+                    continue
                 
-                if result.returncode != 0:
-                    logger.warning(f"Falha ao salvar regras: {command} - {result.stderr}")
+                chain = self._chain_for(tipo)
+                key = (chain, network)
+                if key in present:
+                    is_present = present[key]
+                elif self.exclusive or not self.backend.idempotent(tipo):
+                    is_present = self.index.contains(chain, network)
+                else:
+                    # Outro processo pode ter alterado a entrada: enviar mesmo assim
+                    is_present = None
+                if (action == 'add') == is_present and timeout is None:
+                    continue
+                present[key] = action == 'add'
+                changes.append(RuleChange(action, tipo, network, timeout))
             
-            logger.info("Regras do firewall salvas")
-            return True
+            if not changes:
+                logger.info(f"Transação do firewall sem alterações ({len(operations)} operações já refletidas)")
+                return True
             
-        except Exception as e:
-            logger.error(f"Erro ao salvar regras do firewall: {str(e)}")
-            return False
+            success, applied = self.backend.apply(changes)
+            for change in applied:
+                if change.action == 'add':
+                    self.index.add(self._chain_for(change.tipo), change.network, change.timeout)
+                else:
+                    self.index.discard(self._chain_for(change.tipo), change.network)
+            
+            if not success:
+                # Divergência entre índice e kernel: reconstruir no próximo uso
+                self.index.invalidate()
+            
+            logger.info(f"Transação do firewall aplicada: {len(operations)} operações, sucesso={success}")
+            if applied:
+                self._save_iptables_rules()
+            return success
     
-    def sync_database_with_firewall(self):
-        """Sincroniza regras do banco de dados com o firewall"""
+    def _stage_diff(self, tx: FirewallTransaction, tipo: str, networks: Set[Network],
+                    timeouts: Optional[Dict[Network, Optional[int]]] = None):
+        """Agenda na transação a diferença entre as redes desejadas e o índice"""
+        timeouts = timeouts or {}
+        current = self.index.networks(self._chain_for(tipo))
+        # No firewall mas não no banco - remover
+        for network in current - networks:
+            logger.info(f"Removendo IP órfão do firewall ({tipo}): {network}")
+            tx.remove_ip(format_network(network), tipo=tipo)
+        # No banco mas não no firewall - adicionar
+        for network in networks - current:
+            logger.info(f"Adicionando IP ausente no firewall ({tipo}): {network}")
+            tx.add_ip(format_network(network), tipo=tipo, timeout=timeouts.get(network))
+    
+    def apply_blacklist(self) -> bool:
+        """Recompila a blacklist a partir das regras ativas no banco e aplica a diferença
+        
+        Uma única consulta; as entradas enviadas ao kernel são as do set
+        compilado, então uma regra removida só libera o que nenhuma outra
+        regra ativa ainda cobre.
+        """
         from app.models import FirewallRule, db
         
+        sources = db.session.query(FirewallRule.id, FirewallRule.ip_address).filter(
+            FirewallRule.is_active == True,
+            FirewallRule.tipo == 'blacklist'
+        ).all()
+        self.blacklist.load(sources)
+        
+        with self._fresh_index():
+            with self.transaction() as tx:
+                self._stage_diff(tx, 'blacklist', self.blacklist.networks())
+        logger.info(
+            f"Blacklist compilada: {len(self.blacklist)} regras em {len(self.blacklist.networks())} redes "
+            f"(sucesso={tx.success})"
+        )
+        return tx.success
+    
+    def sync_database_with_firewall(self):
+        """Sincroniza regras do banco de dados com o firewall
+        
+        Calcula a diferença mínima entre as regras ativas no banco (uma
+        única consulta) e o índice relido do kernel, e a aplica em um único lote.
+        Se o lote falhar, o índice é reconstruído a partir do kernel e a
+        diferença é recalculada uma vez.
+        
+        Quando a whitelist expira no kernel, regras de sessões vencidas não
+        são reaplicadas e as ausentes são adicionadas com o tempo restante
+        da sessão mais longa do IP.
+        """
+        from app.models import FirewallRule, UserSession, db
+        
         logger.info("Sincronizando regras do banco com firewall")
         
         try:
-            # Buscar regras ativas no banco
-            active_rules = FirewallRule.query.filter_by(is_active=True).all()
-            firewall_ips = set(self.list_allowed_ips())
-            database_ips = set(rule.ip_address for rule in active_rules)
+            # Buscar regras ativas no banco (com o vencimento da sessão, se houver)
+            active_rules = db.session.query(
+                FirewallRule.id,
+                FirewallRule.ip_address,
+                FirewallRule.tipo,
+                FirewallRule.iptables_rule_added,
+                UserSession.expires_at
+            ).outerjoin(UserSession, FirewallRule.session_id == UserSession.id).filter(
+                FirewallRule.is_active == True
+            ).all()
+            
+            now = datetime.utcnow()
+            desired: Dict[str, set] = {'whitelist': set(), 'blacklist': set()}
+            timeouts: Dict[Network, Optional[int]] = {}
+            blacklist_sources = []
+            for rule in active_rules:
+                if rule.tipo not in desired:
+                    continue
+                if rule.tipo == 'blacklist':
+                    blacklist_sources.append((rule.id, rule.ip_address))
+                    continue
+                try:
+                    network = to_network(rule.ip_address)
+                except ValueError:
+                    logger.warning(f"IP inválido ignorado na sincronização: {rule.ip_address}")
+                    continue
+                
+                if self.supports_timeouts and rule.tipo == 'whitelist':
+                    if rule.expires_at is None:
+                        # Regra sem sessão (painel admin): permanente
+                        timeouts[network] = None
+                    elif rule.expires_at > now:
+                        # Prevalece a sessão mais longa; regra permanente não ganha prazo
+                        if network not in timeouts or timeouts[network] is not None:
+                            timeouts[network] = max(timeouts.get(network) or 0, session_timeout(rule.expires_at, now))
+                    else:
+                        # Sessão vencida: o kernel já descartou a entrada
+                        continue
+                desired[rule.tipo].add(network)
+            
+            # Blacklist aplicada é o set compilado (deduplicado e agregado em CIDRs)
+            self.blacklist.load(blacklist_sources)
+            desired['blacklist'] = self.blacklist.networks()
             
-            # IPs no firewall mas não no banco - remover
-            orphaned_ips = firewall_ips - database_ips
-            for ip in orphaned_ips:
-                logger.info(f"Removendo IP órfão do firewall: {ip}")
-                self.remove_ip_from_firewall(ip)
+            for attempt in range(2):
+                with self._fresh_index():
+                    with self.transaction() as tx:
+                        for tipo, networks in desired.items():
+                            self._stage_diff(tx, tipo, networks, timeouts)
+                if tx.success:
+                    break
+                logger.warning("Divergência entre índice e firewall detectada, recalculando diferença")
             
-            # IPs no banco mas não no firewall - adicionar
-            missing_ips = database_ips - firewall_ips
-            for ip in missing_ips:
-                logger.info(f"Adicionando IP ausente no firewall: {ip}")
-                if self.add_ip_to_firewall(ip):
-                    # Marcar como adicionado no banco
-                    rule = FirewallRule.query.filter_by(ip_address=ip, is_active=True).first()
-                    if rule:
-                        rule.iptables_rule_added = True
+            if tx.success:
+                # Marcar como adicionado no banco
+                pending_ids = [rule.id for rule in active_rules if not rule.iptables_rule_added]
+                if pending_ids:
+                    FirewallRule.query.filter(FirewallRule.id.in_(pending_ids)).update(
+                        {FirewallRule.iptables_rule_added: True},
+                        synchronize_session=False
+                    )
             
             db.session.commit()
             logger.info("Sincronização concluída")
@@ -288,73 +417,16 @@ class FirewallManager:
             db.session.rollback()
     
     def cleanup_all_rules(self) -> bool:
-        """Remove todas as regras da chain personalizada (usar com cuidado)"""
-        logger.warning("Limpando todas as regras da chain personalizada")
+        """Remove todas as regras da whitelist (usar com cuidado)"""
+        logger.warning("Limpando todas as regras da whitelist")
         
-        commands = [
-            [self.iptables_path, '-F', self.chain_name],
-            [self.ip6tables_path, '-F', self.chain_name]
-        ]
+        success = self.backend.flush('whitelist')
         
-        success = True
-        for command in commands:
-            result, output = self._run_command(command)
-            if not result:
-                success = False
-                logger.error(f"Falha ao limpar chain: {' '.join(command)}")
+        # O conteúdo da whitelist mudou fora das transações: reconstruir o índice
+        self.index.invalidate()
         
         if success:
             self._save_iptables_rules()
-            logger.info("Todas as regras da chain foram removidas")
+            logger.info("Todas as regras da whitelist foram removidas")
         
         return success
-
-    def add_ip_to_blacklist(self, ip_address: str) -> bool:
-        """Adiciona IP à blacklist do firewall"""
-        logger.info(f"Adicionando IP {ip_address} à blacklist do firewall")
-        try:
-            ip_obj = ipaddress.ip_address(ip_address)
-            iptables_bin = self._get_iptables_binary(ip_address)
-            chain = current_app.config.get('FIREWALL_BLACK', 'BLACKLIST')
-            command = [iptables_bin, '-A', chain, '-s', ip_address, '-j', 'DROP']
-            success, output = self._run_command(command)
-            if success:
-                logger.info(f"IP {ip_address} adicionado com sucesso à blacklist")
-                self._save_iptables_rules()
-                return True
-            else:
-                logger.error(f"Falha ao adicionar IP {ip_address} à blacklist: {output}")
-                return False
-        except ValueError as e:
-            logger.error(f"IP inválido {ip_address}: {str(e)}")
-            return False
-        except Exception as e:
-            logger.error(f"Erro ao adicionar IP {ip_address} à blacklist: {str(e)}")
-            return False
-
-    def remove_ip_from_blacklist(self, ip_address: str) -> bool:
-        """Remove IP da blacklist do firewall"""
-        logger.info(f"Removendo IP {ip_address} da blacklist do firewall")
-        try:
-            ip_obj = ipaddress.ip_address(ip_address)
-            iptables_bin = self._get_iptables_binary(ip_address)
-            chain = current_app.config.get('FIREWALL_BLACK', 'BLACKLIST')
-            command = [iptables_bin, '-D', chain, '-s', ip_address, '-j', 'DROP']
-            success, output = self._run_command(command)
-            if success:
-                logger.info(f"IP {ip_address} removido com sucesso da blacklist")
-                self._save_iptables_rules()
-                return True
-            else:
-                if "No chain/target/match" in output or "does not exist" in output:
-                    logger.warning(f"Regra para IP {ip_address} não encontrada na blacklist")
-                    return True
-                else:
-                    logger.error(f"Falha ao remover IP {ip_address} da blacklist: {output}")
-                    return False
-        except ValueError as e:
-            logger.error(f"IP inválido {ip_address}: {str(e)}")
-            return False
-        except Exception as e:
-            logger.error(f"Erro ao remover IP {ip_address} da blacklist: {str(e)}")
-            return False
@@ -0,0 +1,267 @@
+"""
+Processo auxiliar privilegiado que aplica as regras do firewall
+
+Os workers do Flask não executam binários do firewall: enviam lotes de
+operações por um socket Unix a este processo, que é o único dono do índice
+de regras e do ruleset. Requisições que chegam juntas (dentro de
+FIREWALL_HELPER_MERGE_MS) são fundidas em uma única transação do backend,
+e cada operação recebe o seu resultado individual.
+
+Protocolo: uma requisição JSON por linha e uma resposta JSON por linha.
+    {"op": "apply", "operations": [["add", "whitelist", "192.0.2.10", 3600], ...]}
+    -> {"ok": true, "results": [true, ...]}
+    {"op": "read_state"} -> {"ok": true, "entries": [["whitelist", "192.0.2.10"], ...]}
+    {"op": "info"} / {"op": "setup"} / {"op": "flush", "tipo": "whitelist"}
+"""
+import os
+import grp
+import json
+import time
+import queue
+import signal
+import logging
+import argparse
+import threading
+import socketserver
+from types import SimpleNamespace
+from typing import List, Optional
+
+from app.ruleset import format_network
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class _PendingApply:
+    """Lote de operações de uma requisição aguardando a aplicação fundida"""
+
+    def __init__(self, operations: List[tuple]):
+        self.operations = operations
+        self.results: List[bool] = []
+        self.done = threading.Event()
+
+
+class FirewallHelperServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Servidor do processo auxiliar
+
+    Cada conexão é atendida por uma thread; as requisições 'apply' vão para
+    uma fila única consumida pela thread de fusão, que aplica as operações
+    de várias requisições com uma única chamada a apply_operations do
+    FirewallManager local (com o backend real: iptables ou nftables).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, manager, merge_window: float = 0.005,
+                 max_batch: int = 500, socket_mode: int = 0o660, socket_group: Optional[str] = None):
+        self.manager = manager
+        self.merge_window = merge_window
+        self.max_batch = max_batch
+        self.socket_path = socket_path
+        self._pending: queue.Queue = queue.Queue()
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        os.makedirs(os.path.dirname(socket_path) or '.', exist_ok=True)
+        super().__init__(socket_path, _HelperRequestHandler)
+        os.chmod(socket_path, socket_mode)
+        if socket_group:
+            os.chown(socket_path, -1, grp.getgrnam(socket_group).gr_gid)
+
+        self._merger = threading.Thread(target=self._merge_loop, name='firewall-helper-merge', daemon=True)
+        self._merger.start()
+
+    def submit(self, operations: List[tuple]) -> List[bool]:
+        """Enfileira as operações e aguarda os resultados individuais"""
+        pending = _PendingApply(operations)
+        self._pending.put(pending)
+        pending.done.wait()
+        return pending.results
+
+    def _merge_loop(self):
+        """Agrupa as requisições que chegam juntas e as aplica em uma transação"""
+        while True:
+            pending = self._pending.get()
+            if pending is _STOP:
+                return
+
+            batch = [pending]
+            size = len(pending.operations)
+            stop = False
+            deadline = time.monotonic() + self.merge_window
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending = self._pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if pending is _STOP:
+                    stop = True
+                    break
+                batch.append(pending)
+                size += len(pending.operations)
+
+            try:
+                self._apply_batch(batch)
+            except Exception as e:
+                logger.error(f"Erro ao aplicar lote fundido de {len(batch)} requisições: {str(e)}")
+                for pending in batch:
+                    pending.results = pending.results or [False] * len(pending.operations)
+            finally:
+                for pending in batch:
+                    pending.done.set()
+
+            if stop:
+                return
+
+    def _apply_batch(self, batch: List[_PendingApply]):
+        """Aplica o lote fundido; em caso de falha, isola as requisições com erro"""
+        manager = self.manager
+        operations = [operation for pending in batch for operation in pending.operations]
+        if not manager.apply_operations(operations) and len(batch) > 1:
+            logger.warning(f"Lote fundido de {len(batch)} requisições falhou, aplicando separadamente")
+            for pending in batch:
+                manager.apply_operations(pending.operations)
+
+        # Resultado de cada operação: o índice (reidratado após falha) reflete o pedido
+        with manager._apply_lock:
+            manager._ensure_index()
+            for pending in batch:
+                pending.results = [self._reflects(operation) for operation in pending.operations]
+        logger.info(f"Lote fundido aplicado: {len(batch)} requisições, {len(operations)} operações")
+
+    def _reflects(self, operation: tuple) -> bool:
+        action, tipo, ip_address = operation[:3]
+        try:
+            present = self.manager.index.contains(self.manager._chain_for(tipo), ip_address)
+        except ValueError:
+            return False
+        return present == (action == 'add')
+
+    def read_state(self) -> List[List[str]]:
+        """Entradas do índice em memória (sem consultar o kernel)"""
+        manager = self.manager
+        with manager._apply_lock:
+            manager._ensure_index()
+            return [
+                [tipo, format_network(network)]
+                for tipo in ('whitelist', 'blacklist')
+                for network in manager.index.networks(manager._chain_for(tipo))
+            ]
+
+    def stop(self):
+        """Aplica o que estiver pendente, grava o ruleset e interrompe serve_forever"""
+        self._pending.put(_STOP)
+        self._merger.join(timeout=10)
+        self.manager.flush_saved_rules()
+        self.shutdown()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class _HelperRequestHandler(socketserver.StreamRequestHandler):
+    """Atende uma conexão: uma resposta JSON por linha de requisição"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self._dispatch(json.loads(line))
+            except Exception as e:
+                logger.error(f"Requisição inválida ao processo auxiliar: {str(e)}")
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+    def _dispatch(self, request: dict) -> dict:
+        server: FirewallHelperServer = self.server
+        manager = server.manager
+        op = request.get('op')
+
+        if op == 'apply':
+            # [acao, tipo, ip] ou [acao, tipo, ip, timeout]
+            operations = [
+                tuple(operation[:3]) if len(operation) < 4 or operation[3] is None else tuple(operation[:4])
+                for operation in request.get('operations', [])
+            ]
+            results = server.submit(operations)
+            return {'ok': all(results), 'results': results}
+        if op == 'read_state':
+            return {'ok': True, 'entries': server.read_state()}
+        if op == 'info':
+            return {'ok': True, 'backend': manager.backend.name, 'supports_timeouts': manager.supports_timeouts}
+        if op == 'setup':
+            return {'ok': manager.setup_firewall_base()}
+        if op == 'flush':
+            tipo = request.get('tipo', 'whitelist')
+            success = manager.backend.flush(tipo)
+            manager.index.invalidate()
+            manager._save_iptables_rules()
+            return {'ok': success}
+        return {'ok': False, 'error': f'Operação desconhecida: {op}'}
+
+
+def create_manager(settings):
+    """Cria o FirewallManager do processo auxiliar com o backend real"""
+    from app.firewall import FirewallManager
+
+    settings['FIREWALL_BACKEND'] = settings.get('FIREWALL_HELPER_BACKEND', 'iptables')
+    manager = FirewallManager()
+    manager.configure(SimpleNamespace(config=settings))
+    # Único processo que altera as regras: o índice local é autoritativo
+    manager.exclusive = True
+    return manager
+
+
+def main():
+    """Ponto de entrada: executar como root (ex.: serviço systemd)"""
+    from flask import Config
+    from config.config import config
+
+    parser = argparse.ArgumentParser(description='Processo auxiliar privilegiado do firewall')
+    parser.add_argument('--socket', help='Caminho do socket Unix (padrão: FIREWALL_HELPER_SOCKET)')
+    parser.add_argument('--setup', action='store_true', help='Aplicar as regras base do firewall ao iniciar')
+    args = parser.parse_args()
+
+    settings = Config(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    settings.from_object(config[os.environ.get('FLASK_ENV', 'default')])
+    logging.basicConfig(
+        level=getattr(logging, str(settings.get('LOG_LEVEL', 'INFO')).upper(), logging.INFO),
+        format='%(asctime)s %(levelname)s [%(name)s] %(message)s'
+    )
+
+    manager = create_manager(settings)
+    if args.setup:
+        manager.setup_firewall_base()
+    manager.rehydrate_index()
+
+    socket_path = args.socket or settings.get('FIREWALL_HELPER_SOCKET')
+    server = FirewallHelperServer(
+        socket_path,
+        manager,
+        merge_window=settings.get('FIREWALL_HELPER_MERGE_MS', 5) / 1000.0,
+        socket_mode=int(str(settings.get('FIREWALL_HELPER_SOCKET_MODE', '660')), 8),
+        socket_group=settings.get('FIREWALL_HELPER_SOCKET_GROUP') or None
+    )
+
+    def handle_signal(signum, frame):
+        logger.info(f"Sinal {signum} recebido, encerrando processo auxiliar")
+        threading.Thread(target=server.stop, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    logger.info(f"Processo auxiliar do firewall ({manager.backend.name}) ouvindo em {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
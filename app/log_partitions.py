@@ -0,0 +1,305 @@
+"""
+Armazenamento dos logs do sistema particionado por dia
+"""
+import re
+import time
+import logging
+import threading
+from datetime import date, datetime
+from itertools import groupby
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import (Column, DateTime, Index, Integer, MetaData, String, Table, Text,
+                        func, inspect, select, text)
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from app.pagination import before
+from app.stats import day_counter, log_deltas
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = 'system_logs_p'
+_PARTITION_RE = re.compile(r'^system_logs_p(\d{8})$')
+_PARTITION_NAME_RE = re.compile(r'system_logs_p\d{8}')
+
+# Os ids das partições começam em AAAAMMDD * 10^8 para continuarem únicos entre os dias
+_ID_BASE = 10 ** 8
+
+
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day.strftime('%Y%m%d')}"
+
+
+def partition_day(name: str) -> Optional[date]:
+    match = _PARTITION_RE.match(name)
+    return datetime.strptime(match.group(1), '%Y%m%d').date() if match else None
+
+
+class LogPartitions:
+    """Tabelas system_logs_pAAAAMMDD, uma por dia, com a mesma estrutura de system_logs
+
+    O gravador assíncrono insere cada lote na partição do dia do registro
+    (criada sob demanda). As consultas são roteadas apenas para as
+    partições do intervalo pedido, da mais recente para a mais antiga,
+    parando assim que o limite é atingido. A retenção remove partições
+    inteiras com DROP TABLE, sem varrer nem apagar registro por registro.
+
+    A tabela system_logs original continua sendo lida (registros anteriores
+    ao particionamento ou gravados sem aplicação ativa) e é tratada como a
+    partição mais antiga; sua limpeza é feita em blocos pequenos.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.delete_chunk = 5000
+        self.metadata = MetaData()
+        self._tables: Dict[date, Table] = {}
+        self._existing: Optional[set] = None
+        self._checked_at = 0.0
+        self.cache_ttl = 5.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura as partições com as configurações da aplicação"""
+        self.app = app
+        self.delete_chunk = app.config.get('SYSTEM_LOG_DELETE_CHUNK', 5000)
+
+    @property
+    def engine(self):
+        from app.models import db
+        return db.engine
+
+    @property
+    def legacy_table(self) -> Table:
+        from app.models import SystemLog
+        return SystemLog.__table__
+
+    def table_for(self, day: date) -> Table:
+        """Objeto Table da partição do dia (sem criar a tabela no banco)"""
+        table = self._tables.get(day)
+        if table is None:
+            with self._lock:
+                table = self._tables.get(day)
+                if table is None:
+                    name = partition_name(day)
+                    table = Table(
+                        name, self.metadata,
+                        Column('id', Integer, primary_key=True),
+                        Column('level', String(20), nullable=False),
+                        Column('message', Text, nullable=False),
+                        Column('module', String(50), nullable=False),
+                        Column('user_id', Integer),
+                        Column('ip_address', String(45)),
+                        Column('created_at', DateTime, index=True),
+                        Index(f'ix_{name}_user_created', 'user_id', 'created_at'),
+                        sqlite_autoincrement=True
+                    )
+                    self._tables[day] = table
+        return table
+
+    def refresh(self):
+        """Descarta o cache da lista de partições existentes"""
+        with self._lock:
+            self._existing = None
+
+    def days(self, connection=None) -> List[date]:
+        """Dias com partição existente, do mais recente para o mais antigo
+
+        A lista é recarregada a cada poucos segundos para enxergar partições
+        criadas por outros processos (workers do gunicorn). Uma partição
+        removida por outro processo nesse intervalo é tratada nas consultas
+        (ver _partition_dropped).
+        """
+        existing = self._existing
+        if existing is None or time.monotonic() - self._checked_at > self.cache_ttl:
+            names = inspect(connection if connection is not None else self.engine).get_table_names()
+            existing = {day for day in map(partition_day, names) if day is not None}
+            with self._lock:
+                self._existing = existing
+                self._checked_at = time.monotonic()
+        return sorted(existing, reverse=True)
+
+    def ensure(self, connection, day: date) -> Table:
+        """Cria a partição do dia se ainda não existir"""
+        table = self.table_for(day)
+        if day in self.days(connection):
+            return table
+
+        table.create(connection, checkfirst=True)
+        if connection.dialect.name == 'sqlite':
+            # Inicia a sequência de ids da partição (ignorado se outro processo já iniciou)
+            connection.execute(text(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT :name, :seq "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"
+            ), {'name': table.name, 'seq': int(day.strftime('%Y%m%d')) * _ID_BASE})
+        with self._lock:
+            if self._existing is not None:
+                self._existing.add(day)
+        logger.info(f"Partição de logs criada: {table.name}")
+        return table
+
+    def insert(self, connection, records: List[dict]):
+        """Grava os registros nas partições dos seus dias (um executemany por partição)"""
+        records = sorted(records, key=lambda record: record['created_at'])
+        for day, day_records in groupby(records, key=lambda record: record['created_at'].date()):
+            connection.execute(self.ensure(connection, day).insert(), list(day_records))
+        # Contadores das estatísticas na mesma transação (logs.total e logs.day.*)
+        from app.models import StatCounter
+        StatCounter.increment(connection, log_deltas(record['created_at'] for record in records))
+
+    def _partition_dropped(self, error: Exception) -> bool:
+        """Indica se a consulta falhou porque outro processo removeu uma partição
+
+        Nesse caso a lista em cache é descartada e a consulta pode ser repetida.
+        """
+        names = set(_PARTITION_NAME_RE.findall(str(error)))
+        if not names or names <= set(inspect(self.engine).get_table_names()):
+            return False
+        logger.info(f"Partição de logs removida por outro processo: {', '.join(sorted(names))}")
+        self.refresh()
+        return True
+
+    def _tables_between(self, since: Optional[datetime], until: Optional[datetime],
+                        cursor: Optional[Tuple[datetime, int]] = None) -> List[Table]:
+        """Partições que podem conter registros no intervalo, mais recentes primeiro"""
+        tables = [
+            self.table_for(day) for day in self.days()
+            if (since is None or day >= since.date()) and (until is None or day <= until.date())
+            and (cursor is None or day <= cursor[0].date())
+        ]
+        # A tabela original não tem data própria: entra sempre, por último
+        tables.append(self.legacy_table)
+        return tables
+
+    @staticmethod
+    def _criteria(table: Table, user_id, since, until, where, cursor=None):
+        criteria = []
+        if cursor is not None:
+            criteria.append(before(table.c.created_at, table.c.id, cursor))
+        if user_id is not None:
+            criteria.append(table.c.user_id == user_id)
+        if since is not None:
+            criteria.append(table.c.created_at >= since)
+        if until is not None:
+            criteria.append(table.c.created_at < until)
+        if where is not None:
+            criteria.append(where(table))
+        return criteria
+
+    def recent(self, limit: int, user_id: Optional[int] = None, since: Optional[datetime] = None,
+               until: Optional[datetime] = None, where: Optional[Callable] = None,
+               cursor: Optional[Tuple[datetime, int]] = None) -> list:
+        """Registros mais recentes (atributos id, level, message, module, ...)
+
+        where recebe a tabela da partição e devolve um critério adicional,
+        ex.: where=lambda t: t.c.module == 'auth'. cursor (created_at, id)
+        restringe aos registros anteriores a essa posição (paginação keyset).
+        """
+        try:
+            return self._recent(limit, user_id, since, until, where, cursor)
+        except (OperationalError, ProgrammingError) as e:
+            if not self._partition_dropped(e):
+                raise
+            return self._recent(limit, user_id, since, until, where, cursor)
+
+    def _recent(self, limit, user_id, since, until, where, cursor) -> list:
+        rows = []
+        with self.engine.connect() as connection:
+            for table in self._tables_between(since, until, cursor):
+                remaining = limit - len(rows)
+                if remaining <= 0:
+                    break
+                query = select(*table.c).where(
+                    *self._criteria(table, user_id, since, until, where, cursor)
+                ).order_by(table.c.created_at.desc(), table.c.id.desc()).limit(remaining)
+                rows.extend(connection.execute(query).all())
+        return rows
+
+    def stream(self, user_id: Optional[int] = None, since: Optional[datetime] = None,
+               until: Optional[datetime] = None, where: Optional[Callable] = None,
+               cursor: Optional[Tuple[datetime, int]] = None, batch: int = 500) -> Iterator:
+        """Itera todos os registros, mais recentes primeiro, lendo batch linhas por vez do cursor do banco
+
+        Uma partição removida por outro processo durante a leitura é pulada
+        (seus registros não existem mais) e a leitura segue em nova conexão.
+        """
+        tables = self._tables_between(since, until, cursor)
+        while tables:
+            try:
+                with self.engine.connect() as connection:
+                    connection = connection.execution_options(stream_results=True, yield_per=batch)
+                    while tables:
+                        table = tables.pop(0)
+                        query = select(*table.c).where(
+                            *self._criteria(table, user_id, since, until, where, cursor)
+                        ).order_by(table.c.created_at.desc(), table.c.id.desc())
+                        yield from connection.execute(query)
+            except (OperationalError, ProgrammingError) as e:
+                if not self._partition_dropped(e):
+                    raise
+
+    def count(self, user_id: Optional[int] = None, since: Optional[datetime] = None,
+              until: Optional[datetime] = None, where: Optional[Callable] = None, connection=None) -> int:
+        """Quantidade de registros no intervalo (somando apenas as partições envolvidas)"""
+        if connection is None:
+            with self.engine.connect() as connection:
+                return self.count(user_id, since, until, where, connection)
+        try:
+            return self._count(connection, user_id, since, until, where)
+        except (OperationalError, ProgrammingError) as e:
+            if not self._partition_dropped(e):
+                raise
+            return self._count(connection, user_id, since, until, where)
+
+    def _count(self, connection, user_id, since, until, where) -> int:
+        total = 0
+        for table in self._tables_between(since, until):
+            query = select(func.count()).select_from(table).where(
+                *self._criteria(table, user_id, since, until, where)
+            )
+            total += connection.execute(query).scalar() or 0
+        return total
+
+    def drop_before(self, cutoff: datetime) -> int:
+        """Remove os registros anteriores a cutoff; retorna a quantidade removida
+
+        Partições de dias inteiramente anteriores ao corte são descartadas com
+        DROP TABLE; na tabela original os registros são apagados em blocos
+        de SYSTEM_LOG_DELETE_CHUNK, liberando o lock de escrita entre eles.
+        """
+        from app.models import StatCounter
+        removed = 0
+        self.refresh()
+        for day in self.days():
+            if day >= cutoff.date():
+                continue
+            table = self.table_for(day)
+            with self.engine.begin() as connection:
+                rows = connection.execute(select(func.count()).select_from(table)).scalar() or 0
+                table.drop(connection, checkfirst=True)
+                StatCounter.increment(connection, {'logs.total': -rows})
+                removed += rows
+                if connection.dialect.name == 'sqlite':
+                    connection.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {'name': table.name})
+            with self._lock:
+                self._tables.pop(day, None)
+                self.metadata.remove(table)
+            logger.info(f"Partição de logs removida: {table.name}")
+        self.refresh()
+
+        legacy = self.legacy_table
+        while True:
+            with self.engine.begin() as connection:
+                ids = select(legacy.c.id).where(legacy.c.created_at < cutoff).limit(self.delete_chunk)
+                deleted = connection.execute(legacy.delete().where(legacy.c.id.in_(ids))).rowcount
+                StatCounter.increment(connection, {'logs.total': -deleted})
+            removed += deleted
+            if deleted < self.delete_chunk:
+                break
+
+        # Contadores diários dos dias removidos
+        with self.engine.begin() as connection:
+            StatCounter.discard_before(connection, 'logs.day.', day_counter(cutoff.date()))
+        return removed
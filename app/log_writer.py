@@ -0,0 +1,198 @@
+"""
+Gravação assíncrona e em lote dos registros de SystemLog
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# Política padrão quando a fila está cheia:
+#   drop  - descarta o registro imediatamente
+#   block - aguarda até SYSTEM_LOG_BLOCK_MS por espaço e então descarta
+#   sync  - aguarda até SYSTEM_LOG_BLOCK_MS e então grava diretamente (nunca perde)
+DEFAULT_POLICIES = {
+    'DEBUG': 'drop',
+    'INFO': 'drop',
+    'WARNING': 'block',
+    'ERROR': 'sync',
+    'CRITICAL': 'sync',
+}
+
+
+def parse_policies(value: Optional[str]) -> Dict[str, str]:
+    """Converte 'DEBUG=drop,INFO=block' em dicionário, partindo das políticas padrão"""
+    policies = dict(DEFAULT_POLICIES)
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        level, policy = (part.strip() for part in item.split('=', 1))
+        if policy.lower() in ('drop', 'block', 'sync'):
+            policies[level.upper()] = policy.lower()
+    return policies
+
+
+class SystemLogWriter:
+    """Fila limitada de registros de log gravados em lote por uma thread dedicada
+
+    SystemLog.log apenas enfileira o registro (com created_at do momento da
+    chamada); a thread grava os registros na partição diária
+    (app.log_partitions) com um único INSERT executemany a cada SYSTEM_LOG_BATCH_SIZE registros ou SYSTEM_LOG_FLUSH_MS
+    milissegundos, em conexão própria, sem tocar na sessão da requisição.
+    A memória é limitada por SYSTEM_LOG_QUEUE_SIZE; quando a fila enche, a
+    política do nível decide entre descartar, aguardar ou gravar
+    diretamente. Os registros pendentes são gravados no encerramento.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.batch_size = 100
+        self.flush_interval = 0.5
+        self.queue_size = 10000
+        self.block_timeout = 0.1
+        self.policies = dict(DEFAULT_POLICIES)
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'enqueued': 0, 'written': 0, 'dropped': 0, 'sync_writes': 0, 'failed': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura o gravador com as configurações da aplicação"""
+        self.app = app
+        self.enabled = app.config.get('SYSTEM_LOG_ASYNC', True)
+        self.batch_size = app.config.get('SYSTEM_LOG_BATCH_SIZE', 100)
+        self.flush_interval = app.config.get('SYSTEM_LOG_FLUSH_MS', 500) / 1000.0
+        self.queue_size = app.config.get('SYSTEM_LOG_QUEUE_SIZE', 10000)
+        self.block_timeout = app.config.get('SYSTEM_LOG_BLOCK_MS', 100) / 1000.0
+        self.policies = parse_policies(app.config.get('SYSTEM_LOG_POLICY'))
+        atexit.register(self.shutdown)
+
+    def _ensure_started(self):
+        """Inicia a thread sob demanda (também após fork dos workers do gunicorn)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._thread = None
+                self._pid = os.getpid()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='system-log-writer', daemon=True)
+                self._thread.start()
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def stats(self) -> Dict[str, int]:
+        """Contadores do gravador (para monitoramento)"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+        return stats
+
+    def write(self, level: str, message: str, module: str, user_id=None, ip_address=None):
+        """Enfileira um registro; aplica a política do nível se a fila estiver cheia"""
+        record = {
+            'level': level,
+            'message': message,
+            'module': module,
+            'user_id': user_id,
+            'ip_address': ip_address,
+            'created_at': datetime.utcnow(),
+        }
+        if not self.enabled:
+            self._insert([record])
+            return
+
+        self._ensure_started()
+        policy = self.policies.get(str(level).upper(), 'block')
+        try:
+            if policy == 'drop':
+                self._queue.put_nowait(record)
+            else:
+                self._queue.put(record, timeout=self.block_timeout)
+            self._count('enqueued')
+        except queue.Full:
+            if policy == 'sync':
+                self._count('sync_writes')
+                self._insert([record])
+            else:
+                self._count('dropped')
+
+    def flush(self):
+        """Bloqueia até que todos os registros enfileirados tenham sido gravados"""
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def shutdown(self):
+        """Grava os registros pendentes e encerra a thread"""
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout=10)
+
+    def _run(self):
+        """Loop da thread: agrupa registros em lotes e os grava"""
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                self._queue.task_done()
+                return
+
+            batch = [record]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    record = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stop = True
+                    break
+                batch.append(record)
+
+            try:
+                self._insert(batch)
+            finally:
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self._queue.task_done()
+
+            if stop:
+                return
+
+    def _insert(self, records: List[dict]) -> bool:
+        """Grava os registros na partição do dia (INSERT executemany) em transação própria"""
+        from app.models import db
+
+        for attempt in range(2):
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as connection:
+                        self.app.log_partitions.insert(connection, records)
+                self._count('written', len(records))
+                return True
+            except Exception as e:
+                # Banco ocupado (ex.: lock do SQLite): tentar mais uma vez
+                if attempt == 0:
+                    time.sleep(self.flush_interval)
+                    continue
+                logger.error(f"Falha ao gravar {len(records)} registros de log: {str(e)}")
+                self._count('failed', len(records))
+        return False
@@ -0,0 +1,403 @@
+"""
+Entrega dos emails da outbox por um pool fixo de workers com conexões SMTP reutilizadas
+"""
+import os
+import json
+import time
+import smtplib
+import uuid
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, func, or_, select, update
+
+logger = logging.getLogger(__name__)
+
+_registered = False
+
+# Recusas do servidor que dizem respeito a uma mensagem; as demais falhas
+# (conexão, autenticação, servidor fora do ar) valem para o lote inteiro
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def _after_commit(session):
+    """Acorda os workers quando uma transação com emails é confirmada"""
+    if session.info.pop('email_outbox', False):
+        from flask import current_app, has_app_context
+        worker = getattr(current_app, 'email_worker', None) if has_app_context() else None
+        if worker is not None:
+            worker.notify()
+
+
+def _after_rollback(session):
+    session.info.pop('email_outbox', None)
+
+
+def register_outbox_listeners():
+    """Registra os hooks de commit das sessões do Flask-SQLAlchemy (uma única vez)"""
+    global _registered
+    if _registered:
+        return
+    from flask_sqlalchemy.session import Session
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_soft_rollback', lambda session, previous: _after_rollback(session))
+    _registered = True
+
+
+class EmailWorkerPool:
+    """Entrega os emails da tabela email_outbox com EMAIL_WORKERS threads fixas
+
+    send_email grava o email na outbox, na transação do chamador; após o
+    commit os workers são acordados. Cada worker reivindica um lote de até
+    EMAIL_BATCH_SIZE emails pendentes marcando lease_until (agora +
+    EMAIL_LEASE_S) e o seu identificador, envia o lote pela sua conexão SMTP
+    autenticada (mail.connect(), reutilizada entre lotes e fechada após
+    EMAIL_IDLE_TIMEOUT_S sem envios ou EMAIL_MAX_PER_CONNECTION mensagens) e
+    marca os enviados em um único UPDATE. Antes de cada envio o lease do
+    email é renovado; se outro worker o reivindicou nesse meio tempo, ele é
+    pulado. Falhas descartam a conexão e reagendam o email com espera
+    exponencial (EMAIL_RETRY_BACKOFF_S, 2x, 4x, ... até
+    EMAIL_RETRY_BACKOFF_MAX_S); após EMAIL_MAX_RETRIES novas tentativas ele
+    fica como failed. Uma falha de conexão interrompe o lote: os emails
+    ainda não enviados são liberados e o worker espera, com a mesma espera
+    exponencial, antes de tentar de novo (zerada no primeiro lote sem falha
+    de conexão). Um email reivindicado por um processo
+    que morreu volta a ser entregue quando o lease vence, e os workers
+    também verificam a outbox a cada EMAIL_POLL_S segundos. No encerramento
+    o lote em andamento é concluído em até EMAIL_DRAIN_TIMEOUT_S segundos.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.workers = 2
+        self.batch_size = 50
+        self.lease = 60.0
+        self.poll_interval = 5.0
+        self.idle_timeout = 30.0
+        self.max_per_connection = 100
+        self.max_retries = 3
+        self.backoff = 1.0
+        self.backoff_max = 60.0
+        self.drain_timeout = 10.0
+        self.suppress = False
+        self._threads = []
+        self._pid = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._idle = threading.Condition()
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'claimed': 0, 'sent': 0, 'failed': 0, 'retries': 0, 'connections': 0,
+                       'connection_failures': 0}
+        self._latency = {'send_total': 0.0, 'send_max': 0.0, 'queue_total': 0.0, 'queue_max': 0.0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura o pool com as configurações da aplicação"""
+        self.app = app
+        self.workers = max(1, app.config.get('EMAIL_WORKERS', 2))
+        self.batch_size = app.config.get('EMAIL_BATCH_SIZE', 50)
+        self.lease = app.config.get('EMAIL_LEASE_S', 60)
+        self.poll_interval = app.config.get('EMAIL_POLL_S', 5)
+        self.idle_timeout = app.config.get('EMAIL_IDLE_TIMEOUT_S', 30)
+        self.max_per_connection = app.config.get('EMAIL_MAX_PER_CONNECTION', 100)
+        self.max_retries = app.config.get('EMAIL_MAX_RETRIES', 3)
+        self.backoff = app.config.get('EMAIL_RETRY_BACKOFF_S', 1.0)
+        self.backoff_max = app.config.get('EMAIL_RETRY_BACKOFF_MAX_S', 60.0)
+        self.drain_timeout = app.config.get('EMAIL_DRAIN_TIMEOUT_S', 10)
+        self.suppress = app.config.get('MAIL_SUPPRESS_SEND', app.testing)
+        register_outbox_listeners()
+        atexit.register(self.shutdown)
+
+    def _ensure_started(self):
+        """Inicia os workers sob demanda (também após fork dos workers do gunicorn)"""
+        if self._pid == os.getpid() and self._threads and all(thread.is_alive() for thread in self._threads):
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._threads = []
+                self._wakeup = threading.Event()
+                self._stopping = threading.Event()
+                self._idle = threading.Condition()
+                self._busy = 0
+                self._pid = os.getpid()
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f'email-worker-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def notify(self):
+        """Acorda os workers (há emails novos na outbox)"""
+        self._ensure_started()
+        self._wakeup.set()
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def pending(self) -> int:
+        """Emails aguardando entrega na outbox"""
+        from app.models import EmailOutbox, db
+
+        with db.engine.connect() as connection:
+            return connection.execute(
+                select(func.count()).select_from(EmailOutbox.__table__).where(EmailOutbox.__table__.c.status == 'pending')
+            ).scalar() or 0
+
+    def stats(self) -> Dict[str, float]:
+        """Contadores, emails pendentes e latências de envio (para monitoramento)"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+            latency = dict(self._latency)
+        sent = max(stats['sent'], 1)
+        stats['pending'] = self.pending()
+        stats['send_latency_ms_avg'] = round(latency['send_total'] / sent * 1000, 2)
+        stats['send_latency_ms_max'] = round(latency['send_max'] * 1000, 2)
+        stats['queue_latency_ms_avg'] = round(latency['queue_total'] / sent * 1000, 2)
+        stats['queue_latency_ms_max'] = round(latency['queue_max'] * 1000, 2)
+        return stats
+
+    def flush(self, timeout: float = 10.0):
+        """Bloqueia até a outbox não ter emails prontos para envio (ou até o timeout)"""
+        self.notify()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._idle:
+                if self._busy == 0 and not self._ready():
+                    return True
+                self._idle.wait(0.05)
+            self._wakeup.set()
+        return False
+
+    def _ready(self) -> bool:
+        from app.models import EmailOutbox, db
+
+        table = EmailOutbox.__table__
+        with self.app.app_context():
+            with db.engine.connect() as connection:
+                return connection.execute(select(table.c.id).where(*self._claimable(table)).limit(1)).first() is not None
+
+    def shutdown(self):
+        """Conclui o lote em andamento (até EMAIL_DRAIN_TIMEOUT_S) e encerra os workers"""
+        if self._pid != os.getpid() or not any(thread.is_alive() for thread in self._threads):
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        deadline = time.monotonic() + self.drain_timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        if any(thread.is_alive() for thread in self._threads):
+            logger.warning("Encerramento dos workers de email antes do fim do lote (lease será reaproveitado)")
+
+    def _run(self):
+        """Loop do worker: reivindica e entrega lotes enquanto houver emails prontos"""
+        owner = f'{os.getpid()}-{threading.current_thread().name}-{uuid.uuid4().hex[:8]}'
+        connection = None
+        last_send = time.monotonic()
+        failures = 0
+        with self.app.app_context():
+            while not self._stopping.is_set():
+                with self._idle:
+                    self._busy += 1
+                connection_failed = False
+                try:
+                    batch = self._claim(owner)
+                    if batch:
+                        connection, connection_failed = self._deliver(batch, owner, connection)
+                        last_send = time.monotonic()
+                except Exception as e:
+                    logger.error(f"Erro no worker de email: {str(e)}")
+                    connection = self._close(connection)
+                    batch = None
+                finally:
+                    with self._idle:
+                        self._busy -= 1
+                        self._idle.notify_all()
+                if connection_failed:
+                    # Servidor SMTP indisponível: uma tentativa de conexão por ciclo
+                    failures += 1
+                    delay = min(self.backoff * (2 ** (failures - 1)), self.backoff_max)
+                    logger.warning(f"Falha de conexão SMTP, nova tentativa do worker em {delay:.1f}s")
+                    self._stopping.wait(delay)
+                    continue
+                if batch:
+                    failures = 0
+                    continue
+
+                if connection is not None and time.monotonic() - last_send >= self.idle_timeout:
+                    connection = self._close(connection)
+                self._wakeup.wait(self.poll_interval if connection is None else min(self.poll_interval, self.idle_timeout))
+                self._wakeup.clear()
+        self._close(connection)
+
+    @staticmethod
+    def _claimable(table, now: Optional[datetime] = None):
+        now = now or datetime.utcnow()
+        return (table.c.status == 'pending', table.c.next_attempt_at <= now,
+                or_(table.c.lease_until.is_(None), table.c.lease_until < now))
+
+    def _claim(self, owner: str) -> List:
+        """Reivindica um lote de emails prontos com prazo (lease) em nome do worker"""
+        from app.models import EmailOutbox, db
+
+        table = EmailOutbox.__table__
+        now = datetime.utcnow()
+        lease_until = now + timedelta(seconds=self.lease)
+        chunk = select(table.c.id).where(*self._claimable(table, now)).order_by(
+            table.c.next_attempt_at
+        ).limit(self.batch_size).scalar_subquery()
+        claim = update(table).where(table.c.id.in_(chunk), *self._claimable(table, now)).values(
+            lease_until=lease_until, lease_owner=owner
+        )
+        with db.engine.begin() as connection:
+            if connection.dialect.update_returning:
+                rows = connection.execute(claim.returning(*table.c)).all()
+            else:
+                connection.execute(claim)
+                rows = connection.execute(select(*table.c).where(
+                    table.c.lease_owner == owner, table.c.lease_until == lease_until
+                )).all()
+        if rows:
+            self._count('claimed', len(rows))
+        return sorted(rows, key=lambda row: row.id)
+
+    def _renew(self, row, owner: str) -> bool:
+        """Renova o lease do email antes do envio; False se ele não pertence mais ao worker"""
+        from app.models import EmailOutbox, db
+
+        table = EmailOutbox.__table__
+        with db.engine.begin() as connection:
+            return connection.execute(update(table).where(
+                table.c.id == row.id, table.c.lease_owner == owner, table.c.status == 'pending'
+            ).values(lease_until=datetime.utcnow() + timedelta(seconds=self.lease))).rowcount == 1
+
+    def _deliver(self, batch: List, owner: str, connection):
+        """Envia o lote pela conexão do worker e registra o resultado de cada email
+
+        Retorna (conexão, falha de conexão). Após uma falha de conexão os
+        emails restantes do lote não são tentados e têm o lease liberado.
+        """
+        from app import mail
+        from app.models import EmailOutbox, db
+
+        table = EmailOutbox.__table__
+        sent_ids, retries, released = [], [], []
+        connection_failed = False
+        for position, row in enumerate(batch):
+            if not self._renew(row, owner):
+                logger.warning(f"Lease do email {row.id} perdido para outro worker; envio ignorado")
+                continue
+            try:
+                msg = self._message(row)
+            except Exception as e:
+                retries.append((row, str(e)))
+                continue
+            try:
+                if connection is None:
+                    connection = self._connect(mail)
+                    self._count('connections')
+                started = time.monotonic()
+                connection.send(msg)
+                self._sent(started, row.created_at)
+                sent_ids.append(row.id)
+                if connection.num_emails >= self.max_per_connection:
+                    connection = self._close(connection)
+            except Exception as e:
+                connection = self._close(connection)
+                retries.append((row, str(e)))
+                if not isinstance(e, MESSAGE_ERRORS):
+                    self._count('connection_failures')
+                    connection_failed = True
+                    released = [pending.id for pending in batch[position + 1:]]
+                    break
+
+        now = datetime.utcnow()
+        mine = (table.c.lease_owner == owner,)
+        with db.engine.begin() as conn:
+            if released:
+                conn.execute(update(table).where(table.c.id.in_(released), *mine).values(lease_until=None))
+            if sent_ids:
+                conn.execute(update(table).where(table.c.id.in_(sent_ids), *mine).values(
+                    status='sent', sent_at=now, attempts=table.c.attempts + 1, lease_until=None, last_error=None
+                ))
+            for row, error in retries:
+                attempts = row.attempts + 1
+                if attempts > self.max_retries:
+                    self._count('failed')
+                    logger.error(f"❌ Erro ao enviar email {row.email_type} para {row.recipients}: {error}")
+                    values = {'status': 'failed'}
+                else:
+                    self._count('retries')
+                    delay = min(self.backoff * (2 ** row.attempts), self.backoff_max)
+                    logger.warning(f"Falha no envio do email {row.email_type} ({error}); "
+                                   f"nova tentativa em {delay:.1f}s")
+                    values = {'next_attempt_at': now + timedelta(seconds=delay)}
+                conn.execute(update(table).where(table.c.id == row.id, *mine).values(
+                    attempts=attempts, lease_until=None, last_error=error[:1000], **values
+                ))
+        if sent_ids:
+            logger.info(f"✅ {len(sent_ids)} emails enviados da outbox")
+        return connection, connection_failed
+
+    def _connect(self, mail):
+        """Abre a conexão SMTP do worker
+
+        Com MAIL_SUPPRESS_SEND (padrão em TESTING) nenhuma conexão real é
+        aberta: os emails são apenas registrados (sinal email_dispatched).
+        """
+        connection = mail.connect()
+        if self.suppress:
+            connection.host = None
+            connection.num_emails = 0
+            return connection
+        return connection.__enter__()
+
+    def _message(self, row):
+        """Mensagem do email; emails por template são renderizados aqui, fora da requisição"""
+        from flask_mail import Message
+
+        subject, text_body, html_body = row.subject, row.text_body, row.html_body
+        if row.template:
+            rendered = self.app.email_renderer.render(row.template, json.loads(row.context or '{}'))
+            subject, text_body, html_body = rendered.subject, rendered.text, rendered.html
+        msg = Message(subject, sender=row.sender, recipients=[a for a in row.recipients.split(',') if a])
+        msg.body = text_body
+        if html_body:
+            msg.html = html_body
+        return msg
+
+    def _sent(self, started: float, created_at: Optional[datetime]):
+        now = time.monotonic()
+        waited = max(0.0, (datetime.utcnow() - created_at).total_seconds()) if created_at else 0.0
+        with self._stats_lock:
+            self._stats['sent'] += 1
+            self._latency['send_total'] += now - started
+            self._latency['send_max'] = max(self._latency['send_max'], now - started)
+            self._latency['queue_total'] += waited
+            self._latency['queue_max'] = max(self._latency['queue_max'], waited)
+
+    def purge(self, before: datetime) -> int:
+        """Remove da outbox os emails já processados (sent/failed) criados antes de before"""
+        from app.models import EmailOutbox, db
+
+        table = EmailOutbox.__table__
+        with db.engine.begin() as connection:
+            return connection.execute(table.delete().where(
+                table.c.status.in_(['sent', 'failed']), table.c.created_at < before
+            )).rowcount
+
+    @staticmethod
+    def _close(connection):
+        """Fecha a conexão SMTP (ignorando erros de uma conexão já caída)"""
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except Exception:
+                pass
+        return None
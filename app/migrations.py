@@ -0,0 +1,103 @@
+"""
+Migrações do esquema aplicadas na inicialização
+"""
+import logging
+from typing import List
+
+from sqlalchemy import inspect
+
+logger = logging.getLogger(__name__)
+
+
+def create_missing_tables() -> List[str]:
+    """Cria nos bancos existentes as tabelas declaradas nos models que ainda não existem
+
+    Tabelas novas (contadores, outbox de emails, resumos do admin...) não
+    chegam aos bancos criados por versões anteriores de outra forma.
+    Retorna os nomes das tabelas criadas.
+    """
+    from app.models import db
+
+    with db.engine.begin() as connection:
+        existing = set(inspect(connection).get_table_names())
+        missing = [table for table in db.metadata.sorted_tables if table.name not in existing]
+        if missing:
+            db.metadata.create_all(connection, tables=missing)
+    for table in missing:
+        logger.info(f"Tabela criada: {table.name}")
+    return [table.name for table in missing]
+
+
+def upgrade_indexes() -> List[str]:
+    """Cria nos bancos existentes os índices declarados nos models que ainda não existem
+
+    db.create_all() não altera tabelas já criadas, então índices novos
+    (compostos e parciais em __table_args__) só chegam aos bancos antigos
+    por aqui. Tabelas ainda inexistentes são ignoradas (create_missing_tables
+    as cria completas). Retorna os nomes dos índices criados.
+    """
+    from app.models import db
+
+    created = []
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        tables = set(inspector.get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                if index.name not in existing:
+                    index.create(connection)
+                    created.append(index.name)
+                    logger.info(f"Índice criado: {index.name} em {table.name}")
+    return created
+
+
+def upgrade_nullable_columns() -> List[str]:
+    """Remove o NOT NULL das colunas que passaram a aceitar nulo nos models
+
+    O SQLite não altera a restrição de uma coluna existente: a tabela é
+    recriada (renomeada, criada de novo pelo model com os seus índices,
+    copiada e a antiga descartada). Em outros bancos basta um ALTER COLUMN.
+    Retorna as colunas alteradas (tabela.coluna).
+    """
+    from app.models import db
+
+    changed = []
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        tables = set(inspector.get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            existing = {column['name']: column for column in inspector.get_columns(table.name)}
+            columns = [
+                column.name for column in table.columns
+                if column.nullable and not column.primary_key
+                and column.name in existing and not existing[column.name]['nullable']
+            ]
+            if not columns:
+                continue
+
+            if connection.dialect.name == 'sqlite':
+                old_name = f'_{table.name}_old'
+                copied = ', '.join(f'"{column.name}"' for column in table.columns if column.name in existing)
+                # Sem reescrever as referências das outras tabelas durante o RENAME
+                connection.exec_driver_sql('PRAGMA legacy_alter_table=ON')
+                for index in inspector.get_indexes(table.name):
+                    connection.exec_driver_sql(f'DROP INDEX "{index["name"]}"')
+                connection.exec_driver_sql(f'ALTER TABLE "{table.name}" RENAME TO "{old_name}"')
+                table.create(connection)
+                connection.exec_driver_sql(
+                    f'INSERT INTO "{table.name}" ({copied}) SELECT {copied} FROM "{old_name}"'
+                )
+                connection.exec_driver_sql(f'DROP TABLE "{old_name}"')
+                connection.exec_driver_sql('PRAGMA legacy_alter_table=OFF')
+            else:
+                for name in columns:
+                    connection.exec_driver_sql(f'ALTER TABLE {table.name} ALTER COLUMN {name} DROP NOT NULL')
+            for name in columns:
+                changed.append(f'{table.name}.{name}')
+                logger.info(f"Coluna {table.name}.{name} passou a aceitar nulo")
+    return changed
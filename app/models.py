@@ -1,14 +1,89 @@
 """
 Models do banco de dados para o sistema de login com firewall
 """
+import os
+import weakref
 from datetime import datetime, timedelta
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import URLSafeTimedSerializer
 import secrets
 
 db = SQLAlchemy()
 
+# Opções aceitas apenas pelo QueuePool (pool padrão dos bancos em arquivo)
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+# Engines com o perfil do SQLite aplicado; descartados (sem fechar) após cada fork
+_sqlite_engines = weakref.WeakSet()
+
+def _dispose_after_fork():
+    for engine in list(_sqlite_engines):
+        engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=_dispose_after_fork)
+
+def configure_engine_options(app):
+    """Ajusta SQLALCHEMY_ENGINE_OPTIONS ao pool usado pela URL (chamar antes de db.init_app)
+    
+    SQLite em memória usa StaticPool, que rejeita o dimensionamento do pool;
+    essas opções só são mantidas quando a URL usa QueuePool.
+    """
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    in_memory = url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+    poolclass = options.get('poolclass')
+    if in_memory or (poolclass is not None and not issubclass(poolclass, QueuePool)):
+        for option in QUEUE_POOL_OPTIONS:
+            options.pop(option, None)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+def configure_sqlite_engine(app):
+    """Perfil do SQLite: PRAGMAs aplicados em cada nova conexão e pool seguro para fork
+    
+    WAL permite que leitores (dashboard, estatísticas) não esperem os
+    escritores; synchronous=NORMAL faz fsync apenas nos checkpoints. As
+    conexões herdadas do processo mestre (preload_app do gunicorn) são
+    descartadas, sem fechar, em cada worker após o fork.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite' or engine in _sqlite_engines:
+        return
+    
+    pragmas = [
+        f"PRAGMA journal_mode={app.config.get('SQLITE_JOURNAL_MODE', 'WAL')}",
+        f"PRAGMA synchronous={app.config.get('SQLITE_SYNCHRONOUS', 'NORMAL')}",
+        f"PRAGMA busy_timeout={int(app.config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}",
+        f"PRAGMA mmap_size={int(app.config.get('SQLITE_MMAP_SIZE', 268435456))}",
+        f"PRAGMA cache_size={int(app.config.get('SQLITE_CACHE_SIZE', -20000))}",
+        f"PRAGMA temp_store={app.config.get('SQLITE_TEMP_STORE', 'MEMORY')}",
+    ]
+    
+    @event.listens_for(engine, 'connect')
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+    
+    # Conexões abertas antes do registro não receberam os PRAGMAs
+    engine.dispose()
+    _sqlite_engines.add(engine)
+
+def sqlite_wal_size():
+    """Tamanho em bytes do arquivo WAL do banco SQLite (0 se não houver)"""
+    engine = db.engine
+    if engine.dialect.name != 'sqlite' or not engine.url.database:
+        return 0
+    try:
+        return os.path.getsize(f'{engine.url.database}-wal')
+    except OSError:
+        return 0
+
 class User(db.Model):
     """Model para usuários do sistema"""
     __tablename__ = 'users'
@@ -18,7 +93,8 @@ class User(db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     full_name = db.Column(db.String(100), nullable=True)
     role = db.Column(db.String(20), default='user', nullable=False)  # 'admin' ou 'user'
-    confirmed = db.Column(db.Boolean, default=False, nullable=False)
+    # active_history: o valor anterior é carregado na alteração (contadores em app.stats)
+    confirmed = db.column_property(db.Column(db.Boolean, default=False, nullable=False), active_history=True)
     confirmation_token = db.Column(db.String(255), unique=True)
     confirmation_sent_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -68,10 +144,12 @@ class User(db.Model):
         self.failed_login_attempts = 0
     
     def record_failed_login(self):
-        """Registra tentativa de login falhada"""
+        """Registra tentativa de login falhada; retorna se a conta foi bloqueada (zera o contador)"""
         self.failed_login_attempts += 1
         if self.failed_login_attempts >= 5:
             self.lock_account()
+            return True
+        return False
     
     def record_successful_login(self):
         """Registra login bem-sucedido"""
@@ -120,9 +198,19 @@ class UserSession(db.Model):
     session_token = db.Column(db.String(255), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     expires_at = db.Column(db.DateTime, nullable=False)
-    is_active = db.Column(db.Boolean, default=True, nullable=False)
+    is_active = db.column_property(db.Column(db.Boolean, default=True, nullable=False), active_history=True)
     ended_at = db.Column(db.DateTime)
     
+    __table_args__ = (
+        # Sessões ativas do usuário (dashboard, /api/user/sessions)
+        db.Index('ix_user_sessions_user_active_expires', 'user_id', 'is_active', 'expires_at'),
+        # Histórico de sessões do usuário (página da conta)
+        db.Index('ix_user_sessions_user_created', 'user_id', 'created_at'),
+        # Limpeza de sessões expiradas: apenas as ativas
+        db.Index('ix_user_sessions_active_expires', 'expires_at',
+                 sqlite_where=is_active.columns[0] == True, postgresql_where=is_active.columns[0] == True),
+    )
+    
     def __init__(self, user_id, ip_address, user_agent=None):
         self.user_id = user_id
         self.ip_address = ip_address
@@ -167,14 +255,28 @@ class FirewallRule(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     ip_address = db.Column(db.String(45), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    session_id = db.Column(db.Integer, db.ForeignKey('user_sessions.id'), nullable=False)
+    # Nulo nas regras de blacklist (criadas no login falho, sem sessão)
+    session_id = db.Column(db.Integer, db.ForeignKey('user_sessions.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     removed_at = db.Column(db.DateTime)
-    is_active = db.Column(db.Boolean, default=True, nullable=False)
+    is_active = db.column_property(db.Column(db.Boolean, default=True, nullable=False), active_history=True)
     iptables_rule_added = db.Column(db.Boolean, default=False)
     tipo = db.Column(db.String(20), default='whitelist', nullable=False)  # whitelist ou blacklist
     chain = db.Column(db.String(50), default='WHITELIST', nullable=False)
     
+    __table_args__ = (
+        # Regra da sessão (logout, encerramento e expiração de sessões)
+        db.Index('ix_firewall_rules_session_active', 'session_id', 'is_active'),
+        # Regras de um IP (reconciliador, blacklist no login)
+        db.Index('ix_firewall_rules_ip_active', 'ip_address', 'is_active'),
+        # Regras ativas: cobre a sincronização e a carga da blacklist sem ler a tabela
+        db.Index('ix_firewall_rules_active_covering', 'tipo', 'ip_address', 'session_id', 'iptables_rule_added',
+                 sqlite_where=is_active.columns[0] == True, postgresql_where=is_active.columns[0] == True),
+        # Regras ativas mais recentes primeiro (painel Firewall Manager)
+        db.Index('ix_firewall_rules_active_created', 'created_at',
+                 sqlite_where=is_active.columns[0] == True, postgresql_where=is_active.columns[0] == True),
+    )
+    
     # Relacionamentos
     user = db.relationship('User', backref='firewall_rules')
     session = db.relationship('UserSession', backref='firewall_rule', uselist=False)
@@ -199,12 +301,27 @@ class SystemLog(db.Model):
     ip_address = db.Column(db.String(45))
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
+    __table_args__ = (
+        # Atividade recente do usuário (registros anteriores ao particionamento)
+        db.Index('ix_system_logs_user_created', 'user_id', 'created_at'),
+    )
+    
     # Relacionamento
     user = db.relationship('User', backref='system_logs')
     
     @classmethod
     def log(cls, level, message, module, user_id=None, ip_address=None):
-        """Método para criar log no sistema"""
+        """Método para criar log no sistema
+        
+        Com a aplicação ativa, o registro é entregue ao gravador assíncrono
+        (app.system_log_writer) e gravado em lote por outra thread: nenhum
+        commit é feito na sessão do chamador e nada é retornado.
+        """
+        writer = getattr(current_app, 'system_log_writer', None) if has_app_context() else None
+        if writer is not None:
+            writer.write(level, message, module, user_id=user_id, ip_address=ip_address)
+            return None
+        
         log_entry = cls(
             level=level,
             message=message,
@@ -218,3 +335,160 @@ class SystemLog(db.Model):
     
     def __repr__(self):
         return f'<SystemLog {self.level} - {self.module}>'
+
+
+def increment_counters(connection, table, keys, rows, column='count'):
+    """Soma o valor de cada linha ao contador existente (upsert), criando os que faltarem"""
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=keys,
+            set_={column: table.c[column] + statement.excluded[column]}
+        ), rows)
+        return
+    
+    for row in rows:
+        result = connection.execute(table.update().where(
+            *(table.c[key] == row[key] for key in keys)
+        ).values({column: table.c[column] + row[column]}))
+        if result.rowcount == 0:
+            connection.execute(table.insert(), row)
+
+class RequestCounter(db.Model):
+    """Model para contadores de requisições por minuto, endpoint e status"""
+    __tablename__ = 'request_counters'
+    __table_args__ = (
+        db.UniqueConstraint('minute', 'endpoint', 'status', name='uq_request_counter'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    minute = db.Column(db.DateTime, nullable=False, index=True)
+    endpoint = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    @classmethod
+    def increment(cls, connection, counters):
+        """Soma {(minuto, endpoint, status): quantidade} aos contadores existentes"""
+        rows = [
+            {'minute': minute, 'endpoint': endpoint, 'status': status, 'count': count}
+            for (minute, endpoint, status), count in counters.items()
+        ]
+        increment_counters(connection, cls.__table__, ['minute', 'endpoint', 'status'], rows)
+    
+    def __repr__(self):
+        return f'<RequestCounter {self.minute} {self.endpoint} {self.status}={self.count}>'
+
+class StatCounter(db.Model):
+    """Model para contadores agregados das estatísticas (evita COUNT(*) nas tabelas)
+    
+    Nomes: users.total, users.confirmed, sessions.active, rules.total,
+    rules.active, logs.total e logs.day.AAAAMMDD (registros de log do dia).
+    """
+    __tablename__ = 'stat_counters'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    @classmethod
+    def increment(cls, connection, deltas):
+        """Soma {nome: delta} aos contadores, na transação da conexão informada"""
+        rows = [{'name': name, 'value': delta} for name, delta in deltas.items() if delta]
+        if rows:
+            increment_counters(connection, cls.__table__, ['name'], rows, column='value')
+    
+    @classmethod
+    def discard_before(cls, connection, prefix, name):
+        """Remove os contadores com o prefixo cujo nome é anterior a name (ex.: dias já descartados)"""
+        column = cls.__table__.c.name
+        connection.execute(cls.__table__.delete().where(column.startswith(prefix), column < name))
+    
+    @classmethod
+    def values(cls, names, connection=None):
+        """Valores dos contadores pedidos (ausentes valem 0) em uma única consulta
+        
+        Com connection, a leitura é feita na transação dessa conexão.
+        """
+        if connection is None:
+            found = dict(db.session.query(cls.name, cls.value).filter(cls.name.in_(names)))
+        else:
+            table = cls.__table__
+            found = dict(connection.execute(
+                db.select(table.c.name, table.c.value).where(table.c.name.in_(names))
+            ).all())
+        return {name: found.get(name, 0) for name in names}
+    
+    def __repr__(self):
+        return f'<StatCounter {self.name}={self.value}>'
+
+class EmailOutbox(db.Model):
+    """Model para a fila persistente de emails (outbox)
+    
+    O email é gravado na mesma transação da alteração que o originou
+    (registro, aprovação, blacklist...) e entregue depois pelo app.email_worker,
+    que reivindica lotes com prazo (lease_until): se o processo morrer no meio
+    do envio, o prazo vence e outro worker reenvia.
+    """
+    __tablename__ = 'email_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    email_type = db.Column(db.String(50), nullable=False, default='genérico')
+    # Emails por template (app.email_templates) guardam só o tipo e as variáveis (JSON):
+    # assunto e corpos são renderizados pelo worker no envio
+    template = db.Column(db.String(50))
+    context = db.Column(db.Text)
+    subject = db.Column(db.String(255))
+    sender = db.Column(db.String(255))
+    recipients = db.Column(db.Text, nullable=False)  # separados por vírgula
+    text_body = db.Column(db.Text)
+    html_body = db.Column(db.Text)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, sent, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    lease_until = db.Column(db.DateTime)
+    lease_owner = db.Column(db.String(64))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        # Próximos emails a entregar: apenas os pendentes
+        db.Index('ix_email_outbox_pending', 'next_attempt_at',
+                 sqlite_where=db.text("status = 'pending'"), postgresql_where=db.text("status = 'pending'")),
+        # Retenção dos já processados
+        db.Index('ix_email_outbox_status_created', 'status', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f'<EmailOutbox {self.id} {self.email_type} {self.status}>'
+
+class AdminDigestEvent(db.Model):
+    """Model para eventos destinados ao administrador (novos registros, blacklist)
+    
+    O primeiro evento de cada tipo gera email imediato (status immediate); os
+    seguintes dentro da janela ficam pendentes (pending) até o resumo
+    (digested) enviado pelo app.admin_digest.
+    """
+    __tablename__ = 'admin_digest_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    digest_type = db.Column(db.String(50), nullable=False)
+    user_email = db.Column(db.String(120))
+    ip_address = db.Column(db.String(45))
+    status = db.Column(db.String(20), default='pending', nullable=False)  # immediate, pending, digested
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        # Evento recente do tipo (decide entre envio imediato e resumo)
+        db.Index('ix_admin_digest_events_type_created', 'digest_type', 'created_at'),
+        # Eventos pendentes de resumo
+        db.Index('ix_admin_digest_events_type_status', 'digest_type', 'status', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f'<AdminDigestEvent {self.digest_type} {self.user_email} {self.status}>'
@@ -0,0 +1,113 @@
+"""
+Paginação por cursor (keyset) e respostas JSON/NDJSON em streaming
+"""
+import json
+import base64
+import logging
+from datetime import datetime
+from typing import Callable, Iterable, Optional, Tuple
+
+from flask import Response, current_app, request, stream_with_context
+from sqlalchemy import and_, or_
+
+logger = logging.getLogger(__name__)
+
+# Formatos aceitos em ?stream=
+STREAM_FORMATS = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
+# Linhas lidas do cursor do banco por vez no modo streaming
+STREAM_BATCH = 500
+
+Cursor = Tuple[datetime, int]
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Cursor opaco da posição (created_at, id) do último registro da página"""
+    raw = f"{created_at.isoformat()}|{row_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Cursor]:
+    """Posição (created_at, id) do cursor; ValueError se o cursor for inválido"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+        created_at, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f'Cursor inválido: {token}') from e
+
+
+def before(created_column, id_column, cursor: Optional[Cursor]):
+    """Critério dos registros anteriores ao cursor na ordem (created_at DESC, id DESC)"""
+    if cursor is None:
+        return None
+    created_at, row_id = cursor
+    return or_(created_column < created_at, and_(created_column == created_at, id_column < row_id))
+
+
+def page_args(default: Optional[int] = None):
+    """(cursor, limite, formato de streaming) dos parâmetros da requisição
+
+    O limite vem de ?limit=, restrito a API_PAGE_MAX; ?stream=json|ndjson
+    pede a listagem completa em streaming (sem limite). ValueError para
+    cursor, limite ou formato inválidos.
+    """
+    cursor = decode_cursor(request.args.get('cursor'))
+    limit = request.args.get('limit', type=int)
+    if limit is None:
+        limit = default or current_app.config.get('API_PAGE_SIZE', 50)
+    if limit <= 0:
+        raise ValueError(f'Limite inválido: {limit}')
+    limit = min(limit, current_app.config.get('API_PAGE_MAX', 500))
+    stream = request.args.get('stream')
+    if stream is not None and stream not in STREAM_FORMATS:
+        raise ValueError(f'Formato de streaming inválido: {stream}')
+    return cursor, limit, stream
+
+
+def keyset_page(query, created_column, id_column, cursor: Optional[Cursor], limit: int):
+    """Uma página da consulta ORM na ordem (created_at DESC, id DESC) e o cursor da próxima"""
+    criteria = before(created_column, id_column, cursor)
+    if criteria is not None:
+        query = query.filter(criteria)
+    rows = query.order_by(created_column.desc(), id_column.desc()).limit(limit + 1).all()
+    return page_of(rows, limit)
+
+
+def page_of(rows: list, limit: int):
+    """Separa a página (limit registros) do indicador de próxima página"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+def stream_query(query, created_column, id_column, cursor: Optional[Cursor] = None):
+    """Itera a consulta ORM inteira com cursor do servidor, STREAM_BATCH linhas por vez"""
+    criteria = before(created_column, id_column, cursor)
+    if criteria is not None:
+        query = query.filter(criteria)
+    return query.order_by(created_column.desc(), id_column.desc()).yield_per(STREAM_BATCH)
+
+
+def stream_response(rows: Iterable, serialize: Callable, fmt: str, key: str) -> Response:
+    """Resposta em streaming: NDJSON (um objeto por linha) ou JSON {key: [...]}
+
+    Os registros são serializados à medida que saem do cursor do banco: a
+    memória usada não depende do tamanho da listagem e o primeiro byte sai
+    antes da consulta terminar.
+    """
+    def generate():
+        if fmt == 'ndjson':
+            for row in rows:
+                yield json.dumps(serialize(row), ensure_ascii=False) + '\n'
+            return
+        yield '{"%s": [' % key
+        separator = ''
+        for row in rows:
+            yield separator + json.dumps(serialize(row), ensure_ascii=False)
+            separator = ','
+        yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype=STREAM_FORMATS[fmt])
@@ -0,0 +1,189 @@
+"""
+Persistência das regras do firewall com escrita agrupada (debounce)
+"""
+import os
+import re
+import time
+import atexit
+import logging
+import tempfile
+import threading
+import subprocess
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Contadores das chains ([pacotes:bytes]) mudam a cada dump e não fazem parte do ruleset
+_COUNTERS_RE = re.compile(r'\[\d+:\d+\]')
+# Prazos por elemento (ipset save / nft list) diminuem a cada dump
+_TIMEOUTS_RE = re.compile(r' (?:timeout|expires) \S+?(?=[\s,}]|$)')
+
+
+class RulesetPersister:
+    """Agenda a gravação do ruleset em disco no máximo uma vez por janela
+
+    Cada alteração no firewall apenas marca o ruleset como sujo. A gravação
+    acontece em uma thread temporizada ao fim da janela configurada (ou na
+    finalização do processo), é atômica (arquivo temporário + rename) e é
+    ignorada quando o conteúdo serializado é idêntico ao que já está em disco,
+    desconsiderando os prazos restantes das entradas com timeout (o arquivo
+    mantém os prazos da última gravação). Uma gravação que falha deixa o
+    ruleset sujo e é tentada de novo na janela seguinte.
+    """
+
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self.targets: List[Tuple[List[str], str]] = []
+        self.enabled = True
+        self._dirty = False
+        self._timer: Optional[threading.Timer] = None
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._atexit_registered = False
+
+    def configure(self, targets: List[Tuple[List[str], str]], interval: float, enabled: bool = True):
+        """Define os comandos de dump e os arquivos de destino"""
+        self.targets = targets
+        self.interval = interval
+        self.enabled = enabled
+        if not self._atexit_registered:
+            atexit.register(self.shutdown)
+            self._atexit_registered = True
+
+    def _reset_after_fork(self):
+        """Descarta o timer herdado do processo pai (ex.: workers do gunicorn)"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._timer = None
+            self._lock = threading.Lock()
+            self._flush_lock = threading.Lock()
+
+    def mark_dirty(self):
+        """Marca o ruleset como alterado e agenda uma gravação"""
+        if not self.enabled:
+            logger.info("[SIMULAÇÃO - FIREWALL DESLIGADO] Salvando regras do firewall (simulado)")
+            return
+
+        self._reset_after_fork()
+        if self.interval <= 0:
+            # Sem janela configurada: gravação síncrona
+            self._dirty = True
+            self.flush()
+            return
+
+        with self._lock:
+            self._dirty = True
+            self._schedule()
+
+    def _schedule(self):
+        """Agenda a gravação para o fim da janela (chamar com _lock)"""
+        if self._timer is not None:
+            # Já existe gravação agendada; ela incluirá esta alteração
+            return
+
+        delay = max(0.0, self._last_flush + self.interval - time.monotonic())
+        self._timer = threading.Timer(delay, self._timer_flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _timer_flush(self):
+        with self._lock:
+            self._timer = None
+        self.flush()
+
+    def flush(self) -> bool:
+        """Grava imediatamente o ruleset, se houver alterações pendentes"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return True
+                self._dirty = False
+
+            self._last_flush = time.monotonic()
+            success = True
+            for command, path in self.targets:
+                if not self._dump_to_file(command, path):
+                    success = False
+
+            if success:
+                logger.info("Regras do firewall salvas")
+            else:
+                # A alteração continua pendente: nova tentativa na próxima janela
+                with self._lock:
+                    self._dirty = True
+                    if self.interval > 0:
+                        self._schedule()
+            return success
+
+    def shutdown(self):
+        """Cancela o timer pendente e grava alterações restantes"""
+        timer = self._timer
+        if timer is not None:
+            timer.cancel()
+            self._timer = None
+        if self.enabled:
+            self.flush()
+
+    @staticmethod
+    def _normalize(output: str) -> str:
+        """Remove comentários com data/hora e zera contadores para comparação estável"""
+        lines = []
+        for line in output.splitlines():
+            if line.startswith('#'):
+                continue
+            if line.startswith(':'):
+                line = _COUNTERS_RE.sub('[0:0]', line)
+            lines.append(line)
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _without_timeouts(content: bytes) -> bytes:
+        """Conteúdo sem os prazos restantes por elemento, usado apenas na comparação"""
+        return _TIMEOUTS_RE.sub('', content.decode('utf-8', 'replace')).encode('utf-8')
+
+    def _dump_to_file(self, command: List[str], path: str) -> bool:
+        """Executa o comando de dump e grava o resultado de forma atômica"""
+        try:
+            result = subprocess.run(
+                command,
+                capture_output=True,
+                text=True,
+                timeout=10,
+                check=False
+            )
+            if result.returncode != 0:
+                logger.warning(f"Falha ao salvar regras: {' '.join(command)} - {result.stderr}")
+                return False
+
+            content = self._normalize(result.stdout).encode('utf-8')
+
+            # Pular gravação quando o conteúdo em disco já é idêntico (exceto pelos prazos)
+            try:
+                with open(path, 'rb') as f:
+                    if self._without_timeouts(f.read()) == self._without_timeouts(content):
+                        logger.debug(f"Regras inalteradas, gravação ignorada: {path}")
+                        return True
+            except FileNotFoundError:
+                pass
+
+            directory = os.path.dirname(path) or '.'
+            fd, tmp_path = tempfile.mkstemp(prefix='.rules-', dir=directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(content)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.chmod(tmp_path, 0o640)
+                os.replace(tmp_path, path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+
+            logger.info(f"Regras gravadas em {path}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Erro ao salvar regras em {path}: {str(e)}")
+            return False
@@ -0,0 +1,226 @@
+"""
+Reconciliador do firewall orientado a eventos
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+
+logger = logging.getLogger(__name__)
+
+# Evento de alteração de regra: action é 'add', 'remove' ou 'refresh' (renovar o prazo
+# da entrada após estender a sessão), tipo é 'whitelist' ou 'blacklist'
+FirewallEvent = namedtuple('FirewallEvent', ['action', 'tipo', 'ip_address', 'rule_id'])
+
+_STOP = object()
+
+
+class FirewallReconciler:
+    """Aplica no firewall as alterações de regras assim que elas acontecem
+
+    As rotas (login, logout, encerramento de sessão e painel admin) enviam
+    eventos para uma fila em memória. Uma thread dedicada agrupa os eventos
+    em lotes pequenos (até FIREWALL_RECONCILE_BATCH_SIZE eventos ou
+    FIREWALL_RECONCILE_LATENCY_MS de espera), aplica cada lote em uma única
+    transação do FirewallManager e marca iptables_rule_added nas regras
+    aplicadas. A sincronização periódica completa permanece como rede de
+    segurança para eventos perdidos (ex.: reinício do processo).
+
+    Quando o backend suporta timeouts, cada IP da whitelist é aplicado com o
+    tempo restante da sessão ativa mais longa daquele IP, e o kernel remove
+    a entrada sozinho quando ela vence.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.batch_size = 50
+        self.max_latency = 0.05
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura o reconciliador com as configurações da aplicação"""
+        self.app = app
+        self.batch_size = app.config.get('FIREWALL_RECONCILE_BATCH_SIZE', 50)
+        self.max_latency = app.config.get('FIREWALL_RECONCILE_LATENCY_MS', 50) / 1000.0
+        atexit.register(self.shutdown)
+
+    def _ensure_started(self):
+        """Inicia a thread sob demanda (também após fork dos workers do gunicorn)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = None
+                self._pid = os.getpid()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='firewall-reconciler', daemon=True)
+                self._thread.start()
+
+    def submit(self, action: str, tipo: str, ip_address: str, rule_id: Optional[int] = None):
+        """Enfileira uma alteração de regra para aplicação imediata"""
+        self._ensure_started()
+        self._queue.put(FirewallEvent(action, tipo, ip_address, rule_id))
+
+    def flush(self):
+        """Bloqueia até que todos os eventos enfileirados tenham sido aplicados"""
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def shutdown(self):
+        """Aplica os eventos pendentes e encerra a thread"""
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout=10)
+
+    def _run(self):
+        """Loop da thread: agrupa eventos em lotes e os aplica"""
+        while True:
+            event = self._queue.get()
+            if event is _STOP:
+                self._queue.task_done()
+                return
+
+            batch = [event]
+            stop = False
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if event is _STOP:
+                    stop = True
+                    break
+                batch.append(event)
+
+            try:
+                self._apply_batch(batch)
+            except Exception as e:
+                logger.error(f"Erro ao aplicar lote de {len(batch)} eventos do firewall: {str(e)}")
+            finally:
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self._queue.task_done()
+
+            if stop:
+                return
+
+    def _session_timeouts(self, ips) -> Dict[str, int]:
+        """Tempo restante da sessão ativa mais longa de cada IP (uma única consulta)"""
+        from app.firewall import session_timeout
+        from app.models import FirewallRule, UserSession, db
+
+        if not ips:
+            return {}
+        now = datetime.utcnow()
+        rows = db.session.query(FirewallRule.ip_address, func.max(UserSession.expires_at)).join(
+            UserSession, FirewallRule.session_id == UserSession.id
+        ).filter(
+            FirewallRule.ip_address.in_(ips),
+            FirewallRule.tipo == 'whitelist',
+            FirewallRule.is_active == True,
+            UserSession.is_active == True
+        ).group_by(FirewallRule.ip_address)
+        return {ip_address: session_timeout(expires_at, now) for ip_address, expires_at in rows if expires_at}
+
+    def _apply_batch(self, batch: List[FirewallEvent]):
+        """Aplica um lote de eventos em uma única transação do firewall"""
+        from app.models import FirewallRule, db
+
+        with self.app.app_context():
+            # Adição e remoção da mesma regra no mesmo lote se anulam
+            added_ids = {event.rule_id for event in batch if event.action == 'add'}
+            removed_ids = {event.rule_id for event in batch if event.action == 'remove'}
+            cancelled = (added_ids & removed_ids) - {None}
+            events = [event for event in batch if event.rule_id not in cancelled]
+            if not events:
+                return
+
+            # Regras ativas já aplicadas para os IPs do lote (uma única consulta)
+            ips = {event.ip_address for event in events}
+            applied = {
+                (tipo, ip_address)
+                for tipo, ip_address in db.session.query(FirewallRule.tipo, FirewallRule.ip_address).filter(
+                    FirewallRule.ip_address.in_(ips),
+                    FirewallRule.is_active == True,
+                    FirewallRule.iptables_rule_added == True
+                )
+            }
+            removed_rules = {
+                rule_id: iptables_rule_added
+                for rule_id, iptables_rule_added in db.session.query(
+                    FirewallRule.id, FirewallRule.iptables_rule_added
+                ).filter(FirewallRule.id.in_(removed_ids - {None}))
+            }
+
+            mark_added = []
+            firewall_manager = self.app.firewall_manager
+            timeouts = {}
+            if firewall_manager.supports_timeouts:
+                timeouts = self._session_timeouts({event.ip_address for event in events if event.tipo == 'whitelist'})
+
+            # A blacklist é aplicada como set compilado (deduplicado e agregado em CIDRs)
+            blacklist_events = [event for event in events if event.tipo == 'blacklist']
+            events = [event for event in events if event.tipo != 'blacklist']
+
+            with firewall_manager.transaction() as tx:
+                for event in events:
+                    key = (event.tipo, event.ip_address)
+                    timeout = timeouts.get(event.ip_address) if event.tipo == 'whitelist' else None
+                    if event.action == 'add':
+                        # IP já coberto por outra regra ativa não gera nova regra (apenas renova o prazo)
+                        if key not in applied or timeout is not None:
+                            tx.add_ip(event.ip_address, tipo=event.tipo, timeout=timeout)
+                            applied.add(key)
+                        if event.rule_id is not None:
+                            mark_added.append(event.rule_id)
+                    elif event.action == 'refresh':
+                        if timeout is not None:
+                            tx.add_ip(event.ip_address, tipo=event.tipo, timeout=timeout)
+                    elif event.action == 'remove':
+                        # Só remover o que foi aplicado e não é mais usado por outra regra ativa
+                        if key not in applied and removed_rules.get(event.rule_id, event.rule_id is None):
+                            tx.remove_ip(event.ip_address, tipo=event.tipo)
+                        elif key in applied and timeout is not None:
+                            # Ainda liberado por outra sessão: o prazo passa a ser o dela
+                            tx.add_ip(event.ip_address, tipo=event.tipo, timeout=timeout)
+
+            if not tx.success:
+                mark_added = []
+
+            success = tx.success
+            if blacklist_events:
+                if firewall_manager.apply_blacklist():
+                    mark_added.extend(
+                        event.rule_id for event in blacklist_events
+                        if event.action == 'add' and event.rule_id is not None
+                    )
+                else:
+                    success = False
+
+            if mark_added:
+                FirewallRule.query.filter(
+                    FirewallRule.id.in_(mark_added),
+                    FirewallRule.is_active == True
+                ).update({FirewallRule.iptables_rule_added: True}, synchronize_session=False)
+                db.session.commit()
+
+            logger.info(
+                f"Reconciliador aplicou lote de {len(events) + len(blacklist_events)} eventos (sucesso={success})"
+            )
@@ -0,0 +1,176 @@
+"""
+Política de registro das requisições: nível mínimo, amostragem e contadores por minuto
+"""
+import os
+import atexit
+import random
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+
+from flask import request, session
+
+logger = logging.getLogger(__name__)
+
+_LEVELS = {'DEBUG': logging.DEBUG, 'INFO': logging.INFO, 'WARNING': logging.WARNING,
+           'ERROR': logging.ERROR, 'CRITICAL': logging.CRITICAL}
+
+
+def parse_rates(value: Optional[str]) -> Dict[str, float]:
+    """Converte 'api.api_status=0,main.dashboard=0.1' em {endpoint: taxa}"""
+    rates = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        endpoint, rate = (part.strip() for part in item.split('=', 1))
+        try:
+            rates[endpoint] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            logger.warning(f"Taxa de amostragem inválida ignorada: {item}")
+    return rates
+
+
+class RequestLogPolicy:
+    """Decide quais requisições viram registro em system_logs
+
+    Toda requisição é contada em memória por (minuto, endpoint, status) e os
+    contadores são gravados periodicamente na tabela request_counters. Um
+    registro individual só é gravado quando:
+      - o endpoint está em REQUEST_LOG_ALWAYS (por padrão, 'auth.'), ou
+      - o nível da requisição (DEBUG para 2xx/3xx, WARNING para 4xx, ERROR
+        para 5xx) atinge REQUEST_LOG_LEVEL e a amostragem do endpoint
+        (REQUEST_LOG_SAMPLING / REQUEST_LOG_SAMPLE_RATE) o seleciona.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.threshold = logging.INFO
+        self.default_rate = 1.0
+        self.rates: Dict[str, float] = {}
+        self.always = ('auth.',)
+        self.flush_interval = 60.0
+        self._counters: Counter = Counter()
+        self._counters_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop: Optional[threading.Event] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura a política e registra o hook after_request"""
+        self.app = app
+        level = str(app.config.get('REQUEST_LOG_LEVEL') or app.config.get('LOG_LEVEL', 'INFO')).upper()
+        self.threshold = _LEVELS.get(level, logging.INFO)
+        self.default_rate = app.config.get('REQUEST_LOG_SAMPLE_RATE', 1.0)
+        self.rates = parse_rates(app.config.get('REQUEST_LOG_SAMPLING'))
+        self.always = tuple(
+            prefix.strip() for prefix in app.config.get('REQUEST_LOG_ALWAYS', 'auth.').split(',') if prefix.strip()
+        )
+        self.flush_interval = app.config.get('REQUEST_COUNTER_FLUSH_S', 60)
+        app.after_request(self.after_request)
+        atexit.register(self.shutdown)
+
+    def _ensure_started(self):
+        """Inicia a thread de gravação dos contadores (também após fork dos workers)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Contadores herdados do processo pai pertencem ao pai
+                with self._counters_lock:
+                    self._counters = Counter()
+                self._thread = None
+                self._pid = os.getpid()
+            if self._thread is None or not self._thread.is_alive():
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._run, name='request-counters', daemon=True)
+                self._thread.start()
+
+    def sample_rate(self, endpoint: str) -> float:
+        """Taxa do endpoint exato, senão do blueprint ('api.'), senão a padrão"""
+        if endpoint in self.rates:
+            return self.rates[endpoint]
+        blueprint = endpoint.split('.', 1)[0] + '.'
+        return self.rates.get(blueprint, self.default_rate)
+
+    @staticmethod
+    def level_for(status: int) -> str:
+        if status >= 500:
+            return 'ERROR'
+        if status >= 400:
+            return 'WARNING'
+        return 'DEBUG'
+
+    def should_log(self, endpoint: str, status: int) -> bool:
+        if endpoint.startswith(self.always):
+            return True
+        if _LEVELS[self.level_for(status)] < self.threshold:
+            return False
+        rate = self.sample_rate(endpoint)
+        return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+    def count(self, endpoint: str, status: int, when: Optional[datetime] = None):
+        """Soma a requisição no contador do minuto corrente"""
+        minute = (when or datetime.utcnow()).replace(second=0, microsecond=0)
+        with self._counters_lock:
+            self._counters[(minute, endpoint, status)] += 1
+
+    def after_request(self, response):
+        endpoint = request.endpoint
+        if not endpoint or endpoint.startswith('static'):
+            return response
+
+        try:
+            self._ensure_started()
+            status = response.status_code
+            self.count(endpoint, status)
+            if self.should_log(endpoint, status):
+                from app.models import SystemLog
+                is_api = endpoint.startswith('api.')
+                SystemLog.log(
+                    level=self.level_for(status),
+                    message=f"{'API' if is_api else 'Requisição'}: {request.method} {request.path} -> {status}",
+                    module='api_request' if is_api else 'request',
+                    user_id=session.get('user_id'),
+                    ip_address=request.remote_addr
+                )
+        except Exception as e:
+            logger.error(f"Erro ao registrar requisição: {str(e)}")
+        return response
+
+    def _run(self):
+        stop = self._stop
+        while not stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> int:
+        """Grava os contadores acumulados (soma aos já existentes no mesmo minuto)"""
+        with self._counters_lock:
+            counters, self._counters = self._counters, Counter()
+        if not counters:
+            return 0
+
+        from app.models import RequestCounter, db
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    RequestCounter.increment(connection, counters)
+            return len(counters)
+        except Exception as e:
+            logger.error(f"Falha ao gravar {len(counters)} contadores de requisições: {str(e)}")
+            # Devolver os contadores para a próxima tentativa
+            with self._counters_lock:
+                self._counters.update(counters)
+            return 0
+
+    def shutdown(self):
+        """Interrompe a thread e grava os contadores pendentes"""
+        if self._pid != os.getpid():
+            return
+        if self._stop is not None:
+            self._stop.set()
+        self.flush()
@@ -2,9 +2,12 @@
 API routes para o sistema
 """
 import logging
-from flask import Blueprint, jsonify, session, request, current_app
+from flask import Blueprint, jsonify, session, current_app, g
 from app import limiter
-from app.models import User, UserSession, FirewallRule, SystemLog, db
+from app.models import User, UserSession, FirewallRule, SystemLog, db, sqlite_wal_size
+from app.stats import stat_values, logs_today
+from app.pagination import page_args, keyset_page, page_of, stream_query, stream_response
+from sqlalchemy.orm import joinedload
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -28,26 +31,14 @@ def user_session_info():
     if 'user_id' not in session:
         return jsonify({'error': 'Não autenticado'}), 401
     
-    user = User.query.get(session['user_id'])
-    if not user:
-        return jsonify({'error': 'Usuário não encontrado'}), 404
-    
-    # Buscar sessão atual
-    current_session = UserSession.query.filter_by(
-        user_id=user.id,
-        session_token=session.get('session_token'),
-        is_active=True
-    ).first()
-    
-    if not current_session:
+    # Sessão atual já validada em before_request (inclui os dados do usuário)
+    current_session = g.get('user_session')
+    if current_session is None:
         return jsonify({'error': 'Sessão não encontrada'}), 404
     
-    if current_session.is_expired():
-        return jsonify({'error': 'Sessão expirada'}), 401
-    
     return jsonify({
-        'user_id': user.id,
-        'email': user.email,
+        'user_id': current_session.user_id,
+        'email': current_session.email,
         'ip_address': current_session.ip_address,
         'login_time': current_session.created_at.isoformat(),
         'expires_at': current_session.expires_at.isoformat(),
@@ -55,10 +46,43 @@ def user_session_info():
         'time_remaining': (current_session.expires_at - datetime.utcnow()).total_seconds()
     })
 
+def _session_data(sess, current_token=None):
+    return {
+        'id': sess.id,
+        'ip_address': sess.ip_address,
+        'user_agent': sess.user_agent,
+        'created_at': sess.created_at.isoformat(),
+        'expires_at': sess.expires_at.isoformat(),
+        'is_current': sess.session_token == current_token,
+        'time_remaining': (sess.expires_at - datetime.utcnow()).total_seconds()
+    }
+
+def _log_data(log):
+    return {
+        'id': log.id,
+        'level': log.level,
+        'message': log.message,
+        'module': log.module,
+        'ip_address': log.ip_address,
+        'created_at': log.created_at.isoformat()
+    }
+
+def _rule_data(rule):
+    return {
+        'id': rule.id,
+        'ip_address': rule.ip_address,
+        'tipo': rule.tipo,
+        'chain': rule.chain,
+        'user_email': rule.user.email if rule.user else None,
+        'session_id': rule.session_id,
+        'iptables_rule_added': rule.iptables_rule_added,
+        'created_at': rule.created_at.isoformat()
+    }
+
 @bp.route('/user/sessions')
 @limiter.limit("30 per minute")
 def user_sessions():
-    """Lista todas as sessões do usuário"""
+    """Lista as sessões ativas do usuário (paginação por cursor ou streaming)"""
     if 'user_id' not in session:
         return jsonify({'error': 'Não autenticado'}), 401
     
@@ -66,27 +90,60 @@ def user_sessions():
     if not user:
         return jsonify({'error': 'Usuário não encontrado'}), 404
     
+    try:
+        cursor, limit, stream = page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     # Buscar sessões ativas
     active_sessions = UserSession.query.filter_by(
         user_id=user.id,
         is_active=True
-    ).filter(UserSession.expires_at > datetime.utcnow()).all()
-    
-    sessions_data = []
-    for sess in active_sessions:
-        sessions_data.append({
-            'id': sess.id,
-            'ip_address': sess.ip_address,
-            'user_agent': sess.user_agent,
-            'created_at': sess.created_at.isoformat(),
-            'expires_at': sess.expires_at.isoformat(),
-            'is_current': sess.session_token == session.get('session_token'),
-            'time_remaining': (sess.expires_at - datetime.utcnow()).total_seconds()
-        })
+    ).filter(UserSession.expires_at > datetime.utcnow())
+    current_token = session.get('session_token')
+    
+    if stream:
+        rows = stream_query(active_sessions, UserSession.created_at, UserSession.id, cursor)
+        return stream_response(rows, lambda sess: _session_data(sess, current_token), stream, 'active_sessions')
+    
+    page, next_cursor = keyset_page(active_sessions, UserSession.created_at, UserSession.id, cursor, limit)
+    sessions_data = [_session_data(sess, current_token) for sess in page]
     
     return jsonify({
         'active_sessions': sessions_data,
-        'total_active': len(sessions_data)
+        # Total de sessões ativas do usuário (não apenas as da página)
+        'total_active': active_sessions.order_by(None).count(),
+        'next_cursor': next_cursor
+    })
+
+@bp.route('/firewall/rules')
+@limiter.limit("10 per minute")
+def firewall_rules():
+    """Regras ativas do firewall (apenas administradores; paginação por cursor ou streaming)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Não autenticado'}), 401
+    
+    user = User.query.get(session['user_id'])
+    if not user or not user.is_admin():
+        return jsonify({'error': 'Acesso restrito ao administrador'}), 403
+    
+    try:
+        cursor, limit, stream = page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Usuário carregado na mesma consulta (sem uma consulta por regra)
+    rules = FirewallRule.query.options(joinedload(FirewallRule.user)).filter(FirewallRule.is_active == True)
+    
+    if stream:
+        rows = stream_query(rules, FirewallRule.created_at, FirewallRule.id, cursor)
+        return stream_response(rows, _rule_data, stream, 'rules')
+    
+    page, next_cursor = keyset_page(rules, FirewallRule.created_at, FirewallRule.id, cursor, limit)
+    return jsonify({
+        'rules': [_rule_data(rule) for rule in page],
+        'count': len(page),
+        'next_cursor': next_cursor
     })
 
 @bp.route('/firewall/allowed-ips')
@@ -118,22 +175,28 @@ def system_stats():
         return jsonify({'error': 'Não autenticado'}), 401
     
     try:
+        # Contadores mantidos nos caminhos de escrita: uma única consulta
+        today = logs_today()
+        counters = stat_values('users.total', 'users.confirmed', 'sessions.active',
+                               'rules.active', 'rules.total', 'logs.total', today)
         stats = {
             'users': {
-                'total': User.query.count(),
-                'confirmed': User.query.filter_by(confirmed=True).count(),
-                'active_sessions': UserSession.query.filter_by(is_active=True).count()
+                'total': counters['users.total'],
+                'confirmed': counters['users.confirmed'],
+                'active_sessions': counters['sessions.active']
             },
             'firewall': {
-                'active_rules': FirewallRule.query.filter_by(is_active=True).count(),
-                'total_rules': FirewallRule.query.count()
+                'active_rules': counters['rules.active'],
+                'total_rules': counters['rules.total']
             },
             'logs': {
-                'total': SystemLog.query.count(),
-                'today': SystemLog.query.filter(
-                    SystemLog.created_at >= datetime.utcnow().date()
-                ).count()
+                'total': counters['logs.total'],
+                'today': counters[today]
+            },
+            'database': {
+                'wal_size_bytes': sqlite_wal_size()
             },
+            'email': current_app.email_worker.stats(),
             'timestamp': datetime.utcnow().isoformat()
         }
         
@@ -150,18 +213,10 @@ def extend_session():
     if 'user_id' not in session:
         return jsonify({'error': 'Não autenticado'}), 401
     
-    user = User.query.get(session['user_id'])
-    if not user:
-        return jsonify({'error': 'Usuário não encontrado'}), 404
-    
-    # Buscar sessão atual
-    current_session = UserSession.query.filter_by(
-        user_id=user.id,
-        session_token=session.get('session_token'),
-        is_active=True
-    ).first()
-    
-    if not current_session:
+    # Sessão atual já validada em before_request
+    cached_session = g.get('user_session')
+    current_session = db.session.get(UserSession, cached_session.session_id) if cached_session else None
+    if not current_session or not current_session.is_active:
         return jsonify({'error': 'Sessão não encontrada'}), 404
     
     if current_session.is_expired():
@@ -171,13 +226,17 @@ def extend_session():
         # Estender sessão por mais 24 horas
         current_session.extend_session(hours=24)
         db.session.commit()
+        current_app.session_cache.invalidate(current_session.session_token, current_session.user_id)
+        
+        # Renovar o prazo da liberação no firewall (entrada com timeout no kernel)
+        current_app.firewall_reconciler.submit('refresh', 'whitelist', current_session.ip_address)
         
         # Log da extensão
         SystemLog.log(
             level='INFO',
             message=f'Sessão estendida - IP: {current_session.ip_address}',
             module='api_extend',
-            user_id=user.id,
+            user_id=current_session.user_id,
             ip_address=current_session.ip_address
         )
         
@@ -195,7 +254,7 @@ def extend_session():
 @bp.route('/user/activity')
 @limiter.limit("10 per minute")
 def user_activity():
-    """Atividade recente do usuário"""
+    """Atividade recente do usuário (paginação por cursor ou streaming)"""
     if 'user_id' not in session:
         return jsonify({'error': 'Não autenticado'}), 401
     
@@ -203,25 +262,25 @@ def user_activity():
     if not user:
         return jsonify({'error': 'Usuário não encontrado'}), 404
     
-    # Buscar logs recentes do usuário
-    recent_logs = SystemLog.query.filter_by(
-        user_id=user.id
-    ).order_by(SystemLog.created_at.desc()).limit(20).all()
-    
-    activity_data = []
-    for log in recent_logs:
-        activity_data.append({
-            'id': log.id,
-            'level': log.level,
-            'message': log.message,
-            'module': log.module,
-            'ip_address': log.ip_address,
-            'created_at': log.created_at.isoformat()
-        })
+    try:
+        cursor, limit, stream = page_args(default=20)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if stream:
+        rows = current_app.log_partitions.stream(user_id=user.id, cursor=cursor)
+        return stream_response(rows, _log_data, stream, 'activity')
+    
+    # Buscar logs recentes do usuário (um a mais para saber se há próxima página)
+    recent_logs, next_cursor = page_of(
+        current_app.log_partitions.recent(limit + 1, user_id=user.id, cursor=cursor), limit
+    )
+    activity_data = [_log_data(log) for log in recent_logs]
     
     return jsonify({
         'activity': activity_data,
-        'total_records': len(activity_data)
+        'total_records': len(activity_data),
+        'next_cursor': next_cursor
     })
 
 @bp.errorhandler(404)
@@ -239,15 +298,3 @@ def api_internal_error(error):
 def api_rate_limit_exceeded(error):
     """Erro de rate limit da API"""
     return jsonify({'error': 'Limite de requisições excedido. Tente novamente mais tarde.'}), 429
-
-@bp.before_request
-def api_before_request():
-    """Executado antes de cada requisição da API"""
-    # Log da requisição da API
-    SystemLog.log(
-        level='DEBUG',
-        message=f'API: {request.method} {request.path}',
-        module='api_request',
-        user_id=session.get('user_id'),
-        ip_address=request.remote_addr
-    )
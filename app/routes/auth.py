@@ -28,13 +28,12 @@ def register():
             user.generate_confirmation_token()
             user.status = 'pending'  # Usuário pendente de aprovação
             db.session.add(user)
-            db.session.commit()
+            db.session.flush()
             
-            # Enviar email para o usuário
+            # Emails gravados na outbox na mesma transação do registro
             send_registration_received_email(user)
-            
-            # Enviar email para o admin
             send_admin_new_registration_email(user)
+            db.session.commit()
             
             # Log do registro
             log_user_action(
@@ -134,7 +133,14 @@ def login():
                     )
                     db.session.add(firewall_rule_v6)
                 user.record_successful_login()
+                # Notificação gravada na outbox na mesma transação do login
+                send_login_notification(user, client_ip, user_agent)
                 db.session.commit()
+                # Liberar o IP no firewall imediatamente (sem esperar a sincronização)
+                reconciler = current_app.firewall_reconciler
+                reconciler.submit('add', 'whitelist', client_ip, firewall_rule.id)
+                if ipv6_enabled and isinstance(client_ip, str) and ':' in client_ip:
+                    reconciler.submit('add', 'whitelist', client_ip, firewall_rule_v6.id)
                 session['user_id'] = user.id
                 session['session_token'] = user_session.session_token
                 session['user_email'] = user.email
@@ -152,7 +158,6 @@ def login():
                     user_id=user.id,
                     ip_address=client_ip
                 )
-                send_login_notification(user, client_ip, user_agent)
                 flash(f'Login realizado com sucesso!', 'success')
                 return redirect(url_for('main.dashboard'))
 
@@ -171,28 +176,37 @@ def login():
         else:
             # Login falhou
             if user:
-                user.record_failed_login()
+                locked = user.record_failed_login()
                 db.session.commit()
 
                 # Se atingiu 5 tentativas, bloquear usuário e IP (exceto admin)
-                if user.failed_login_attempts >= 5 and not user.is_admin():
+                if locked and not user.is_admin():
                     user.status = 'blacklist'
-                    db.session.commit()
-                    # Criar regra de blacklist
+                    # Criar regra de blacklist (uma única regra ativa por IP)
                     firewall_black_chain = current_app.config.get('FIREWALL_BLACK', 'BLACKLIST')
-                    blacklist_rule = FirewallRule(
+                    already_blacklisted = FirewallRule.query.filter_by(
                         ip_address=request.remote_addr,
-                        user_id=user.id,
-                        session_id=None,
-                        iptables_rule_added=False,
                         tipo='blacklist',
-                        chain=firewall_black_chain
-                    )
-                    db.session.add(blacklist_rule)
-                    db.session.commit()
-                    # Enviar emails
+                        is_active=True
+                    ).first() is not None
+                    blacklist_rule = None
+                    if not already_blacklisted:
+                        blacklist_rule = FirewallRule(
+                            ip_address=request.remote_addr,
+                            user_id=user.id,
+                            session_id=None,
+                            iptables_rule_added=False,
+                            tipo='blacklist',
+                            chain=firewall_black_chain
+                        )
+                        db.session.add(blacklist_rule)
+                    # Emails gravados na outbox na mesma transação da blacklist
                     send_blacklist_email_user(user, request.remote_addr)
                     send_blacklist_email_admin(user, request.remote_addr)
+                    db.session.commit()
+                    current_app.session_cache.invalidate_user(user.id)
+                    if blacklist_rule is not None:
+                        current_app.firewall_reconciler.submit('add', 'blacklist', blacklist_rule.ip_address, blacklist_rule.id)
                 
                 log_security_event(
                     event_type="Tentativa de login falhada",
@@ -245,6 +259,10 @@ def logout():
                     firewall_rule.mark_as_removed()
                 
                 db.session.commit()
+                current_app.session_cache.invalidate(user_session.session_token, user_session.user_id)
+                
+                if firewall_rule:
+                    current_app.firewall_reconciler.submit('remove', firewall_rule.tipo, firewall_rule.ip_address, firewall_rule.id)
                 
                 # Log do logout
                 log_user_action(
@@ -304,10 +322,9 @@ def confirm_email(token):
     try:
         # Confirmar email
         user.confirm_email()
-        db.session.commit()
-        
-        # Enviar email de boas-vindas
+        # Email de boas-vindas gravado na outbox na mesma transação
         send_welcome_email(user)
+        db.session.commit()
         
         # Log da confirmação
         log_user_action(
@@ -347,10 +364,9 @@ def resend_confirmation():
             try:
                 # Gerar novo token
                 user.generate_confirmation_token()
-                db.session.commit()
-                
-                # Enviar email
+                # Email gravado na outbox na mesma transação do novo token
                 send_confirmation_email(user)
+                db.session.commit()
                 
                 # Log do reenvio
                 log_user_action(
@@ -439,6 +455,10 @@ def end_session(session_id):
             firewall_rule.mark_as_removed()
         
         db.session.commit()
+        current_app.session_cache.invalidate(user_session.session_token, user_session.user_id)
+        
+        if firewall_rule:
+            current_app.firewall_reconciler.submit('remove', firewall_rule.tipo, firewall_rule.ip_address, firewall_rule.id)
         
         # Log da ação
         SystemLog.log(
@@ -2,12 +2,16 @@
 Rotas principais da aplicação
 """
 import logging
-from flask import Blueprint, render_template, session, request, redirect, url_for, flash, current_app
+from flask import Blueprint, render_template, session, request, redirect, url_for, flash, current_app, g
 from app import limiter
-from app.models import User, UserSession, SystemLog, db, FirewallRule
+from app.models import User, UserSession, db, FirewallRule
+from app.ruleset import to_network, format_network
+from app.stats import stat_values
+from app.pagination import decode_cursor, keyset_page
 from datetime import datetime
 import os
 from sqlalchemy import text
+from sqlalchemy.orm import joinedload
 
 logger = logging.getLogger(__name__)
 
@@ -42,28 +46,27 @@ def dashboard():
         flash('Sessão inválida. Faça login novamente.', 'error')
         return redirect(url_for('auth.login'))
     
-    # Buscar sessão atual
-    current_session = UserSession.query.filter_by(
-        user_id=user.id,
-        session_token=session.get('session_token'),
-        is_active=True
-    ).first()
-    
-    if not current_session or current_session.is_expired():
+    # Sessão atual já validada em before_request
+    cached_session = g.get('user_session')
+    if cached_session is None:
         session.clear()
         flash('Sua sessão expirou. Faça login novamente.', 'warning')
         return redirect(url_for('auth.login'))
     
-    # Buscar sessões ativas do usuário
+    # Buscar sessões ativas do usuário (a atual está entre elas)
     active_sessions = UserSession.query.filter_by(
         user_id=user.id,
         is_active=True
     ).filter(UserSession.expires_at > datetime.utcnow()).all()
+    current_session = next((s for s in active_sessions if s.id == cached_session.session_id), None)
+    if current_session is None:
+        current_app.session_cache.invalidate(session.get('session_token'), user.id)
+        session.clear()
+        flash('Sua sessão expirou. Faça login novamente.', 'warning')
+        return redirect(url_for('auth.login'))
     
     # Buscar logs recentes do usuário
-    recent_logs = SystemLog.query.filter_by(
-        user_id=user.id
-    ).order_by(SystemLog.created_at.desc()).limit(10).all()
+    recent_logs = current_app.log_partitions.recent(10, user_id=user.id)
 
     # Obter seções do dashboard a partir do config.yml
     dashboard_config = current_app.config.get('DASHBOARD_CONFIG', {})
@@ -103,11 +106,12 @@ def status():
         firewall_status = f'Erro: {str(e)}'
     
     # Estatísticas básicas
+    counters = stat_values('users.total', 'users.confirmed', 'sessions.active', 'logs.total')
     stats = {
-        'total_users': User.query.count(),
-        'confirmed_users': User.query.filter_by(confirmed=True).count(),
-        'active_sessions': UserSession.query.filter_by(is_active=True).count(),
-        'total_logs': SystemLog.query.count()
+        'total_users': counters['users.total'],
+        'confirmed_users': counters['users.confirmed'],
+        'active_sessions': counters['sessions.active'],
+        'total_logs': counters['logs.total']
     }
     
     status_info = {
@@ -155,16 +159,18 @@ def admin_pending_users():
             return redirect(url_for('main.admin_pending_users'))
         if action == 'approve':
             target_user.status = 'approved'
-            db.session.commit()
-            # Enviar email de confirmação
+            # Email de confirmação gravado na outbox na mesma transação da aprovação
             from app.email import send_confirmation_email
             send_confirmation_email(target_user)
+            db.session.commit()
+            current_app.session_cache.invalidate_user(target_user.id)
             flash(f'Usuário {target_user.email} aprovado com sucesso!', 'success')
         elif action == 'reject':
             target_user.status = 'rejected'
-            db.session.commit()
             from app.email import send_rejection_email
             send_rejection_email(target_user)
+            db.session.commit()
+            current_app.session_cache.invalidate_user(target_user.id)
             flash(f'Usuário {target_user.email} rejeitado.', 'info')
         return redirect(url_for('main.admin_pending_users'))
 
@@ -184,8 +190,15 @@ def firewall_manager():
         return redirect(url_for('main.dashboard'))
 
     firewall_manager = current_app.firewall_manager
-    # Listar regras ativas
-    regras = FirewallRule.query.filter_by(is_active=True).order_by(FirewallRule.created_at.desc()).all()
+    # Listar regras ativas: uma página por cursor, com o usuário na mesma consulta
+    try:
+        cursor = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        cursor = None
+    regras, next_cursor = keyset_page(
+        FirewallRule.query.options(joinedload(FirewallRule.user)).filter(FirewallRule.is_active == True),
+        FirewallRule.created_at, FirewallRule.id, cursor, current_app.config.get('API_PAGE_SIZE', 50)
+    )
 
     if request.method == 'POST':
         acao = request.form.get('acao')
@@ -193,6 +206,12 @@ def firewall_manager():
         tipo = request.form.get('tipo')  # whitelist ou blacklist
         chain = request.form.get('chain') or (firewall_manager.chain_name if tipo == 'whitelist' else current_app.config.get('FIREWALL_BLACK', 'BLACKLIST'))
         if acao == 'adicionar' and ip and tipo:
+            # Aceitar IP ou rede em CIDR (ex.: 203.0.113.0/24), normalizado
+            try:
+                ip = format_network(to_network(ip.strip()))
+            except ValueError:
+                flash(f'IP ou rede inválida: {ip}', 'error')
+                return redirect(url_for('main.firewall_manager'))
             # Adicionar IP
             nova_regra = FirewallRule(
                 ip_address=ip,
@@ -205,10 +224,7 @@ def firewall_manager():
             db.session.add(nova_regra)
             db.session.commit()
             # Adicionar no iptables
-            if tipo == 'whitelist':
-                firewall_manager.add_ip_to_firewall(ip)
-            else:
-                firewall_manager.add_ip_to_blacklist(ip)
+            current_app.firewall_reconciler.submit('add', tipo, ip, nova_regra.id)
             flash(f'IP {ip} adicionado à {tipo}.', 'success')
             return redirect(url_for('main.firewall_manager'))
         elif acao == 'remover' and ip:
@@ -218,16 +234,13 @@ def firewall_manager():
                 regra.mark_as_removed()
                 db.session.commit()
                 # Remover do iptables
-                if regra.tipo == 'whitelist':
-                    firewall_manager.remove_ip_from_firewall(ip)
-                else:
-                    firewall_manager.remove_ip_from_blacklist(ip)
+                current_app.firewall_reconciler.submit('remove', regra.tipo, ip, regra.id)
                 flash(f'IP {ip} removido da {regra.tipo}.', 'info')
             else:
                 flash('Regra não encontrada.', 'warning')
             return redirect(url_for('main.firewall_manager'))
 
-    return render_template('firewall_manager.html', user=user, regras=regras)
+    return render_template('firewall_manager.html', user=user, regras=regras, next_cursor=next_cursor)
 
 @bp.errorhandler(404)
 def not_found_error(error):
@@ -249,25 +262,14 @@ def forbidden_error(error):
 @bp.before_app_request
 def before_request():
     """Executa antes de cada requisição"""
-    # Log da requisição
-    if request.endpoint and not request.endpoint.startswith('static'):
-        SystemLog.log(
-            level='DEBUG',
-            message=f'Requisição: {request.method} {request.path}',
-            module='request',
-            user_id=session.get('user_id'),
-            ip_address=request.remote_addr
-        )
+    # O registro das requisições é feito por app.request_log_policy (após a resposta)
     
-    # Verificar se usuário está logado e sessão é válida
+    # Verificar se usuário está logado e sessão é válida (cache por session_token)
     if 'user_id' in session and 'session_token' in session:
-        user_session = UserSession.query.filter_by(
-            user_id=session['user_id'],
-            session_token=session['session_token'],
-            is_active=True
-        ).first()
+        user_session = current_app.session_cache.validate(session['user_id'], session['session_token'])
+        g.user_session = user_session
         
-        if not user_session or user_session.is_expired():
+        if user_session is None:
             # Sessão inválida ou expirada
             session.clear()
             if request.endpoint and request.endpoint != 'auth.login':
@@ -0,0 +1,181 @@
+"""
+Leitura estruturada (iptables-save) e índice em memória das regras do firewall
+"""
+import shlex
+import logging
+import ipaddress
+import time
+import threading
+from collections import namedtuple
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+# Regra lida do iptables-save: source é um objeto de rede (ou None quando ausente/negado),
+# matches são os módulos -m usados e args as demais opções não interpretadas
+RuleRecord = namedtuple('RuleRecord', ['family', 'table', 'chain', 'source', 'target', 'matches', 'args'])
+
+
+def to_network(value: Union[str, Network]) -> Network:
+    """Converte IP ou CIDR em objeto de rede (IP simples vira /32 ou /128)"""
+    if isinstance(value, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+        return value
+    return ipaddress.ip_network(value, strict=False)
+
+
+def format_network(network: Network) -> str:
+    """Formata a rede como o usuário a informou: IP simples sem prefixo, redes em CIDR"""
+    if network.num_addresses == 1:
+        return str(network.network_address)
+    return network.with_prefixlen
+
+
+def parse_save_lines(lines: Iterable[str], family: int) -> Iterator[RuleRecord]:
+    """Converte as linhas do iptables-save em RuleRecord, uma de cada vez
+
+    Consome a entrada de forma incremental (pode ser o stdout de um processo),
+    sem materializar o dump inteiro em memória. Apenas linhas '-A' geram
+    registros; declarações de tabela/chain e comentários são ignorados.
+    """
+    table = None
+    for line in lines:
+        line = line.strip()
+        if line.startswith('*'):
+            table = line[1:]
+            continue
+        if not line.startswith('-A '):
+            continue
+
+        try:
+            tokens = shlex.split(line)
+        except ValueError:
+            logger.warning(f"Linha do iptables-save ignorada: {line}")
+            continue
+
+        chain = tokens[1]
+        source: Optional[Network] = None
+        target = None
+        matches = []
+        args = []
+        negate = False
+        i = 2
+        while i < len(tokens):
+            token = tokens[i]
+            value = tokens[i + 1] if i + 1 < len(tokens) else None
+            if token == '!':
+                negate = True
+                i += 1
+                continue
+            if token == '-s' and value is not None:
+                if not negate:
+                    try:
+                        source = to_network(value)
+                    except ValueError:
+                        logger.warning(f"Origem inválida no iptables-save: {value}")
+                i += 2
+            elif token == '-j' and value is not None:
+                target = value
+                i += 2
+            elif token == '-m' and value is not None:
+                matches.append(value)
+                i += 2
+            else:
+                if negate:
+                    args.append('!')
+                args.append(token)
+                i += 1
+            negate = False
+
+        yield RuleRecord(family, table, chain, source, target, tuple(matches), tuple(args))
+
+
+class RuleIndex:
+    """Índice das regras aplicadas, por família, chain e rede
+
+    É a fonte de verdade do FirewallManager sobre o que está no kernel:
+    atualizado a cada transação aplicada com sucesso e reconstruído a partir
+    do iptables-save apenas na inicialização ou quando uma divergência é
+    detectada (falha ao aplicar uma transação).
+
+    Entradas aplicadas com timeout expiram sozinhas no kernel; o índice
+    guarda o prazo de cada uma e deixa de considerá-las presentes quando
+    ele passa.
+    """
+
+    def __init__(self):
+        self._rules: Dict[Tuple[int, str], Set[Network]] = {}
+        self._deadlines: Dict[Tuple[str, Network], float] = {}
+        self._lock = threading.RLock()
+        self.loaded = False
+
+    def _bucket(self, network: Network, chain: str) -> Set[Network]:
+        return self._rules.setdefault((network.version, chain), set())
+
+    def _expire(self, chain: str, network: Network, now: float) -> bool:
+        """Remove a entrada se o timeout dela já venceu; retorna True se removida"""
+        deadline = self._deadlines.get((chain, network))
+        if deadline is None or deadline > now:
+            return False
+        del self._deadlines[(chain, network)]
+        self._rules.get((network.version, chain), set()).discard(network)
+        return True
+
+    def contains(self, chain: str, value) -> bool:
+        network = to_network(value)
+        with self._lock:
+            if self._expire(chain, network, time.monotonic()):
+                return False
+            return network in self._rules.get((network.version, chain), ())
+
+    def add(self, chain: str, value, timeout: Optional[int] = None):
+        network = to_network(value)
+        with self._lock:
+            self._bucket(network, chain).add(network)
+            if timeout is None:
+                self._deadlines.pop((chain, network), None)
+            else:
+                self._deadlines[(chain, network)] = time.monotonic() + timeout
+
+    def discard(self, chain: str, value):
+        network = to_network(value)
+        with self._lock:
+            self._rules.get((network.version, chain), set()).discard(network)
+            self._deadlines.pop((chain, network), None)
+
+    def networks(self, chain: str) -> Set[Network]:
+        """Todas as redes (v4 e v6) presentes na chain"""
+        with self._lock:
+            now = time.monotonic()
+            result = set()
+            for version in (4, 6):
+                for network in list(self._rules.get((version, chain), ())):
+                    if not self._expire(chain, network, now):
+                        result.add(network)
+            return result
+
+    def replace(self, entries: Iterable[Tuple[str, Network]]):
+        """Substitui todo o conteúdo do índice (reidratação)
+
+        O estado lido do kernel não traz os prazos: entradas que continuam
+        presentes mantêm o prazo registrado na adição.
+        """
+        with self._lock:
+            deadlines = self._deadlines
+            self._rules = {}
+            self._deadlines = {}
+            for chain, network in entries:
+                self._bucket(network, chain).add(network)
+                if (chain, network) in deadlines:
+                    self._deadlines[(chain, network)] = deadlines[(chain, network)]
+            self.loaded = True
+
+    def invalidate(self):
+        """Marca o índice como divergente; será reconstruído no próximo uso"""
+        with self._lock:
+            self.loaded = False
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(bucket) for bucket in self._rules.values())
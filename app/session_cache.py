@@ -0,0 +1,145 @@
+"""
+Cache das sessões validadas, indexado pelo session_token
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Contadores de geração por usuário (user_id % USER_SLOTS)
+USER_SLOTS = 4096
+
+# Dados da sessão validada disponíveis em g.user_session
+CachedSession = namedtuple('CachedSession', [
+    'session_id', 'user_id', 'email', 'role', 'status', 'ip_address', 'created_at', 'expires_at'
+])
+
+
+class SessionCache:
+    """Evita consultar user_sessions e users em toda requisição
+
+    Cada entrada vale por SESSION_CACHE_TTL segundos, nunca além do
+    expires_at da sessão, e é descartada explicitamente no logout, no
+    encerramento de sessão, na extensão e quando o administrador altera o
+    status do usuário. Este cache é local ao processo: em outro worker a
+    entrada antiga dura no máximo o TTL. Com vários workers, use o cache
+    compartilhado (SESSION_CACHE_BACKEND=shared, ver shared_cache).
+
+    As invalidações incrementam a geração do usuário (contador em
+    user_id % N) ou a global; um put() com marca (stamp) anterior a elas é
+    descartado, então uma consulta ao banco concorrente com o logout não
+    devolve a sessão encerrada ao cache.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 30.0
+        self.max_entries = 10000
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._global_gen = 0
+        self._user_gens = [0] * USER_SLOTS
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura o cache com as configurações da aplicação"""
+        self.ttl = app.config.get('SESSION_CACHE_TTL', 30)
+        self.max_entries = app.config.get('SESSION_CACHE_MAX_ENTRIES', 10000)
+
+    def get(self, token: str) -> Optional[CachedSession]:
+        """Entrada válida do cache (ou None)"""
+        with self._lock:
+            item = self._entries.get(token)
+            if item is None:
+                return None
+            deadline, entry = item
+            if time.monotonic() >= deadline:
+                del self._entries[token]
+                return None
+            return entry
+
+    def stamp(self, user_id: int):
+        """Gerações global e do usuário, tiradas antes da consulta ao banco"""
+        with self._lock:
+            return self._global_gen, self._user_gens[user_id % USER_SLOTS]
+
+    def put(self, token: str, entry: CachedSession, stamp=None):
+        """Guarda a entrada até o TTL ou o vencimento da sessão, o que vier antes"""
+        remaining = (entry.expires_at - datetime.utcnow()).total_seconds()
+        if self.ttl <= 0 or remaining <= 0:
+            return
+        deadline = time.monotonic() + min(self.ttl, remaining)
+        with self._lock:
+            # Invalidação depois da marca: a entrada consultada pode estar encerrada
+            if stamp is not None and stamp != (self._global_gen, self._user_gens[entry.user_id % USER_SLOTS]):
+                return
+            self._entries[token] = (deadline, entry)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def validate(self, user_id: int, token: str) -> Optional[CachedSession]:
+        """Sessão ativa e não expirada do usuário com o token, consultando o banco só na falta"""
+        entry = self.get(token)
+        if entry is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # Marca tirada antes da consulta: invalidações concorrentes vencem o put
+            stamp = self.stamp(user_id)
+            entry = self.load(token)
+            if entry is not None:
+                self.put(token, entry, stamp)
+
+        if entry is None or entry.user_id != user_id or entry.expires_at <= datetime.utcnow():
+            return None
+        return entry
+
+    @staticmethod
+    def load(token: str) -> Optional[CachedSession]:
+        """Consulta a sessão ativa e o usuário em uma única consulta"""
+        from app.models import User, UserSession, db
+
+        row = db.session.query(
+            UserSession.id, UserSession.user_id, User.email, User.role, User.status,
+            UserSession.ip_address, UserSession.created_at, UserSession.expires_at
+        ).join(User, User.id == UserSession.user_id).filter(
+            UserSession.session_token == token,
+            UserSession.is_active == True
+        ).first()
+        return CachedSession(*row) if row is not None else None
+
+    def invalidate(self, token: Optional[str], user_id: Optional[int] = None):
+        """Descarta a entrada do token (logout, encerramento ou extensão da sessão)
+
+        Incrementa também a geração do usuário (ou a global, sem o user_id):
+        consultas ao banco em andamento não regravam a sessão encerrada.
+        """
+        with self._lock:
+            if user_id is not None:
+                self._user_gens[user_id % USER_SLOTS] += 1
+            else:
+                self._global_gen += 1
+            if token:
+                self._entries.pop(token, None)
+
+    def invalidate_user(self, user_id: int):
+        """Descarta todas as entradas do usuário (ex.: alteração de status pelo admin)"""
+        with self._lock:
+            self._user_gens[user_id % USER_SLOTS] += 1
+            for token in [token for token, (_, entry) in self._entries.items() if entry.user_id == user_id]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._global_gen += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,310 @@
+"""
+Cache das sessões validadas compartilhado entre os workers (arquivo mapeado em memória)
+"""
+import os
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.session_cache import CachedSession, SessionCache
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b'SESSCACH'
+_VERSION = 1
+# magic, versão, slots por faixa, faixas, contadores por usuário, geração global
+_HEADER = struct.Struct('<8sIIIIQ')
+_GENERATION_OFFSET = 24
+_SEQ = struct.Struct('<Q')
+# chave, geração global, geração do usuário, prazo, expires_at, session_id, user_id,
+# created_at, role, status, email, ip_address
+_SLOT = struct.Struct('<16sQQddqqd16s16s128s48s')
+_EMPTY_KEY = bytes(16)
+_EPOCH = datetime(1970, 1, 1)
+
+# Slots examinados a partir da posição da chave (dentro da mesma faixa)
+PROBES = 8
+# Tentativas de leitura consistente antes de tratar como ausência
+READ_RETRIES = 16
+
+
+def open_shared_file(path: str, size: int, header: bytes, valid) -> tuple:
+    """Abre o arquivo compartilhado com o layout esperado; retorna (descritor, se foi recriado)
+
+    Um arquivo com layout diferente não é truncado no lugar: os processos
+    que já o mapearam receberiam SIGBUS ao acessar as páginas cortadas. O
+    arquivo novo é preparado ao lado e renomeado sobre o antigo; quem já
+    mapeou o antigo continua com ele até reabrir.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        keep = False
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            stat = os.fstat(fd)
+            try:
+                replaced = os.stat(path).st_ino != stat.st_ino
+            except FileNotFoundError:
+                replaced = True
+            if replaced:
+                # Outro processo recriou o arquivo enquanto esperávamos o lock
+                continue
+            if stat.st_size == size and valid(os.pread(fd, len(header), 0)):
+                keep = True
+                return fd, False
+
+            new_fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', dir=directory)
+            try:
+                os.ftruncate(new_fd, size)
+                os.pwrite(new_fd, header, 0)
+                os.rename(temp_path, path)
+            except BaseException:
+                os.close(new_fd)
+                os.unlink(temp_path)
+                raise
+            return new_fd, True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            if not keep:
+                os.close(fd)
+
+
+def _timestamp(value: datetime) -> float:
+    return (value - _EPOCH).total_seconds()
+
+
+def _datetime(value: float) -> datetime:
+    return _EPOCH + timedelta(seconds=value)
+
+
+def _text(value: str, size: int) -> bytes:
+    return (value or '').encode('utf-8')[:size]
+
+
+def _decode(value: bytes) -> str:
+    return value.rstrip(b'\0').decode('utf-8', 'ignore')
+
+
+class SharedSessionCache(SessionCache):
+    """Tabela hash de tamanho fixo em um arquivo mapeado em memória sob instance/
+
+    Todos os workers do gunicorn mapeiam o mesmo arquivo (MAP_SHARED), então
+    uma entrada gravada ou invalidada por um worker vale imediatamente para
+    os demais. Os slots são divididos em SESSION_CACHE_STRIPES faixas, cada
+    uma com um contador de sequência (seqlock):
+
+      - leitura: sem lock e sem chamadas ao sistema; lê o contador, o slot e
+        o contador de novo, e repete se um escritor estava no meio (ímpar)
+        ou passou por ali (valor mudou);
+      - escrita: lock da faixa (threading + fcntl no byte do contador),
+        contador ímpar, grava o slot, contador par.
+
+    A invalidação por geração não varre a tabela: cada entrada guarda a
+    geração global e a do usuário (contador em user_id % N) do momento da
+    consulta ao banco; clear() incrementa a global e invalidate_user() a do
+    usuário, e entradas com geração antiga deixam de valer.
+    """
+
+    def __init__(self, app=None, path: Optional[str] = None, slots: int = 16384,
+                 stripes: int = 64, user_slots: int = 4096):
+        self.path = path
+        self.slots = slots
+        self.stripes = stripes
+        self.user_slots = user_slots
+        self._mm: Optional[mmap.mmap] = None
+        self._fd = None
+        super().__init__(app)
+        if app is None and path:
+            self.open()
+
+    def init_app(self, app):
+        """Configura o cache e mapeia o arquivo compartilhado"""
+        super().init_app(app)
+        self.path = app.config.get('SESSION_CACHE_PATH') or os.path.join(app.instance_path, 'session_cache.bin')
+        self.slots = app.config.get('SESSION_CACHE_SLOTS', 16384)
+        self.stripes = app.config.get('SESSION_CACHE_STRIPES', 64)
+        self.open()
+
+    def open(self):
+        """Abre (ou cria/recria) o arquivo com o layout configurado e o mapeia em memória"""
+        self.per_stripe = max(PROBES, self.slots // self.stripes)
+        self._stripe_locks = [threading.Lock() for _ in range(self.stripes)]
+        self._header_lock = threading.Lock()
+        self._seq_offset = 64
+        self._user_offset = self._seq_offset + self.stripes * _SEQ.size
+        self._slot_offset = self._user_offset + self.user_slots * _SEQ.size
+        size = self._slot_offset + self.stripes * self.per_stripe * _SLOT.size
+
+        expected = (_MAGIC, _VERSION, self.per_stripe, self.stripes, self.user_slots)
+        fd, created = open_shared_file(self.path, size, _HEADER.pack(*expected, 1),
+                                       lambda header: _HEADER.unpack(header)[:5] == expected)
+        if created:
+            # Layout diferente (ou arquivo novo): recomeçar vazio
+            logger.info(f"Cache compartilhado de sessões criado: {self.path} ({size} bytes)")
+
+        self._fd = fd
+        self._mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            os.close(self._fd)
+            self._mm = None
+
+    # Leitura (sem lock)
+
+    def _generation(self) -> int:
+        return _SEQ.unpack_from(self._mm, _GENERATION_OFFSET)[0]
+
+    def _user_generation(self, user_id: int) -> int:
+        return _SEQ.unpack_from(self._mm, self._user_offset + (user_id % self.user_slots) * _SEQ.size)[0]
+
+    def _locate(self, token: str):
+        key = hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+        stripe = int.from_bytes(key[:8], 'little') % self.stripes
+        start = int.from_bytes(key[8:], 'little') % self.per_stripe
+        return key, stripe, start
+
+    def _slot_position(self, stripe: int, start: int, probe: int) -> int:
+        return self._slot_offset + (stripe * self.per_stripe + (start + probe) % self.per_stripe) * _SLOT.size
+
+    def _read_stripe(self, stripe: int, start: int):
+        """Lê de forma consistente os slots de sondagem da chave (seqlock)"""
+        mm = self._mm
+        seq_position = self._seq_offset + stripe * _SEQ.size
+        for _ in range(READ_RETRIES):
+            before = _SEQ.unpack_from(mm, seq_position)[0]
+            if before & 1:
+                continue
+            slots = [_SLOT.unpack_from(mm, self._slot_position(stripe, start, probe)) for probe in range(PROBES)]
+            if _SEQ.unpack_from(mm, seq_position)[0] == before:
+                return slots
+        return None
+
+    def _valid(self, slot, now: float, generation: int) -> bool:
+        return slot[0] != _EMPTY_KEY and slot[3] > now and slot[1] == generation \
+            and slot[2] == self._user_generation(slot[6])
+
+    def get(self, token: str) -> Optional[CachedSession]:
+        """Entrada válida do cache (ou None)"""
+        key, stripe, start = self._locate(token)
+        slots = self._read_stripe(stripe, start)
+        if slots is None:
+            return None
+        now = time.time()
+        generation = self._generation()
+        for slot in slots:
+            if slot[0] == key and self._valid(slot, now, generation):
+                return CachedSession(
+                    session_id=slot[5], user_id=slot[6], email=_decode(slot[10]), role=_decode(slot[8]),
+                    status=_decode(slot[9]), ip_address=_decode(slot[11]),
+                    created_at=_datetime(slot[7]), expires_at=_datetime(slot[4])
+                )
+        return None
+
+    def __len__(self) -> int:
+        now = time.time()
+        generation = self._generation()
+        return sum(
+            1 for index in range(self.stripes * self.per_stripe)
+            if self._valid(_SLOT.unpack_from(self._mm, self._slot_offset + index * _SLOT.size), now, generation)
+        )
+
+    # Escrita (lock da faixa)
+
+    def _lock_stripe(self, stripe: int):
+        self._stripe_locks[stripe].acquire()
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _SEQ.size, self._seq_offset + stripe * _SEQ.size)
+
+    def _unlock_stripe(self, stripe: int):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, _SEQ.size, self._seq_offset + stripe * _SEQ.size)
+        self._stripe_locks[stripe].release()
+
+    def _write_slot(self, stripe: int, position: int, values: tuple):
+        """Grava um slot com o contador da faixa ímpar durante a escrita"""
+        seq_position = self._seq_offset + stripe * _SEQ.size
+        seq = _SEQ.unpack_from(self._mm, seq_position)[0]
+        _SEQ.pack_into(self._mm, seq_position, seq + 1)
+        _SLOT.pack_into(self._mm, position, *values)
+        _SEQ.pack_into(self._mm, seq_position, seq + 2)
+
+    def _increment(self, offset: int):
+        with self._header_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, _SEQ.size, offset)
+            try:
+                _SEQ.pack_into(self._mm, offset, _SEQ.unpack_from(self._mm, offset)[0] + 1)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, _SEQ.size, offset)
+
+    def stamp(self, user_id: int):
+        return self._generation(), self._user_generation(user_id)
+
+    def put(self, token: str, entry: CachedSession, stamp=None):
+        """Guarda a entrada até o TTL ou o vencimento da sessão, o que vier antes"""
+        now = time.time()
+        remaining = (entry.expires_at - datetime.utcnow()).total_seconds()
+        if self.ttl <= 0 or remaining <= 0:
+            return
+        generation, user_generation = stamp or self.stamp(entry.user_id)
+        fields = (
+            generation, user_generation, now + min(self.ttl, remaining), _timestamp(entry.expires_at),
+            entry.session_id, entry.user_id, _timestamp(entry.created_at), _text(entry.role, 16),
+            _text(entry.status, 16), _text(entry.email, 128), _text(entry.ip_address, 48)
+        )
+
+        key, stripe, start = self._locate(token)
+        self._lock_stripe(stripe)
+        try:
+            current = self._generation()
+            # Mesmo token, senão slot livre ou vencido, senão o de prazo mais curto
+            candidates = [
+                (0 if slot[0] == key else 1 if not self._valid(slot, now, current) else 2, slot[3], probe)
+                for probe, slot in enumerate(
+                    _SLOT.unpack_from(self._mm, self._slot_position(stripe, start, probe)) for probe in range(PROBES)
+                )
+            ]
+            probe = min(candidates)[2]
+            self._write_slot(stripe, self._slot_position(stripe, start, probe), (key,) + fields)
+        finally:
+            self._unlock_stripe(stripe)
+
+    def invalidate(self, token: Optional[str], user_id: Optional[int] = None):
+        """Descarta a entrada do token para todos os workers
+
+        Incrementa também a geração do usuário (user_id, ou o da entrada em
+        cache; sem nenhum dos dois, a global): uma consulta ao banco que tirou
+        a marca antes desta invalidação não regrava a sessão encerrada.
+        """
+        if token:
+            key, stripe, start = self._locate(token)
+            self._lock_stripe(stripe)
+            try:
+                for probe in range(PROBES):
+                    position = self._slot_position(stripe, start, probe)
+                    slot = _SLOT.unpack_from(self._mm, position)
+                    if slot[0] == key:
+                        self._write_slot(stripe, position, (_EMPTY_KEY,) + slot[1:])
+                        user_id = slot[6] if user_id is None else user_id
+            finally:
+                self._unlock_stripe(stripe)
+        if user_id is not None:
+            self.invalidate_user(user_id)
+        else:
+            self.clear()
+
+    def invalidate_user(self, user_id: int):
+        """Invalida todas as entradas do usuário incrementando a sua geração"""
+        self._increment(self._user_offset + (user_id % self.user_slots) * _SEQ.size)
+
+    def clear(self):
+        """Invalida todas as entradas incrementando a geração global"""
+        self._increment(_GENERATION_OFFSET)
@@ -0,0 +1,278 @@
+"""
+Armazenamento do rate limiting compartilhado entre os workers (arquivo mapeado em memória)
+"""
+import os
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import logging
+import threading
+import urllib.parse
+from math import floor
+from typing import Optional
+
+from limits.errors import ConfigurationError
+from limits.storage import SlidingWindowCounterSupport, Storage
+from limits.storage.base import TimestampedSlidingWindow
+
+from app.shared_cache import open_shared_file
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b'RATELIMT'
+_VERSION = 1
+# magic, versão, slots por faixa, faixas
+_HEADER = struct.Struct('<8sIII')
+_SEQ = struct.Struct('<Q')
+# chave, contador, expiração (time.time())
+_SLOT = struct.Struct('<16sqd')
+_EMPTY_KEY = bytes(16)
+
+# Slots examinados a partir da posição da chave (dentro da mesma faixa)
+PROBES = 8
+# Tentativas de leitura sem lock antes de ler com o lock da faixa
+READ_RETRIES = 16
+
+
+def shared_storage_uri(app) -> str:
+    """URI do armazenamento compartilhado no diretório instance/ quando não informado"""
+    uri = app.config.get('RATELIMIT_STORAGE_URI') or 'shared://'
+    if uri.rstrip('/') == 'shared:':
+        uri = f"shared://{os.path.join(app.instance_path, 'ratelimit.bin')}"
+    return uri
+
+
+class SharedLimiterStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """Contadores do flask-limiter em uma tabela hash de tamanho fixo mapeada em memória
+
+    Registrado no limits com o esquema shared:// (ex.: shared:///caminho/ratelimit.bin
+    ?slots=65536&stripes=64). Todos os workers do gunicorn mapeiam o mesmo
+    arquivo (MAP_SHARED), então o limite de cada chave é global e exato, e
+    não por worker como no memory://. Mesmo layout de faixas do cache de
+    sessões compartilhado (app/shared_cache.py):
+
+      - incremento: lock da faixa (threading + fcntl no byte do contador),
+        contador da faixa ímpar, grava o slot, contador par;
+      - leitura: sem lock, repetida se um escritor passou pela faixa
+        (seqlock).
+
+    Atende as estratégias fixed-window e sliding-window-counter. A tabela
+    não cresce: chaves vencidas são reaproveitadas e, com a faixa cheia, a
+    de expiração mais próxima é substituída (contabilizado em evictions).
+    """
+
+    STORAGE_SCHEME = ['shared']
+
+    def __init__(self, uri: Optional[str] = None, wrap_exceptions: bool = False,
+                 slots: int = 65536, stripes: int = 64, **options):
+        parsed = urllib.parse.urlparse(uri or '')
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        self.path = urllib.parse.unquote(parsed.netloc + parsed.path)
+        if not self.path:
+            raise ConfigurationError(f"Caminho do armazenamento de rate limiting não informado: {uri}")
+        self.slots = int(query.get('slots', slots))
+        self.stripes = int(query.get('stripes', stripes))
+        self.evictions = 0
+        self._mm: Optional[mmap.mmap] = None
+        self._fd = None
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.open()
+
+    @property
+    def base_exceptions(self):
+        return (OSError, ValueError)
+
+    def open(self):
+        """Abre (ou cria/recria) o arquivo com o layout configurado e o mapeia em memória"""
+        self.per_stripe = max(PROBES, self.slots // self.stripes)
+        self._stripe_locks = [threading.Lock() for _ in range(self.stripes)]
+        self._seq_offset = 64
+        self._slot_offset = self._seq_offset + self.stripes * _SEQ.size
+        size = self._slot_offset + self.stripes * self.per_stripe * _SLOT.size
+
+        expected = (_MAGIC, _VERSION, self.per_stripe, self.stripes)
+        fd, created = open_shared_file(self.path, size, _HEADER.pack(*expected),
+                                       lambda header: _HEADER.unpack(header) == expected)
+        if created:
+            # Layout diferente (ou arquivo novo): recomeçar vazio
+            logger.info(f"Armazenamento compartilhado de rate limiting criado: {self.path} ({size} bytes)")
+
+        self._fd = fd
+        self._mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            os.close(self._fd)
+            self._mm = None
+
+    # Faixas
+
+    def _locate(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        stripe = int.from_bytes(digest[:8], 'little') % self.stripes
+        start = int.from_bytes(digest[8:], 'little') % self.per_stripe
+        return digest, stripe, start
+
+    def _slot_position(self, stripe: int, start: int, probe: int) -> int:
+        return self._slot_offset + (stripe * self.per_stripe + (start + probe) % self.per_stripe) * _SLOT.size
+
+    def _lock_stripe(self, stripe: int):
+        self._stripe_locks[stripe].acquire()
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _SEQ.size, self._seq_offset + stripe * _SEQ.size)
+
+    def _unlock_stripe(self, stripe: int):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, _SEQ.size, self._seq_offset + stripe * _SEQ.size)
+        self._stripe_locks[stripe].release()
+
+    def _write_slot(self, stripe: int, position: int, values: tuple):
+        """Grava um slot com o contador da faixa ímpar durante a escrita"""
+        seq_position = self._seq_offset + stripe * _SEQ.size
+        seq = _SEQ.unpack_from(self._mm, seq_position)[0]
+        _SEQ.pack_into(self._mm, seq_position, seq + 1)
+        _SLOT.pack_into(self._mm, position, *values)
+        _SEQ.pack_into(self._mm, seq_position, seq + 2)
+
+    def _find(self, digest: bytes, stripe: int, start: int, now: float):
+        """(posição, slot) da chave ainda válida na faixa, ou (None, None); com o lock da faixa"""
+        for probe in range(PROBES):
+            position = self._slot_position(stripe, start, probe)
+            slot = _SLOT.unpack_from(self._mm, position)
+            if slot[0] == digest and slot[2] > now:
+                return position, slot
+        return None, None
+
+    def _read(self, key: str):
+        """Slot válido da chave (ou None), lido sem lock (seqlock)"""
+        digest, stripe, start = self._locate(key)
+        mm = self._mm
+        seq_position = self._seq_offset + stripe * _SEQ.size
+        now = time.time()
+        for _ in range(READ_RETRIES):
+            before = _SEQ.unpack_from(mm, seq_position)[0]
+            if before & 1:
+                continue
+            slots = [_SLOT.unpack_from(mm, self._slot_position(stripe, start, probe)) for probe in range(PROBES)]
+            if _SEQ.unpack_from(mm, seq_position)[0] == before:
+                return next((slot for slot in slots if slot[0] == digest and slot[2] > now), None)
+        # Escritas contínuas na faixa: ler com o lock
+        self._lock_stripe(stripe)
+        try:
+            return self._find(digest, stripe, start, now)[1]
+        finally:
+            self._unlock_stripe(stripe)
+
+    # Interface do limits
+
+    def incr(self, key: str, expiry: float, amount: int = 1) -> int:
+        """Incrementa o contador da chave; a expiração conta a partir do primeiro incremento"""
+        digest, stripe, start = self._locate(key)
+        self._lock_stripe(stripe)
+        try:
+            now = time.time()
+            position, slot = self._find(digest, stripe, start, now)
+            if slot is not None:
+                count = slot[1] + amount
+                self._write_slot(stripe, position, (digest, count, slot[2]))
+                return count
+            # Slot livre ou vencido, senão o de expiração mais próxima
+            candidates = []
+            for probe in range(PROBES):
+                position = self._slot_position(stripe, start, probe)
+                slot = _SLOT.unpack_from(self._mm, position)
+                candidates.append((slot[0] != _EMPTY_KEY and slot[2] > now, slot[2], position))
+            occupied, _, position = min(candidates)
+            if occupied:
+                self.evictions += 1
+            self._write_slot(stripe, position, (digest, amount, now + expiry))
+            return amount
+        finally:
+            self._unlock_stripe(stripe)
+
+    def decr(self, key: str, amount: int = 1) -> int:
+        """Decrementa o contador da chave (sem ficar negativo)"""
+        digest, stripe, start = self._locate(key)
+        self._lock_stripe(stripe)
+        try:
+            position, slot = self._find(digest, stripe, start, time.time())
+            if slot is None:
+                return 0
+            count = max(slot[1] - amount, 0)
+            self._write_slot(stripe, position, (digest, count, slot[2]))
+            return count
+        finally:
+            self._unlock_stripe(stripe)
+
+    def get(self, key: str) -> int:
+        slot = self._read(key)
+        return slot[1] if slot is not None else 0
+
+    def get_expiry(self, key: str) -> float:
+        slot = self._read(key)
+        return slot[2] if slot is not None else time.time()
+
+    def clear(self, key: str) -> None:
+        digest, stripe, start = self._locate(key)
+        self._lock_stripe(stripe)
+        try:
+            position, slot = self._find(digest, stripe, start, time.time())
+            if slot is not None:
+                self._write_slot(stripe, position, (_EMPTY_KEY, 0, 0.0))
+        finally:
+            self._unlock_stripe(stripe)
+
+    def check(self) -> bool:
+        return self._mm is not None
+
+    def reset(self) -> Optional[int]:
+        """Zera todos os contadores; retorna quantas chaves estavam válidas"""
+        now = time.time()
+        cleared = 0
+        for stripe in range(self.stripes):
+            self._lock_stripe(stripe)
+            try:
+                for index in range(self.per_stripe):
+                    position = self._slot_offset + (stripe * self.per_stripe + index) * _SLOT.size
+                    slot = _SLOT.unpack_from(self._mm, position)
+                    if slot[0] != _EMPTY_KEY:
+                        cleared += slot[2] > now
+                        self._write_slot(stripe, position, (_EMPTY_KEY, 0, 0.0))
+            finally:
+                self._unlock_stripe(stripe)
+        return cleared
+
+    # Estratégia sliding-window-counter (chaves por janela, como o MemoryStorage)
+
+    def acquire_sliding_window_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        if amount > limit:
+            return False
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count, previous_ttl, _, _ = self._sliding_window_info(previous_key, current_key, expiry, now)
+        weighted = previous_count * previous_ttl / expiry
+        if floor(weighted + self.get(current_key)) + amount > limit:
+            return False
+        # O incremento é atômico entre os workers: se outro passou na frente, desfaz
+        current_count = self.incr(current_key, 2 * expiry, amount)
+        if floor(weighted + current_count) > limit:
+            self.decr(current_key, amount)
+            return False
+        return True
+
+    def _sliding_window_info(self, previous_key: str, current_key: str, expiry: int, now: float):
+        previous_count = self.get(previous_key)
+        previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous_count else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, self.get(current_key), current_ttl
+
+    def get_sliding_window(self, key: str, expiry: int):
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        return self._sliding_window_info(previous_key, current_key, expiry, now)
+
+    def clear_sliding_window(self, key: str, expiry: int) -> None:
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self.clear(previous_key)
+        self.clear(current_key)
@@ -0,0 +1,158 @@
+"""
+Contadores das estatísticas atualizados nos caminhos de escrita
+"""
+import logging
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable
+
+from sqlalchemy import event, func, inspect, select
+
+logger = logging.getLogger(__name__)
+
+_registered = False
+
+
+def day_counter(day: date) -> str:
+    """Nome do contador de logs do dia"""
+    return f"logs.day.{day.strftime('%Y%m%d')}"
+
+
+def log_deltas(created_at: Iterable[datetime]) -> Counter:
+    """Incrementos de logs.total e dos contadores diários para os registros gravados"""
+    deltas = Counter()
+    for value in created_at:
+        deltas['logs.total'] += 1
+        deltas[day_counter(value.date())] += 1
+    return deltas
+
+
+def _change(obj, attribute: str):
+    """(valor anterior, valor atual) do atributo na sessão em flush"""
+    history = inspect(obj).attrs[attribute].history
+    current = getattr(obj, attribute)
+    previous = history.deleted[0] if history.deleted else current
+    return bool(previous), bool(current)
+
+
+def _flush_deltas(session, flush_context):
+    """Converte os objetos inseridos/alterados/removidos no flush em incrementos dos contadores"""
+    from app.models import FirewallRule, StatCounter, SystemLog, User, UserSession
+
+    tracked = {User: ('users', 'confirmed', 'confirmed'), UserSession: ('sessions', 'is_active', 'active'),
+               FirewallRule: ('rules', 'is_active', 'active')}
+    deltas = Counter()
+
+    for obj in session.new:
+        if isinstance(obj, SystemLog):
+            deltas.update(log_deltas([obj.created_at or datetime.utcnow()]))
+            continue
+        spec = tracked.get(type(obj))
+        if spec is None:
+            continue
+        prefix, attribute, name = spec
+        if prefix != 'sessions':
+            deltas[f'{prefix}.total'] += 1
+        if getattr(obj, attribute):
+            deltas[f'{prefix}.{name}'] += 1
+
+    for obj in session.dirty:
+        spec = tracked.get(type(obj))
+        if spec is None or not session.is_modified(obj):
+            continue
+        prefix, attribute, name = spec
+        previous, current = _change(obj, attribute)
+        if previous != current:
+            deltas[f'{prefix}.{name}'] += 1 if current else -1
+
+    for obj in session.deleted:
+        if isinstance(obj, SystemLog):
+            deltas.subtract(log_deltas([obj.created_at]))
+            continue
+        spec = tracked.get(type(obj))
+        if spec is None:
+            continue
+        prefix, attribute, name = spec
+        if prefix != 'sessions':
+            deltas[f'{prefix}.total'] -= 1
+        if _change(obj, attribute)[0]:
+            deltas[f'{prefix}.{name}'] -= 1
+
+    if any(deltas.values()):
+        StatCounter.increment(session.connection(), dict(deltas))
+
+
+def register_stat_listeners():
+    """Registra o hook de flush das sessões do Flask-SQLAlchemy (uma única vez)"""
+    global _registered
+    if _registered:
+        return
+    from flask_sqlalchemy.session import Session
+    event.listen(Session, 'after_flush', _flush_deltas)
+    _registered = True
+
+
+def stat_values(*names: str) -> Dict[str, int]:
+    """Valores atuais dos contadores (uma única consulta)"""
+    from app.models import StatCounter
+    return StatCounter.values(list(names))
+
+
+def logs_today() -> str:
+    return day_counter(datetime.utcnow().date())
+
+
+def real_counts(log_partitions, connection=None) -> Dict[str, int]:
+    """Contagens reais (COUNT(*)) usadas pela reconciliação, na transação da conexão"""
+    from app.models import FirewallRule, User, UserSession, db
+
+    if connection is None:
+        with db.engine.connect() as connection:
+            return real_counts(log_partitions, connection)
+
+    def count(column, *criteria):
+        return connection.execute(select(func.count(column)).where(*criteria)).scalar()
+
+    counts = {
+        'users.total': count(User.id),
+        'users.confirmed': count(User.id, User.confirmed == True),
+        'sessions.active': count(UserSession.id, UserSession.is_active == True),
+        'rules.total': count(FirewallRule.id),
+        'rules.active': count(FirewallRule.id, FirewallRule.is_active == True),
+        'logs.total': log_partitions.count(connection=connection),
+    }
+    # Contadores diários: um por partição existente, mais o de hoje
+    log_partitions.refresh()
+    days = set(log_partitions.days(connection)) | {datetime.utcnow().date()}
+    for day in days:
+        start = datetime.combine(day, time.min)
+        counts[day_counter(day)] = log_partitions.count(since=start, until=start + timedelta(days=1),
+                                                        connection=connection)
+    return counts
+
+
+def reconcile_counters(log_partitions) -> Dict[str, int]:
+    """Corrige os contadores pelas contagens reais; retorna a diferença encontrada por contador
+
+    Contagens, leitura e correção dos contadores acontecem na mesma
+    transação, que começa tomando o lock de escrita: nenhuma gravação
+    (com o seu incremento no after_flush) é confirmada entre a contagem e
+    a correção, o que faria a reconciliação somar o próprio erro.
+    """
+    from app.models import StatCounter, db
+
+    table = StatCounter.__table__
+    with db.engine.begin() as connection:
+        # UPDATE sem efeito: no SQLite abre a transação de escrita (lock) antes das leituras
+        connection.execute(table.update().where(table.c.name == '').values(value=table.c.value))
+        counts = real_counts(log_partitions, connection)
+        current = dict(connection.execute(select(table.c.name, table.c.value)).all())
+        drift = {name: value - current.get(name, 0) for name, value in counts.items()}
+        StatCounter.increment(connection, drift)
+        # Contadores diários de dias sem partição (removidos pela retenção)
+        stale = [name for name in current if name.startswith('logs.day.') and name not in counts]
+        if stale:
+            connection.execute(table.delete().where(table.c.name.in_(stale)))
+        drift.update({name: -current[name] for name in stale})
+        drift = {name: delta for name, delta in drift.items() if delta}
+    return drift
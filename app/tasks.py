@@ -1,98 +1,178 @@
 """
 Tarefas em background para o sistema
 """
+import time
 import logging
 from datetime import datetime, timedelta
 from flask import current_app
-from app.models import UserSession, FirewallRule, SystemLog, db
+from sqlalchemy import select, text, update
+from app.models import User, UserSession, FirewallRule, SystemLog, StatCounter, db, sqlite_wal_size
+from app.stats import reconcile_counters
 
 logger = logging.getLogger(__name__)
 
-def cleanup_expired_sessions():
-    """Limpa sessões expiradas e remove IPs do firewall"""
-    try:
-        with current_app.app_context():
+def _claim_expired_sessions(now, chunk_size):
+    """Encerra um bloco de sessões expiradas e devolve (id, user_id, ip_address) de cada uma
+    
+    Com suporte a UPDATE ... RETURNING o bloco é reivindicado em um único
+    comando (dois processos nunca encerram a mesma sessão); caso contrário,
+    os ids são selecionados e atualizados em seguida.
+    """
+    table = UserSession.__table__
+    chunk = select(table.c.id).where(
+        table.c.expires_at < now,
+        table.c.is_active == True
+    ).order_by(table.c.expires_at).limit(chunk_size).scalar_subquery()
+    
+    if db.engine.dialect.update_returning:
+        return db.session.execute(
+            update(table).where(table.c.id.in_(chunk), table.c.is_active == True).values(
+                is_active=False, ended_at=now
+            ).returning(table.c.id, table.c.user_id, table.c.ip_address)
+        ).all()
+    
+    rows = db.session.execute(
+        select(table.c.id, table.c.user_id, table.c.ip_address).where(table.c.id.in_(chunk))
+    ).all()
+    if rows:
+        db.session.execute(update(table).where(table.c.id.in_([row.id for row in rows])).values(
+            is_active=False, ended_at=now
+        ))
+    return rows
+
+def cleanup_expired_sessions(app=None, chunk_size=None):
+    """Limpa sessões expiradas e remove IPs do firewall
+    
+    As sessões são processadas em blocos de SESSION_CLEANUP_CHUNK (memória
+    limitada), com operações em conjunto por bloco: um UPDATE que reivindica
+    as sessões, um UPDATE das suas regras do firewall e um INSERT em lote
+    dos logs. As remoções do firewall de todos os blocos são aplicadas ao
+    final em uma única transação, poupando IPs ainda liberados por outra
+    sessão ativa. Quando o backend suporta timeouts, as entradas da
+    whitelist já expiraram sozinhas no kernel e nada é removido.
+    
+    O agendador executa a tarefa fora de requisições: recebe a aplicação.
+    """
+    app = app or current_app._get_current_object()
+    with app.app_context():
+        try:
             logger.info("Iniciando limpeza de sessões expiradas")
             
-            # Buscar sessões expiradas que ainda estão ativas
-            expired_sessions = UserSession.query.filter(
-                UserSession.expires_at < datetime.utcnow(),
-                UserSession.is_active == True
-            ).all()
-            
+            chunk_size = chunk_size or current_app.config.get('SESSION_CLEANUP_CHUNK', 1000)
+            firewall_manager = current_app.firewall_manager
+            kernel_expiry = firewall_manager.supports_timeouts
+            timings = {'claim': 0.0, 'rules': 0.0, 'logs': 0.0, 'firewall': 0.0}
             removed_count = 0
+            ips_to_remove = set()
+            now = datetime.utcnow()
             
-            for session in expired_sessions:
-                try:
-                    # Remover IP do firewall
-                    firewall_manager = current_app.firewall_manager
-                    success = firewall_manager.remove_ip_from_firewall(session.ip_address)
-                    
-                    # Atualizar sessão
-                    session.end_session()
-                    
-                    # Atualizar regra do firewall no banco
-                    firewall_rule = FirewallRule.query.filter_by(
-                        session_id=session.id,
-                        is_active=True
-                    ).first()
-                    
-                    if firewall_rule:
-                        firewall_rule.mark_as_removed()
-                    
-                    removed_count += 1
-                    
-                    # Log da ação
-                    SystemLog.log(
-                        level='INFO',
-                        message=f'Sessão expirada removida - IP: {session.ip_address}, Usuário: {session.user.email}',
-                        module='task_cleanup',
-                        user_id=session.user_id,
-                        ip_address=session.ip_address
-                    )
-                    
-                    logger.info(f"Sessão expirada removida: {session.user.email} - {session.ip_address}")
-                    
-                except Exception as e:
-                    logger.error(f"Erro ao remover sessão expirada {session.id}: {str(e)}")
-                    SystemLog.log(
-                        level='ERROR',
-                        message=f'Erro ao remover sessão expirada: {str(e)}',
-                        module='task_cleanup',
-                        user_id=session.user_id if hasattr(session, 'user_id') else None,
-                        ip_address=session.ip_address if hasattr(session, 'ip_address') else None
+            while True:
+                # 1. Reivindicar um bloco de sessões expiradas
+                started = time.perf_counter()
+                claimed = _claim_expired_sessions(now, chunk_size)
+                timings['claim'] += time.perf_counter() - started
+                if not claimed:
+                    db.session.commit()
+                    break
+                
+                # 2. Encerrar as regras do firewall dessas sessões
+                started = time.perf_counter()
+                session_ids = [row.id for row in claimed]
+                rules = db.session.query(
+                    FirewallRule.id, FirewallRule.ip_address, FirewallRule.iptables_rule_added
+                ).filter(
+                    FirewallRule.session_id.in_(session_ids),
+                    FirewallRule.is_active == True
+                ).all()
+                if rules:
+                    FirewallRule.query.filter(FirewallRule.id.in_([rule.id for rule in rules])).update(
+                        {FirewallRule.is_active: False, FirewallRule.removed_at: now},
+                        synchronize_session=False
                     )
+                emails = dict(db.session.query(User.id, User.email).filter(
+                    User.id.in_({row.user_id for row in claimed})
+                ))
+                # Atualizações em massa não passam pelo flush: contadores ajustados aqui
+                StatCounter.increment(db.session.connection(), {
+                    'sessions.active': -len(claimed), 'rules.active': -len(rules)
+                })
+                db.session.commit()
+                # Remover do firewall apenas o que chegou a ser aplicado e não expira sozinho no kernel
+                if not kernel_expiry:
+                    ips_to_remove.update(rule.ip_address for rule in rules if rule.iptables_rule_added)
+                timings['rules'] += time.perf_counter() - started
+                
+                # 3. Logs do bloco em um único INSERT
+                started = time.perf_counter()
+                records = [
+                    {
+                        'level': 'INFO',
+                        'message': f'Sessão expirada removida - IP: {row.ip_address}, Usuário: {emails.get(row.user_id)}',
+                        'module': 'task_cleanup',
+                        'user_id': row.user_id,
+                        'ip_address': row.ip_address,
+                        'created_at': now
+                    }
+                    for row in claimed
+                ]
+                with db.engine.begin() as connection:
+                    current_app.log_partitions.insert(connection, records)
+                timings['logs'] += time.perf_counter() - started
+                
+                removed_count += len(claimed)
+                if len(claimed) < chunk_size:
+                    break
             
-            # Commit das alterações
-            db.session.commit()
+            # 4. Uma única transação do firewall para todos os blocos
+            if ips_to_remove:
+                started = time.perf_counter()
+                still_allowed = {
+                    ip_address for ip_address, in db.session.query(FirewallRule.ip_address).filter(
+                        FirewallRule.ip_address.in_(ips_to_remove),
+                        FirewallRule.tipo == 'whitelist',
+                        FirewallRule.is_active == True,
+                        FirewallRule.iptables_rule_added == True
+                    )
+                }
+                with firewall_manager.transaction() as tx:
+                    for ip_address in sorted(ips_to_remove - still_allowed):
+                        tx.remove_ip(ip_address)
+                if not tx.success:
+                    logger.error("Falha ao remover IPs de sessões expiradas do firewall")
+                timings['firewall'] += time.perf_counter() - started
             
-            logger.info(f"Limpeza concluída: {removed_count} sessões expiradas removidas")
+            stages = ', '.join(f'{stage}={seconds * 1000:.1f}ms' for stage, seconds in timings.items())
+            logger.info(f"Limpeza concluída: {removed_count} sessões expiradas removidas ({stages})")
             
             # Log de sistema
             SystemLog.log(
                 level='INFO',
-                message=f'Limpeza automática concluída: {removed_count} sessões removidas',
+                message=f'Limpeza automática concluída: {removed_count} sessões removidas ({stages})',
                 module='task_cleanup'
             )
             
             return removed_count
             
-    except Exception as e:
-        logger.error(f"Erro na limpeza de sessões expiradas: {str(e)}")
-        db.session.rollback()
+        except Exception as e:
+            logger.error(f"Erro na limpeza de sessões expiradas: {str(e)}")
+            db.session.rollback()
         
-        SystemLog.log(
-            level='ERROR',
-            message=f'Erro na limpeza automática de sessões: {str(e)}',
-            module='task_cleanup'
-        )
+            SystemLog.log(
+                level='ERROR',
+                message=f'Erro na limpeza automática de sessões: {str(e)}',
+                module='task_cleanup'
+            )
         
-        return 0
+            return 0
 
-def sync_firewall_rules():
-    """Sincroniza regras do banco de dados com o firewall"""
-    try:
-        with current_app.app_context():
+def sync_firewall_rules(app=None):
+    """Sincroniza regras do banco de dados com o firewall
+    
+    O agendador executa a tarefa fora de requisições: recebe a aplicação.
+    """
+    app = app or current_app._get_current_object()
+    with app.app_context():
+        try:
             logger.info("Iniciando sincronização de regras do firewall")
             
             firewall_manager = current_app.firewall_manager
@@ -106,33 +186,30 @@ def sync_firewall_rules():
             
             logger.info("Sincronização de regras do firewall concluída")
             
-    except Exception as e:
-        logger.error(f"Erro na sincronização de regras do firewall: {str(e)}")
+        except Exception as e:
+            logger.error(f"Erro na sincronização de regras do firewall: {str(e)}")
         
-        SystemLog.log(
-            level='ERROR',
-            message=f'Erro na sincronização de regras do firewall: {str(e)}',
-            module='task_sync'
-        )
+            SystemLog.log(
+                level='ERROR',
+                message=f'Erro na sincronização de regras do firewall: {str(e)}',
+                module='task_sync'
+            )
 
-def cleanup_old_logs(days=30):
-    """Remove logs antigos do sistema"""
-    try:
-        with current_app.app_context():
+def cleanup_old_logs(app=None, days=None):
+    """Remove logs antigos do sistema descartando as partições diárias inteiras
+    
+    O agendador executa a tarefa fora de requisições: recebe a aplicação.
+    """
+    app = app or current_app._get_current_object()
+    with app.app_context():
+        try:
+            if days is None:
+                days = app.config.get('SYSTEM_LOG_RETENTION_DAYS', 30)
             logger.info(f"Iniciando limpeza de logs antigos (mais de {days} dias)")
             
             cutoff_date = datetime.utcnow() - timedelta(days=days)
             
-            old_logs = SystemLog.query.filter(
-                SystemLog.created_at < cutoff_date
-            ).all()
-            
-            removed_count = len(old_logs)
-            
-            for log in old_logs:
-                db.session.delete(log)
-            
-            db.session.commit()
+            removed_count = app.log_partitions.drop_before(cutoff_date)
             
             logger.info(f"Limpeza de logs concluída: {removed_count} logs removidos")
             
@@ -144,17 +221,106 @@ def cleanup_old_logs(days=30):
             
             return removed_count
             
+        except Exception as e:
+            logger.error(f"Erro na limpeza de logs antigos: {str(e)}")
+            db.session.rollback()
+            
+            SystemLog.log(
+                level='ERROR',
+                message=f'Erro na limpeza de logs antigos: {str(e)}',
+                module='task_cleanup'
+            )
+            
+            return 0
+
+def cleanup_email_outbox(app=None, days=None):
+    """Remove da outbox os emails já enviados (ou que falharam) há mais de N dias
+    
+    Remove também os eventos dos resumos ao administrador já enviados
+    (individualmente ou em um resumo); os pendentes são mantidos.
+    O agendador executa a tarefa fora de requisições: recebe a aplicação.
+    """
+    app = app or current_app._get_current_object()
+    with app.app_context():
+        try:
+            if days is None:
+                days = app.config.get('EMAIL_OUTBOX_RETENTION_DAYS', 7)
+            before = datetime.utcnow() - timedelta(days=days)
+            removed_count = app.email_worker.purge(before)
+            events_count = app.admin_digest.purge(before)
+            logger.info(f"Limpeza da outbox de emails concluída: {removed_count} emails e "
+                        f"{events_count} eventos de resumo removidos")
+            return removed_count
+        except Exception as e:
+            logger.error(f"Erro na limpeza da outbox de emails: {str(e)}")
+            return 0
+
+def checkpoint_database(app=None, mode=None):
+    """Checkpoint do WAL do SQLite (devolve as páginas do WAL ao banco)
+    
+    O agendador executa a tarefa fora de requisições: recebe a aplicação.
+    """
+    app = app or current_app._get_current_object()
+    with app.app_context():
+        try:
+            if db.engine.dialect.name != 'sqlite':
+                return None
+            mode = (mode or app.config.get('SQLITE_CHECKPOINT_MODE', 'PASSIVE')).upper()
+            if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+                mode = 'PASSIVE'
+            
+            wal_before = sqlite_wal_size()
+            with db.engine.connect() as connection:
+                busy, log_frames, checkpointed = connection.execute(
+                    text(f'PRAGMA wal_checkpoint({mode})')
+                ).one()
+            
+            logger.info(
+                f"Checkpoint do WAL ({mode}): {checkpointed}/{log_frames} páginas, "
+                f"ocupado={bool(busy)}, WAL {wal_before} -> {sqlite_wal_size()} bytes"
+            )
+            return {'busy': bool(busy), 'log_frames': log_frames, 'checkpointed': checkpointed}
+            
+        except Exception as e:
+            logger.error(f"Erro no checkpoint do WAL: {str(e)}")
+            return None
+
+def optimize_database(app=None):
+    """Executa PRAGMA optimize (atualiza as estatísticas usadas pelo planejador)
+    
+    O agendador executa a tarefa fora de requisições: recebe a aplicação.
+    """
+    app = app or current_app._get_current_object()
+    with app.app_context():
+        try:
+            if db.engine.dialect.name != 'sqlite':
+                return False
+            with db.engine.connect() as connection:
+                connection.execute(text('PRAGMA optimize'))
+            logger.info("PRAGMA optimize executado")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Erro ao otimizar o banco de dados: {str(e)}")
+            return False
+
+def reconcile_stats(app=None):
+    """Corrige os contadores das estatísticas comparando com as contagens reais
+    
+    O agendador executa a tarefa fora de requisições: recebe a aplicação.
+    """
+    try:
+        app = app or current_app._get_current_object()
+        with app.app_context():
+            drift = reconcile_counters(app.log_partitions)
+        if drift:
+            logger.warning(f"Contadores das estatísticas corrigidos: {drift}")
+        else:
+            logger.info("Contadores das estatísticas conferidos sem divergência")
+        return drift
     except Exception as e:
-        logger.error(f"Erro na limpeza de logs antigos: {str(e)}")
-        db.session.rollback()
-        
-        SystemLog.log(
-            level='ERROR',
-            message=f'Erro na limpeza de logs antigos: {str(e)}',
-            module='task_cleanup'
-        )
-        
-        return 0
+        logger.error(f"Erro na reconciliação dos contadores: {str(e)}")
+        return None
 
 def health_check():
     """Verifica saúde do sistema"""
@@ -164,13 +330,15 @@ def health_check():
                 'database': False,
                 'firewall': False,
                 'email': False,
+                'wal_size_bytes': 0,
                 'timestamp': datetime.utcnow()
             }
             
             # Teste do banco de dados
             try:
-                db.session.execute('SELECT 1')
+                db.session.execute(text('SELECT 1'))
                 health_status['database'] = True
+                health_status['wal_size_bytes'] = sqlite_wal_size()
             except Exception as e:
                 logger.error(f"Erro no teste do banco de dados: {str(e)}")
             
@@ -193,6 +361,7 @@ def health_check():
             
             # Log do health check
             status_msg = f"Health check - DB: {health_status['database']}, " \
+                        f"WAL: {health_status['wal_size_bytes']} bytes, " \
                         f"Firewall: {health_status['firewall']}, " \
                         f"Email: {health_status['email']}"
             
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark do rate limiting: armazenamento por worker (memory://) x compartilhado (shared://)
+
+Uso: python bench_rate_limiter.py [chaves] [hits] [workers]
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def _measure(name, limiter, item, keys, iterations):
+    """Executa os hits e imprime a vazão"""
+    picks = [keys[random.randrange(len(keys))] for _ in range(iterations)]
+    started = time.perf_counter()
+    for key in picks:
+        limiter.hit(item, key)
+    elapsed = time.perf_counter() - started
+    print(f"   {name:<32} {iterations / elapsed:>12,.0f} hits/s  ({elapsed / iterations * 1e6:7.1f} µs cada)")
+
+
+def _allowed_across_workers(uri, item, workers, attempts):
+    """Hits aceitos para uma mesma chave com cada worker (processo) tentando `attempts` vezes"""
+    from limits.storage import storage_from_string
+    from limits.strategies import FixedWindowRateLimiter
+    import app.shared_limiter  # noqa: F401 (registra o esquema shared://)
+
+    children = []
+    for _ in range(workers):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            # Cada worker do gunicorn cria o armazenamento depois do fork (memory://) ou mapeia o mesmo arquivo
+            limiter = FixedWindowRateLimiter(storage_from_string(uri))
+            allowed = sum(limiter.hit(item, 'login:203.0.113.7') for _ in range(attempts))
+            os.write(write, allowed.to_bytes(4, 'little'))
+            os._exit(0)
+        os.close(write)
+        children.append((pid, read))
+    allowed = 0
+    for pid, read in children:
+        os.waitpid(pid, 0)
+        allowed += int.from_bytes(os.read(read, 4), 'little')
+        os.close(read)
+    return allowed
+
+
+def main():
+    keys = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    from limits import parse
+    from limits.storage import storage_from_string
+    from limits.strategies import FixedWindowRateLimiter, SlidingWindowCounterRateLimiter
+    import app.shared_limiter  # noqa: F401 (registra o esquema shared://)
+
+    item = parse('10 per minute')
+    ips = [f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}' for i in range(keys)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        shared_uri = f"shared://{os.path.join(directory, 'ratelimit.bin')}"
+        print(f"⏱️  {iterations} hits aleatórios em {keys} chaves (um processo):")
+        for name, uri in (('memory:// (por worker)', 'memory://'), ('shared:// (mmap)', shared_uri)):
+            storage = storage_from_string(uri)
+            _measure(f'{name} fixed', FixedWindowRateLimiter(storage), item, ips, iterations)
+            _measure(f'{name} sliding', SlidingWindowCounterRateLimiter(storage), item, ips, iterations)
+            storage.reset()
+            if hasattr(storage, 'close'):
+                storage.close()
+            elif hasattr(storage, 'timer'):
+                storage.timer.cancel()
+
+        print(f"🚦 Limite '10 per minute' com {workers} workers tentando 10 logins cada:")
+        for name, uri in (('memory:// (por worker)', 'memory://'), ('shared:// (mmap)', shared_uri)):
+            allowed = _allowed_across_workers(uri, item, workers, 10)
+            print(f"   {name:<32} {allowed:>4} aceitos (limite efetivo {allowed / 10:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark da validação de sessões: consulta ao banco x cache local x cache compartilhado
+
+Uso: python bench_session_cache.py [sessões] [validações]
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def _measure(name, validate, tokens, user_ids, iterations):
+    """Executa as validações e imprime a vazão"""
+    picks = [random.randrange(len(tokens)) for _ in range(iterations)]
+    started = time.perf_counter()
+    for index in picks:
+        assert validate(user_ids[index], tokens[index]) is not None
+    elapsed = time.perf_counter() - started
+    print(f"   {name:<28} {iterations / elapsed:>12,.0f} validações/s  ({elapsed / iterations * 1e6:7.1f} µs cada)")
+    return elapsed
+
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    from app import create_app
+    from app.models import db, User, UserSession
+    from app.session_cache import SessionCache
+    from app.shared_cache import SharedSessionCache
+
+    app = create_app('testing')
+
+    with app.app_context(), tempfile.TemporaryDirectory() as directory:
+        db.drop_all()
+        db.create_all()
+        try:
+            print(f"📊 Preparando {sessions} sessões...")
+            users = [User(email=f'bench{i}@exemplo.com', confirmed=True, status='approved') for i in range(50)]
+            for user in users:
+                user.password_hash = 'x'
+            db.session.add_all(users)
+            db.session.commit()
+            user_sessions = [
+                UserSession(user_id=users[i % len(users)].id, ip_address=f'10.0.{i // 250}.{i % 250}')
+                for i in range(sessions)
+            ]
+            db.session.add_all(user_sessions)
+            db.session.commit()
+            tokens = [s.session_token for s in user_sessions]
+            user_ids = [s.user_id for s in user_sessions]
+
+            local = SessionCache(app)
+            app.config['SESSION_CACHE_PATH'] = os.path.join(directory, 'session_cache.bin')
+            shared = SharedSessionCache(app)
+
+            def database(user_id, token):
+                entry = SessionCache.load(token)
+                db.session.rollback()
+                return entry
+
+            # Aquecer os caches (a primeira validação de cada token consulta o banco)
+            for user_id, token in zip(user_ids, tokens):
+                local.validate(user_id, token)
+                shared.validate(user_id, token)
+
+            print(f"⏱️  {iterations} validações aleatórias:")
+            baseline = _measure('banco (sem cache)', database, tokens, user_ids, iterations // 10 or 1) * 10
+            for name, cache in (('cache local (processo)', local), ('cache compartilhado (mmap)', shared)):
+                elapsed = _measure(name, cache.validate, tokens, user_ids, iterations)
+                print(f"   {'':<28} {baseline / elapsed:>12.1f}x mais rápido que o banco")
+            shared.close()
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
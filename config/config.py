@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 
 class Config:
@@ -8,6 +9,27 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///firewall_login.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Pool de conexões por worker do gunicorn
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 3600)),
+    }
+    # Criar na inicialização os índices que faltarem no banco existente
+    DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', 'true').lower() in ['true', 'on', '1', 'yes']
+    # Perfil do SQLite aplicado em cada conexão
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    # Negativo: tamanho em KiB (-20000 = ~20 MB por conexão)
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -20000))
+    SQLITE_TEMP_STORE = os.environ.get('SQLITE_TEMP_STORE', 'MEMORY')
+    # Manutenção periódica: checkpoint do WAL (minutos) e PRAGMA optimize (horas)
+    SQLITE_CHECKPOINT_INTERVAL = int(os.environ.get('SQLITE_CHECKPOINT_INTERVAL', 5))
+    SQLITE_CHECKPOINT_MODE = os.environ.get('SQLITE_CHECKPOINT_MODE', 'PASSIVE')
+    SQLITE_OPTIMIZE_INTERVAL = int(os.environ.get('SQLITE_OPTIMIZE_INTERVAL', 6))
     
     # Configurações de sessão
     PERMANENT_SESSION_LIFETIME = timedelta(hours=24)
@@ -29,23 +51,118 @@ class Config:
     
     # Configurações do sistema
     ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL') or 'admin@localhost'
+    # Entrega dos emails da outbox (tabela email_outbox): workers fixos, lotes com
+    # lease e conexões SMTP reutilizadas
+    EMAIL_WORKERS = int(os.environ.get('EMAIL_WORKERS', 2))
+    EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 50))
+    EMAIL_LEASE_S = float(os.environ.get('EMAIL_LEASE_S', 60))
+    EMAIL_POLL_S = float(os.environ.get('EMAIL_POLL_S', 5))
+    EMAIL_OUTBOX_RETENTION_DAYS = int(os.environ.get('EMAIL_OUTBOX_RETENTION_DAYS', 7))
+    # Emails renderizados guardados por tipo (LRU) para variáveis repetidas
+    EMAIL_RENDER_CACHE_SIZE = int(os.environ.get('EMAIL_RENDER_CACHE_SIZE', 128))
+    EMAIL_IDLE_TIMEOUT_S = float(os.environ.get('EMAIL_IDLE_TIMEOUT_S', 30))
+    EMAIL_MAX_PER_CONNECTION = int(os.environ.get('EMAIL_MAX_PER_CONNECTION', 100))
+    EMAIL_MAX_RETRIES = int(os.environ.get('EMAIL_MAX_RETRIES', 3))
+    EMAIL_RETRY_BACKOFF_S = float(os.environ.get('EMAIL_RETRY_BACKOFF_S', 1.0))
+    EMAIL_RETRY_BACKOFF_MAX_S = float(os.environ.get('EMAIL_RETRY_BACKOFF_MAX_S', 60))
+    EMAIL_DRAIN_TIMEOUT_S = float(os.environ.get('EMAIL_DRAIN_TIMEOUT_S', 10))
+    # Avisos ao administrador (novos registros, blacklist): o primeiro de cada tipo
+    # sai na hora, os seguintes na janela viram um resumo (0 desativa o agrupamento)
+    ADMIN_DIGEST_WINDOW_S = int(os.environ.get('ADMIN_DIGEST_WINDOW_S', 300))
+    ADMIN_DIGEST_TOP = int(os.environ.get('ADMIN_DIGEST_TOP', 10))
     APP_NAME = 'Sistema de Login com Firewall'
     
     # Configurações de rate limiting
-    RATELIMIT_STORAGE_URL = 'memory://'
+    # shared:// = contadores em arquivo mapeado em memória sob instance/, comuns a
+    # todos os workers (limite global exato); memory:// conta por worker
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI', 'shared://')
+    RATELIMIT_SHARED_SLOTS = int(os.environ.get('RATELIMIT_SHARED_SLOTS', 65536))
+    RATELIMIT_SHARED_STRIPES = int(os.environ.get('RATELIMIT_SHARED_STRIPES', 64))
     RATELIMIT_DEFAULT = "100 per hour"
     
     # Configurações de firewall
+    # Backend que aplica as regras no kernel: 'iptables', 'nftables', 'helper'
+    # (processo auxiliar via socket Unix) ou 'fake' (testes)
+    FIREWALL_BACKEND = os.environ.get('FIREWALL_BACKEND', 'iptables').lower()
+    # Processo auxiliar privilegiado (firewall_helper.py): socket, backend real e janela de fusão
+    FIREWALL_HELPER_SOCKET = os.environ.get('FIREWALL_HELPER_SOCKET', '/run/firewall_login/helper.sock')
+    FIREWALL_HELPER_BACKEND = os.environ.get('FIREWALL_HELPER_BACKEND', 'iptables').lower()
+    FIREWALL_HELPER_MERGE_MS = int(os.environ.get('FIREWALL_HELPER_MERGE_MS', 5))
+    FIREWALL_HELPER_TIMEOUT = float(os.environ.get('FIREWALL_HELPER_TIMEOUT', 30))
+    FIREWALL_HELPER_SOCKET_MODE = os.environ.get('FIREWALL_HELPER_SOCKET_MODE', '660')
+    FIREWALL_HELPER_SOCKET_GROUP = os.environ.get('FIREWALL_HELPER_SOCKET_GROUP', '')
     FIREWALL_CHAIN = os.environ.get('FIREWALL_CHAIN', 'FIREWALL_LOGIN_ALLOW')
     FIREWALL_BLACK = os.environ.get('FIREWALL_BLACK', 'BLACKLIST')
     IPTABLES_PATH = '/sbin/iptables'
+    IPTABLES_RESTORE_PATH = os.environ.get('IPTABLES_RESTORE_PATH', '/sbin/iptables-restore')
+    IP6TABLES_RESTORE_PATH = os.environ.get('IP6TABLES_RESTORE_PATH', '/sbin/ip6tables-restore')
+    IPTABLES_SAVE_PATH = os.environ.get('IPTABLES_SAVE_PATH', '/sbin/iptables-save')
+    IP6TABLES_SAVE_PATH = os.environ.get('IP6TABLES_SAVE_PATH', '/sbin/ip6tables-save')
+    IPTABLES_RULES_V4 = os.environ.get('IPTABLES_RULES_V4', '/etc/iptables/rules.v4')
+    IPTABLES_RULES_V6 = os.environ.get('IPTABLES_RULES_V6', '/etc/iptables/rules.v6')
+    IPSET_RULES = os.environ.get('IPSET_RULES', '/etc/iptables/ipsets')
+    # Janela (segundos) para agrupar gravações do ruleset em disco; 0 grava a cada alteração
+    FIREWALL_SAVE_INTERVAL = float(os.environ.get('FIREWALL_SAVE_INTERVAL', 5))
+    # Reconciliador: tamanho máximo do lote e latência máxima de agrupamento
+    FIREWALL_RECONCILE_BATCH_SIZE = int(os.environ.get('FIREWALL_RECONCILE_BATCH_SIZE', 50))
+    FIREWALL_RECONCILE_LATENCY_MS = int(os.environ.get('FIREWALL_RECONCILE_LATENCY_MS', 50))
+    # Intervalo (minutos) da sincronização completa banco x firewall
+    FIREWALL_SYNC_INTERVAL = int(os.environ.get('FIREWALL_SYNC_INTERVAL', 10))
+    # Sessões expiradas encerradas por bloco na limpeza periódica
+    SESSION_CLEANUP_CHUNK = int(os.environ.get('SESSION_CLEANUP_CHUNK', 1000))
+    # Cache das sessões validadas: segundos de validade (0 desativa) e tamanho máximo
+    SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', 30))
+    SESSION_CACHE_MAX_ENTRIES = int(os.environ.get('SESSION_CACHE_MAX_ENTRIES', 10000))
+    # 'shared' (arquivo mapeado em memória sob instance/, visto por todos os workers) ou 'local'
+    SESSION_CACHE_BACKEND = os.environ.get('SESSION_CACHE_BACKEND', 'shared')
+    SESSION_CACHE_PATH = os.environ.get('SESSION_CACHE_PATH')
+    SESSION_CACHE_SLOTS = int(os.environ.get('SESSION_CACHE_SLOTS', 16384))
+    SESSION_CACHE_STRIPES = int(os.environ.get('SESSION_CACHE_STRIPES', 64))
     FIREWALL_ENABLED = os.environ.get('FIREWALL_ENABLED', 'true').lower() in ['true', 'on', '1', 'yes']
+    # Liberações de sessão expiram no kernel (timeout de ipset/nftables) junto com a sessão
+    FIREWALL_SESSION_TIMEOUTS = os.environ.get('FIREWALL_SESSION_TIMEOUTS', 'true').lower() in ['true', 'on', '1', 'yes']
+    # Whitelist em 'rules' (uma regra por IP) ou 'ipset' (sets hash:ip/hash:net + uma regra por família)
+    FIREWALL_WHITELIST_MODE = os.environ.get('FIREWALL_WHITELIST_MODE', 'rules').lower()
+    IPSET_PATH = os.environ.get('IPSET_PATH', '/sbin/ipset')
+    FIREWALL_IPSET_TYPE = os.environ.get('FIREWALL_IPSET_TYPE', 'hash:net')
+    FIREWALL_IPSET_V4 = os.environ.get('FIREWALL_IPSET_V4', 'FIREWALL_LOGIN_ALLOW_V4')
+    FIREWALL_IPSET_V6 = os.environ.get('FIREWALL_IPSET_V6', 'FIREWALL_LOGIN_ALLOW_V6')
+    # Backend nftables: tabela inet única com sets nomeados
+    NFT_PATH = os.environ.get('NFT_PATH', '/usr/sbin/nft')
+    FIREWALL_NFT_TABLE = os.environ.get('FIREWALL_NFT_TABLE', 'firewall_login')
+    FIREWALL_NFT_RULES = os.environ.get('FIREWALL_NFT_RULES', '/etc/nftables.d/firewall_login.nft')
     
     # Configurações de logging
     LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
     LOG_FILE = os.environ.get('LOG_FILE') or 'logs/firewall_login.log'
     LOG_MAX_SIZE = os.environ.get('LOG_MAX_SIZE') or '10MB'
     LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT') or 5)
+    # Gravação em lote dos logs do sistema (tabela system_logs)
+    SYSTEM_LOG_ASYNC = os.environ.get('SYSTEM_LOG_ASYNC', 'true').lower() in ['true', 'on', '1', 'yes']
+    SYSTEM_LOG_BATCH_SIZE = int(os.environ.get('SYSTEM_LOG_BATCH_SIZE', 100))
+    SYSTEM_LOG_FLUSH_MS = int(os.environ.get('SYSTEM_LOG_FLUSH_MS', 500))
+    SYSTEM_LOG_QUEUE_SIZE = int(os.environ.get('SYSTEM_LOG_QUEUE_SIZE', 10000))
+    SYSTEM_LOG_BLOCK_MS = int(os.environ.get('SYSTEM_LOG_BLOCK_MS', 100))
+    # Política por nível com a fila cheia (drop, block ou sync), ex.: "DEBUG=drop,ERROR=sync"
+    SYSTEM_LOG_POLICY = os.environ.get('SYSTEM_LOG_POLICY', '')
+    # Retenção: partições diárias (system_logs_pAAAAMMDD) mais antigas são descartadas
+    SYSTEM_LOG_RETENTION_DAYS = int(os.environ.get('SYSTEM_LOG_RETENTION_DAYS', 30))
+    # Tamanho dos blocos ao limpar a tabela system_logs anterior ao particionamento
+    SYSTEM_LOG_DELETE_CHUNK = int(os.environ.get('SYSTEM_LOG_DELETE_CHUNK', 5000))
+    # Estatísticas vêm da tabela stat_counters; reconciliação com as contagens reais (minutos)
+    STATS_RECONCILE_INTERVAL = int(os.environ.get('STATS_RECONCILE_INTERVAL', 60))
+    # Listagens paginadas por cursor (?cursor=, ?limit=) e exportação em streaming (?stream=json|ndjson)
+    API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 50))
+    API_PAGE_MAX = int(os.environ.get('API_PAGE_MAX', 500))
+    # Registro das requisições: nível mínimo (DEBUG 2xx/3xx, WARNING 4xx, ERROR 5xx),
+    # amostragem por endpoint e endpoints sempre registrados (prefixos)
+    REQUEST_LOG_LEVEL = os.environ.get('REQUEST_LOG_LEVEL') or LOG_LEVEL
+    REQUEST_LOG_SAMPLE_RATE = float(os.environ.get('REQUEST_LOG_SAMPLE_RATE', 1.0))
+    # Taxa por endpoint ou blueprint, ex.: "api.api_status=0,main.dashboard=0.1,api.=0.5"
+    REQUEST_LOG_SAMPLING = os.environ.get('REQUEST_LOG_SAMPLING', 'api.api_status=0')
+    REQUEST_LOG_ALWAYS = os.environ.get('REQUEST_LOG_ALWAYS', 'auth.')
+    # Todas as requisições são contadas por minuto/endpoint/status (tabela request_counters)
+    REQUEST_COUNTER_FLUSH_S = int(os.environ.get('REQUEST_COUNTER_FLUSH_S', 60))
     
     # Configurações do Captcha
     CAPTCHA_ENABLED = os.environ.get('CAPTCHA_ENABLED', 'true').lower() in ['true', 'on', '1']
@@ -64,9 +181,18 @@ class ProductionConfig(Config):
 class TestingConfig(Config):
     """Configurações para testes"""
     TESTING = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///test.db'
+    # Banco e log fora do repositório: os testes não tocam em instance/ nem em logs/
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
+        'sqlite:///' + os.path.join(tempfile.gettempdir(), 'firewall_login_test.db')
+    LOG_FILE = os.path.join(tempfile.gettempdir(), 'firewall_login_test.log')
+    FIREWALL_BACKEND = 'fake'
+    SESSION_CACHE_BACKEND = 'local'
+    RATELIMIT_STORAGE_URI = 'memory://'
     WTF_CSRF_ENABLED = False
     SESSION_COOKIE_SECURE = False
+    # Nunca enviar emails reais durante os testes
+    MAIL_SUPPRESS_SEND = True
+    ADMIN_EMAIL = 'admin@localhost'
 
 # Dicionário de configurações
 config = {
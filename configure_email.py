@@ -74,7 +74,7 @@ IPTABLES_PATH=/sbin/iptables
 IP6TABLES_PATH=/sbin/ip6tables
 
 # Configurações de rate limiting
-RATELIMIT_STORAGE_URL=memory://
+RATELIMIT_STORAGE_URI=shared://
 RATELIMIT_DEFAULT=100 per hour
 """
     
@@ -0,0 +1,28 @@
+"""
+Configuração do pytest: os scripts de teste usam a configuração de testes
+"""
+import os
+
+import pytest
+
+# Os scripts que chamam create_app() sem argumento leem FLASK_ENV; sob o
+# pytest eles não devem usar o banco de desenvolvimento nem o SMTP real
+os.environ['FLASK_ENV'] = 'testing'
+
+
+@pytest.fixture(autouse=True)
+def isolated_database(tmp_path):
+    """Banco próprio por teste: threads de aplicações criadas em testes
+    anteriores (workers de email, gravador de logs, agendador) continuam
+    ativas, mas gravando no banco do teste que as criou"""
+    if os.environ.get('TEST_DATABASE_URL'):
+        yield
+        return
+    from config.config import TestingConfig
+
+    original = TestingConfig.SQLALCHEMY_DATABASE_URI
+    TestingConfig.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'firewall_login_test.db')
+    try:
+        yield
+    finally:
+        TestingConfig.SQLALCHEMY_DATABASE_URI = original
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+"""
+Processo auxiliar privilegiado do firewall
+
+Executar como root; a aplicação (FIREWALL_BACKEND=helper) envia as
+operações por socket Unix em vez de executar iptables/nft diretamente.
+
+    sudo python firewall_helper.py --setup
+"""
+from app.firewall_helper import main
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,7 @@ def test_simple_email():
         
         # Importar módulos
         from app import create_app, mail
+        from app.models import db
         from app.email import send_email
         
         # Criar app
@@ -95,6 +96,9 @@ Sistema de Login
                 text_body=text_body,
                 html_body=html_body
             )
+            # O email vai para a outbox com a transação; os workers entregam após o commit
+            db.session.commit()
+            app.email_worker.flush()
             
             print("✅ Email enviado com sucesso!")
             print(f"📧 Destinatário: {recipients[0]}")
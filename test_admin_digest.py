@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Script para testar o agrupamento dos avisos ao administrador em resumos
+"""
+import os
+import sys
+import json
+from datetime import datetime, timedelta
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_admin_digest():
+    """Testa envio imediato do primeiro aviso, agrupamento na janela e o email de resumo"""
+    from app import create_app, mail
+    from app.models import db, AdminDigestEvent, EmailOutbox, User
+    from app.email import send_blacklist_email_admin, send_admin_new_registration_email
+    from app.tasks import cleanup_email_outbox
+
+    app = create_app('testing')
+    app.config.update(EMAIL_POLL_S=0.05, MAIL_DEFAULT_SENDER='sistema@exemplo.com')
+    app.email_worker.init_app(app)
+    digest = app.admin_digest
+    window = digest.window
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        try:
+            print("📬 Testando resumos dos avisos ao administrador...")
+            users = []
+            for i in range(4):
+                user = User(email=f'resumo{i}@exemplo.com', confirmed=True, status='approved')
+                user.set_password('senha123')
+                users.append(user)
+            db.session.add_all(users)
+            db.session.commit()
+
+            with app.test_request_context():
+                # Primeiro bloqueio: email individual imediato
+                send_blacklist_email_admin(users[0], '192.0.2.1')
+                db.session.commit()
+                assert EmailOutbox.query.filter_by(template='blacklist_admin').count() == 1
+                # Seguintes na janela: apenas registrados
+                for user, ip in [(users[1], '192.0.2.2'), (users[2], '192.0.2.2'), (users[3], '192.0.2.3'),
+                                 (users[1], '192.0.2.2')]:
+                    send_blacklist_email_admin(user, ip)
+                db.session.commit()
+                assert EmailOutbox.query.count() == 1
+                assert AdminDigestEvent.query.filter_by(status='pending').count() == 4
+                # Outro tipo tem a sua própria janela
+                send_admin_new_registration_email(users[0])
+                db.session.commit()
+                assert EmailOutbox.query.filter_by(template='admin_new_registration').count() == 1
+            print("   Primeiro aviso imediato e seguintes agrupados OK")
+
+            assert app.email_worker.flush()
+            with mail.record_messages() as outbox:
+                # Janela ainda aberta: nenhum resumo
+                assert digest.flush() == 0
+                # Janela encerrada: um resumo com contagem, IPs e contas
+                assert digest.flush(datetime.utcnow() + timedelta(seconds=window + 1)) == 1
+                assert AdminDigestEvent.query.filter_by(status='pending').count() == 0
+                row = EmailOutbox.query.filter_by(template='admin_digest').one()
+                context = json.loads(row.context)
+                assert context['count'] == 4 and context['account_count'] == 3
+                assert context['top_ips'][0] == ['192.0.2.2', 3]
+                assert context['accounts'][0] == ['resumo1@exemplo.com', 2]
+                assert digest.flush(datetime.utcnow() + timedelta(seconds=window + 1)) == 0
+
+                assert app.email_worker.flush()
+                summary = [message for message in outbox if 'Resumo' in message.subject]
+                assert len(summary) == 1
+                assert summary[0].recipients == [app.config['ADMIN_EMAIL']]
+                assert '192.0.2.2 (3)' in summary[0].body and 'resumo3@exemplo.com' in summary[0].html
+            print("   ✅ Resumo da janela OK")
+
+            # Retenção: a limpeza da outbox remove os eventos já enviados e mantém os pendentes
+            with app.test_request_context():
+                send_blacklist_email_admin(users[2], '192.0.2.4')
+                db.session.commit()
+            assert AdminDigestEvent.query.filter_by(status='pending').count() == 1
+            cleanup_email_outbox(app, days=0)
+            assert [event.status for event in AdminDigestEvent.query.all()] == ['pending']
+            print("   ✅ Retenção dos eventos OK")
+        finally:
+            app.email_worker.shutdown()
+            app.request_log_policy.shutdown()
+            app.system_log_writer.shutdown()
+            app.log_partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    test_admin_digest()
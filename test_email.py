@@ -33,6 +33,7 @@ def test_email_functions():
         
         # Importar módulos necessários
         from app import create_app, mail
+        from app.models import db
         from app.email import send_confirmation_email, send_welcome_email, send_login_notification
         
         # Criar aplicação Flask
@@ -56,6 +57,9 @@ def test_email_functions():
             print("📨 Teste 1: Email de confirmação")
             try:
                 send_confirmation_email(user)
+                # Os emails vão para a outbox com a transação; os workers entregam após o commit
+                db.session.commit()
+                app.email_worker.flush()
                 print("   ✅ Email de confirmação enviado com sucesso!")
             except Exception as e:
                 print(f"   ❌ Erro ao enviar email de confirmação: {str(e)}")
@@ -65,6 +69,8 @@ def test_email_functions():
             print("📨 Teste 2: Email de boas-vindas")
             try:
                 send_welcome_email(user)
+                db.session.commit()
+                app.email_worker.flush()
                 print("   ✅ Email de boas-vindas enviado com sucesso!")
             except Exception as e:
                 print(f"   ❌ Erro ao enviar email de boas-vindas: {str(e)}")
@@ -74,6 +80,8 @@ def test_email_functions():
             print("📨 Teste 3: Notificação de login")
             try:
                 send_login_notification(user, '192.168.1.100', 'Mozilla/5.0 (Test Browser)')
+                db.session.commit()
+                app.email_worker.flush()
                 print("   ✅ Notificação de login enviada com sucesso!")
             except Exception as e:
                 print(f"   ❌ Erro ao enviar notificação de login: {str(e)}")
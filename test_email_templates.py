@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Script para testar os templates de email pré-compilados e a renderização no worker
+"""
+import os
+import sys
+import json
+from datetime import datetime
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_email_templates():
+    """Testa compilação na inicialização, cache por tipo e renderização fora da requisição"""
+    from app import create_app, mail
+    from app.models import db, EmailOutbox, User
+    from app.email_templates import EMAIL_TYPES
+    from app.email import send_login_notification, send_blacklist_email_admin
+
+    app = create_app('testing')
+    app.config.update(EMAIL_POLL_S=0.05, MAIL_DEFAULT_SENDER='sistema@exemplo.com')
+    app.email_worker.init_app(app)
+    renderer = app.email_renderer
+    app_name = app.config['APP_NAME']
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        try:
+            print("✉️  Testando templates de email pré-compilados...")
+            # Todos os tipos compilados na inicialização e renderizáveis só com as suas variáveis
+            assert set(renderer._compiled) == set(EMAIL_TYPES)
+            samples = {'confirm_url': 'https://localhost/auth/confirm/abc', 'login_url': 'https://localhost/auth/login',
+                       'reset_url': 'https://localhost/auth/reset-password/abc', 'login_time': '01/01/2024 às 10:00:00',
+                       'ip_address': '192.0.2.7', 'user_agent': 'pytest',
+                       'user': {'email': 'modelo@exemplo.com', 'created_at': '2024-01-01 10:00:00'},
+                       'title': 'bloqueios', 'count': 3, 'since': '01/01/2024 10:00:00', 'until': '01/01/2024 10:04:00',
+                       'top_ips': [['192.0.2.8', 2]], 'accounts': [['resumo@exemplo.com', 3]], 'account_count': 1}
+            for name, email_type in EMAIL_TYPES.items():
+                rendered = renderer.render(name, {key: samples[key] for key in email_type.variables})
+                assert rendered.subject.startswith(f'[{app_name}]'), name
+                assert app_name in rendered.text and app_name in rendered.html, name
+                for key in email_type.variables:
+                    value = samples[key]['email'] if key == 'user' else samples[key]
+                    if isinstance(value, list):
+                        value = value[0][0]
+                    assert str(value) in rendered.text, (name, key)
+
+            # Mesmo contexto: resultado do cache
+            hits = renderer.hits
+            renderer.render('blacklist_user', {'ip_address': '192.0.2.7'})
+            assert renderer.hits == hits + 1
+            # Variáveis escapadas apenas no HTML
+            rendered = renderer.render('blacklist_user', {'ip_address': '<b>x</b>'})
+            assert '<b>x</b>' in rendered.text and '&lt;b&gt;x&lt;/b&gt;' in rendered.html
+            print("   Templates compilados e cache por tipo OK")
+
+            # A requisição grava só o tipo e as variáveis; o worker renderiza
+            user = User(email='template@exemplo.com', confirmed=True, status='approved')
+            user.set_password('senha123')
+            db.session.add(user)
+            db.session.commit()
+            with mail.record_messages() as outbox:
+                with app.test_request_context():
+                    send_login_notification(user, '198.51.100.9', 'Navegador de teste')
+                    send_blacklist_email_admin(user, '198.51.100.9')
+                    db.session.commit()
+                rows = EmailOutbox.query.order_by(EmailOutbox.id).all()
+                assert all(row.text_body is None and row.html_body is None for row in rows)
+                assert json.loads(rows[0].context)['ip_address'] == '198.51.100.9'
+                assert app.email_worker.flush()
+                login, blacklist = outbox
+                assert login.subject == f'[{app_name}] Login realizado em sua conta'
+                assert '198.51.100.9' in login.body and 'Navegador de teste' in login.html
+                assert login.recipients == ['template@exemplo.com']
+                assert blacklist.recipients == [app.config['ADMIN_EMAIL']]
+                assert 'template@exemplo.com' in blacklist.body
+            print("   ✅ Renderização no worker OK")
+        finally:
+            app.email_worker.shutdown()
+            app.request_log_policy.shutdown()
+            app.system_log_writer.shutdown()
+            app.log_partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    test_email_templates()
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+Script para testar o gerenciador de firewall sem executar comandos reais
+"""
+import os
+import sys
+import time
+import tempfile
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.firewall import FirewallManager
+from app.backends import FakeBackend, NftablesBackend, RuleChange
+from app.blacklist import BlacklistCompiler
+from app.persistence import RulesetPersister
+from app.ruleset import to_network, parse_save_lines
+
+
+def create_recording_manager(outputs=None):
+    """Cria um FirewallManager que registra os comandos em vez de executá-los"""
+    manager = FirewallManager()
+    manager.commands = []
+    outputs = outputs or {}
+
+    def fake_run(command, *args, **kwargs):
+        manager.commands.append(command)
+        return True, outputs.get(tuple(command[:3]), '')
+
+    manager.backend._run_command = fake_run
+    manager.backend._stream_command = lambda command: iter(fake_run(command)[1].splitlines(True))
+    manager._save_iptables_rules = lambda: True
+    # Único processo alterando as regras: o índice decide o que enviar
+    manager.exclusive = True
+    # Kernel inicialmente vazio
+    manager.index.replace([])
+    return manager
+
+
+def test_ipset_whitelist():
+    """Testa a whitelist baseada em ipset"""
+    print("🧱 Testando whitelist via ipset...")
+
+    manager = create_recording_manager({
+        ('/sbin/ipset', 'save', 'FIREWALL_LOGIN_ALLOW_V4'):
+            'create FIREWALL_LOGIN_ALLOW_V4 hash:net family inet\n'
+            'add FIREWALL_LOGIN_ALLOW_V4 192.168.1.10\n'
+            'add FIREWALL_LOGIN_ALLOW_V4 10.0.0.0/24',
+        ('/sbin/ipset', 'save', 'FIREWALL_LOGIN_ALLOW_V6'):
+            'add FIREWALL_LOGIN_ALLOW_V6 2001:db8::1',
+    })
+    manager.backend.whitelist_mode = 'ipset'
+    manager.backend.ipset_v4 = 'FIREWALL_LOGIN_ALLOW_V4'
+    manager.backend.ipset_v6 = 'FIREWALL_LOGIN_ALLOW_V6'
+    manager.index.replace([('FIREWALL_LOGIN_ALLOW', to_network('2001:db8::1'))])
+
+    inputs = []
+    recording_run = manager.backend._run_command
+    manager.backend._run_command = lambda command, input_data=None: (
+        inputs.append(input_data) or recording_run(command, input_data)
+    )
+
+    assert manager.add_ip_to_firewall('192.168.1.10')
+    assert manager.commands[-1] == ['/sbin/ipset', 'restore', '-exist']
+    assert inputs[-1] == 'add FIREWALL_LOGIN_ALLOW_V4 192.168.1.10 -exist\n'
+
+    assert manager.remove_ip_from_firewall('2001:db8::1')
+    assert inputs[-1] == 'del FIREWALL_LOGIN_ALLOW_V6 2001:db8::1 -exist\n'
+
+    # Com timeout, o membro expira no kernel; repetir a adição renova o prazo
+    with manager.transaction() as tx:
+        tx.add_ip('192.168.1.10', timeout=600)
+    assert inputs[-1] == 'add FIREWALL_LOGIN_ALLOW_V4 192.168.1.10 timeout 600 -exist\n'
+
+    assert not manager.add_ip_to_firewall('ip-invalido')
+
+    allowed = manager.list_allowed_ips()
+    print(f"   IPs permitidos: {allowed}")
+    assert allowed == ['192.168.1.10', '10.0.0.0/24', '2001:db8::1']
+    print("   ✅ Whitelist via ipset OK")
+
+
+def test_transaction():
+    """Testa a aplicação em lote via iptables-restore"""
+    print("📦 Testando transações do firewall...")
+
+    manager = create_recording_manager()
+
+    with manager.transaction() as tx:
+        tx.add_ip('192.0.2.10')
+        tx.add_ip('192.0.2.10')
+        tx.remove_ip('192.0.2.20')
+        tx.add_ip('2001:db8::10')
+        tx.add_ip('198.51.100.7', tipo='blacklist')
+
+    assert tx.success
+    # Uma invocação por família, independente do número de IPs
+    assert [command[0] for command in manager.commands] == ['/sbin/iptables-restore', '/sbin/ip6tables-restore']
+    assert all('--noflush' in command for command in manager.commands)
+
+    # Exceção dentro do bloco descarta as operações
+    manager.commands = []
+    try:
+        with manager.transaction() as tx:
+            tx.add_ip('192.0.2.30')
+            raise RuntimeError('falha simulada')
+    except RuntimeError:
+        pass
+    assert manager.commands == []
+    print("   ✅ Transações OK")
+
+
+def test_transaction_payload():
+    """Testa o conteúdo enviado ao iptables-restore"""
+    manager = FirewallManager()
+    payloads = []
+    manager.backend._run_command = lambda command, input_data=None: (payloads.append(input_data) or (True, ''))
+    manager._save_iptables_rules = lambda: True
+    manager.exclusive = True
+    manager.index.replace([('BLACKLIST', to_network('192.0.2.20'))])
+
+    assert manager.apply_operations([
+        ('add', 'whitelist', '192.0.2.10'),
+        ('remove', 'blacklist', '192.0.2.20'),
+        # Remoção de IP ausente não gera comando (evita falha do -D)
+        ('remove', 'whitelist', '192.0.2.99'),
+    ])
+    assert payloads == [
+        '*filter\n'
+        '-A FIREWALL_LOGIN_ALLOW -s 192.0.2.10 -j ACCEPT\n'
+        '-D BLACKLIST -s 192.0.2.20 -j DROP\n'
+        'COMMIT\n'
+    ]
+
+
+def test_rule_index_rehydration():
+    """Testa a reconstrução do índice a partir do iptables-save e a diferença mínima"""
+    print("🗂️ Testando índice de regras...")
+
+    manager = create_recording_manager({
+        ('/sbin/iptables-save', '-t', 'filter'):
+            '*filter\n'
+            ':INPUT DROP [0:0]\n'
+            ':FIREWALL_LOGIN_ALLOW - [0:0]\n'
+            '-A INPUT -j FIREWALL_LOGIN_ALLOW\n'
+            '-A FIREWALL_LOGIN_ALLOW -s 192.0.2.10/32 -j ACCEPT\n'
+            '-A FIREWALL_LOGIN_ALLOW -s 192.0.2.11/32 -j ACCEPT\n'
+            '-A BLACKLIST -s 203.0.113.0/24 -j DROP\n'
+            'COMMIT\n',
+    })
+    manager.index.invalidate()
+
+    # Primeira operação reidrata o índice; IP já presente não gera comando
+    assert manager.apply_operations([('add', 'whitelist', '192.0.2.10')])
+    assert [command[0] for command in manager.commands] == ['/sbin/iptables-save', '/sbin/ip6tables-save']
+    assert manager.index.contains('FIREWALL_LOGIN_ALLOW', '192.0.2.11')
+    assert manager.index.contains('BLACKLIST', '203.0.113.0/24')
+
+    # Índice carregado: nenhuma nova leitura do kernel
+    manager.commands = []
+    assert manager.apply_operations([('remove', 'whitelist', '192.0.2.11')])
+    assert [command[0] for command in manager.commands] == ['/sbin/iptables-restore']
+    assert not manager.index.contains('FIREWALL_LOGIN_ALLOW', '192.0.2.11')
+    print("   ✅ Índice OK")
+
+
+def test_nftables_backend():
+    """Testa o script enviado ao nft pelo backend nftables"""
+    print("🧬 Testando backend nftables...")
+
+    manager = FirewallManager()
+    manager.backend = NftablesBackend()
+    scripts = []
+    outputs = {}
+    manager.backend._run_command = lambda command, input_data=None: (
+        (input_data is not None and scripts.append(input_data)) or (True, outputs.get(tuple(command[1:3]), ''))
+    )
+    manager._save_iptables_rules = lambda: True
+    manager.index.replace([])
+
+    assert manager.backend.setup()
+    # IPs em sets exatos, redes em sets de intervalo; nenhum set funde elementos
+    assert 'add set inet firewall_login whitelist_ip_v4 { type ipv4_addr; flags timeout; }' in scripts[-1]
+    assert 'add set inet firewall_login whitelist_net_v4 { type ipv4_addr; flags interval, timeout; }' in scripts[-1]
+    assert scripts[-1].count('add set') == 8
+    assert 'auto-merge' not in scripts[-1]
+    # A blacklist é avaliada antes da liberação do HTTPS
+    assert scripts[-1].index('@blacklist_net_v4 drop') < scripts[-1].index('dport 443 accept')
+
+    scripts.clear()
+    with manager.transaction() as tx:
+        tx.add_ip('192.0.2.10')
+        tx.add_ip('2001:db8::/64')
+        tx.add_ip('198.51.100.7', tipo='blacklist')
+    assert tx.success
+    # Todo o lote (v4 e v6) em um único 'nft -f -'
+    assert scripts == [
+        'add element inet firewall_login whitelist_ip_v4 { 192.0.2.10 }\n'
+        'add element inet firewall_login whitelist_net_v6 { 2001:db8::/64 }\n'
+        'add element inet firewall_login blacklist_ip_v4 { 198.51.100.7 }\n'
+    ]
+
+    # Renovação de prazo: add garante a existência, delete + add redefine o timeout
+    scripts.clear()
+    with manager.transaction() as tx:
+        tx.add_ip('192.0.2.10', timeout=3600)
+        tx.remove_ip('2001:db8::/64')
+    assert scripts == [
+        'add element inet firewall_login whitelist_ip_v4 { 192.0.2.10 }\n'
+        'delete element inet firewall_login whitelist_ip_v4 { 192.0.2.10 }\n'
+        'add element inet firewall_login whitelist_ip_v4 { 192.0.2.10 timeout 3600s }\n'
+        'add element inet firewall_login whitelist_net_v6 { 2001:db8::/64 }\n'
+        'delete element inet firewall_login whitelist_net_v6 { 2001:db8::/64 }\n'
+    ]
+
+    # IP dentro de uma rede liberada: cada um no seu set, sem conflito de intervalo
+    scripts.clear()
+    with manager.transaction() as tx:
+        tx.add_ip('203.0.113.0/24')
+        tx.add_ip('203.0.113.7', timeout=600)
+        tx.add_ip('203.0.113.8', timeout=600)
+    assert tx.success
+    assert 'add element inet firewall_login whitelist_net_v4 { 203.0.113.0/24 }' in scripts[-1]
+    assert 'add element inet firewall_login whitelist_ip_v4 { 203.0.113.7 timeout 600s }' in scripts[-1]
+
+    # Remover o IP não abre um buraco na rede...
+    scripts.clear()
+    assert manager.remove_ip_from_firewall('203.0.113.7')
+    assert scripts == [
+        'add element inet firewall_login whitelist_ip_v4 { 203.0.113.7 }\n'
+        'delete element inet firewall_login whitelist_ip_v4 { 203.0.113.7 }\n'
+    ]
+    # ...e remover a rede mantém o IP ainda ativo, com o próprio timeout
+    scripts.clear()
+    assert manager.remove_ip_from_firewall('203.0.113.0/24')
+    assert scripts == [
+        'add element inet firewall_login whitelist_net_v4 { 203.0.113.0/24 }\n'
+        'delete element inet firewall_login whitelist_net_v4 { 203.0.113.0/24 }\n'
+    ]
+    assert manager.index.contains('FIREWALL_LOGIN_ALLOW', '203.0.113.8')
+
+    outputs[('-j', 'list')] = (
+        '{"nftables": [{"metainfo": {}}, '
+        '{"set": {"name": "whitelist_ip_v4", "elem": ["192.0.2.10", {"elem": {"val": "192.0.2.11", "timeout": 3600}}]}}, '
+        '{"set": {"name": "whitelist_net_v4", "elem": [{"prefix": {"addr": "10.0.0.0", "len": 24}}, '
+        '{"prefix": {"addr": "10.1.0.0", "len": 16}}]}}, '
+        '{"set": {"name": "whitelist_v4", "elem": ["192.0.2.99"]}}, '
+        '{"set": {"name": "blacklist_net_v4", "elem": [{"range": ["198.51.100.0", "198.51.100.3"]}]}}]}'
+    )
+    # Elementos exatos (sem fusão); sets fora do layout atual são ignorados
+    assert sorted(manager.list_allowed_ips()) == ['10.0.0.0/24', '10.1.0.0/16', '192.0.2.10', '192.0.2.11']
+    manager.rehydrate_index()
+    assert manager.index.contains('BLACKLIST', '198.51.100.0/30')
+
+    # Rede sobreposta a outra do set de intervalos: ignorada sem derrubar o lote
+    scripts.clear()
+    with manager.transaction() as tx:
+        tx.add_ip('10.0.0.0/16')
+        tx.add_ip('192.0.2.20')
+    assert tx.success
+    assert scripts == ['add element inet firewall_login whitelist_ip_v4 { 192.0.2.20 }\n']
+    assert not manager.index.contains('FIREWALL_LOGIN_ALLOW', '10.0.0.0/16')
+    assert manager.index.contains('FIREWALL_LOGIN_ALLOW', '192.0.2.20')
+    # Remover uma rede que já não está no kernel não gera comando
+    scripts.clear()
+    outputs[('-j', 'list')] = outputs[('-j', 'list')].replace(
+        '{"prefix": {"addr": "10.1.0.0", "len": 16}}', '{"prefix": {"addr": "10.2.0.0", "len": 16}}'
+    )
+    assert manager.remove_ip_from_firewall('10.1.0.0/16')
+    assert scripts == []
+    assert not manager.index.contains('FIREWALL_LOGIN_ALLOW', '10.1.0.0/16')
+    print("   ✅ Backend nftables OK")
+
+
+def test_fake_backend():
+    """Testa o backend em memória e a reidratação após falha"""
+    manager = FirewallManager()
+    manager.backend = FakeBackend()
+    manager._save_iptables_rules = lambda: True
+    manager.exclusive = True
+
+    assert manager.add_ip_to_firewall('192.0.2.10')
+    assert manager.add_ip_to_firewall('192.0.2.10')
+    assert manager.backend.batches == [[RuleChange('add', 'whitelist', to_network('192.0.2.10'))]]
+
+    # Falha do lote invalida o índice; o próximo uso reconstrói a partir do backend
+    manager.backend.fail_next = True
+    assert not manager.apply_operations([('add', 'blacklist', '203.0.113.5')])
+    assert not manager.index.loaded
+    assert manager.apply_operations([('add', 'blacklist', '203.0.113.5')])
+    assert manager.index.contains('FIREWALL_LOGIN_ALLOW', '192.0.2.10')
+    assert manager.list_allowed_ips() == ['192.0.2.10']
+
+    # A reidratação mantém o prazo das entradas que continuam no kernel
+    assert manager.apply_operations([('add', 'whitelist', '192.0.2.50', 3600)])
+    manager.rehydrate_index()
+    assert ('FIREWALL_LOGIN_ALLOW', to_network('192.0.2.50')) in manager.index._deadlines
+    assert ('FIREWALL_LOGIN_ALLOW', to_network('192.0.2.10')) not in manager.index._deadlines
+    manager.remove_ip_from_firewall('192.0.2.50')
+    manager.rehydrate_index()
+    assert ('FIREWALL_LOGIN_ALLOW', to_network('192.0.2.50')) not in manager.index._deadlines
+
+    # Entradas com timeout vencido deixam de constar no índice
+    manager.index.add('FIREWALL_LOGIN_ALLOW', '192.0.2.77', timeout=0)
+    assert not manager.index.contains('FIREWALL_LOGIN_ALLOW', '192.0.2.77')
+    assert to_network('192.0.2.77') not in manager.index.networks('FIREWALL_LOGIN_ALLOW')
+
+
+def test_shared_backend():
+    """Testa dois processos (workers) alterando o mesmo kernel"""
+    backend = FakeBackend()
+    workers = []
+    for _ in range(2):
+        manager = FirewallManager()
+        manager.backend = backend
+        manager._save_iptables_rules = lambda: True
+        workers.append(manager)
+    a, b = workers
+
+    # Os dois índices carregados antes do login
+    assert a.add_ip_to_firewall('192.0.2.20')
+    assert b.add_ip_to_firewall('192.0.2.30')
+
+    # Login tratado por um worker, logout por outro que nunca viu a adição
+    assert a.add_ip_to_firewall('192.0.2.10')
+    assert b.remove_ip_from_firewall('192.0.2.10')
+    assert to_network('192.0.2.10') not in backend.entries['whitelist']
+
+    # Novo login pelo primeiro worker, cujo índice ainda mostra o IP
+    assert a.add_ip_to_firewall('192.0.2.10')
+    assert to_network('192.0.2.10') in backend.entries['whitelist']
+
+    # Blacklist com -D não idempotente: o índice é relido antes da diferença
+    backend.idempotent = lambda tipo: tipo == 'whitelist'
+    assert a.apply_operations([('add', 'blacklist', '203.0.113.5')])
+    assert b.apply_operations([('remove', 'blacklist', '203.0.113.5')])
+    assert backend.entries['blacklist'] == set()
+    # Remoção de IP ausente não é enviada (o -D falharia o lote)
+    batches = len(backend.batches)
+    assert a.apply_operations([('remove', 'blacklist', '203.0.113.5')])
+    assert len(backend.batches) == batches
+
+
+def test_blacklist_compiler():
+    """Testa a deduplicação, agregação em CIDRs e contagem de referências da blacklist"""
+    print("🚫 Testando compilador da blacklist...")
+
+    compiler = BlacklistCompiler()
+    compiler.load([
+        (1, '192.0.2.0'),
+        (2, '192.0.2.1'),
+        (3, '192.0.2.1'),          # duplicado por outra regra
+        (4, '192.0.2.2/31'),
+        (5, '198.51.100.0/24'),    # rede informada pelo admin
+        (6, '198.51.100.77'),      # contido na rede acima
+        (7, '2001:db8::1'),
+        (8, 'ip-invalido'),
+    ])
+    assert compiler.compile() == [
+        to_network('192.0.2.0/30'), to_network('198.51.100.0/24'), to_network('2001:db8::1')
+    ]
+    assert compiler.refcount('192.0.2.1') == 2
+
+    # Remover uma das regras do IP duplicado mantém o intervalo fechado
+    compiler.remove(2)
+    assert compiler.covers('192.0.2.1')
+    compiler.remove(3)
+    assert not compiler.covers('192.0.2.1')
+    assert to_network('192.0.2.0/32') in compiler.networks()
+    # A rede do admin continua cobrindo o IP da regra removida
+    compiler.remove(6)
+    assert compiler.covers('198.51.100.77')
+
+    # O set compilado é o que vai para o kernel: apenas a diferença é aplicada
+    manager = FirewallManager()
+    manager.backend = FakeBackend()
+    manager._save_iptables_rules = lambda: True
+    manager.index.replace([('BLACKLIST', to_network('192.0.2.1'))])
+    with manager.transaction() as tx:
+        manager._stage_diff(tx, 'blacklist', compiler.networks())
+    assert tx.success
+    assert manager.index.networks('BLACKLIST') == compiler.networks()
+    print("   ✅ Compilador da blacklist OK")
+
+
+def test_save_parser():
+    """Testa o parser estruturado da saída do iptables-save"""
+    lines = iter([
+        '# Generated by ip6tables-save\n',
+        '*filter\n',
+        ':FIREWALL_LOGIN_ALLOW - [0:0]\n',
+        '-A FIREWALL_LOGIN_ALLOW -s 2001:db8::1/128 -j ACCEPT\n',
+        '-A FIREWALL_LOGIN_ALLOW -m set --match-set FIREWALL_LOGIN_ALLOW_V6 src -j ACCEPT\n',
+        '-A INPUT ! -s 2001:db8::/32 -p tcp -m comment --comment "porta web" --dport 443 -j ACCEPT\n',
+        'COMMIT\n',
+    ])
+    records = list(parse_save_lines(lines, 6))
+
+    assert len(records) == 3
+    assert records[0].chain == 'FIREWALL_LOGIN_ALLOW'
+    assert records[0].source == to_network('2001:db8::1')
+    assert records[0].target == 'ACCEPT' and records[0].table == 'filter'
+    assert records[1].matches == ('set',) and records[1].source is None
+    assert records[2].source is None
+    assert records[2].matches == ('comment',)
+    assert '--dport' in records[2].args and 'porta web' in records[2].args
+
+    manager = create_recording_manager({
+        ('/sbin/iptables-save', '-t', 'filter'):
+            '*filter\n-A FIREWALL_LOGIN_ALLOW -s 192.0.2.10/32 -j ACCEPT\n-A BLACKLIST -s 192.0.2.66/32 -j DROP\nCOMMIT\n',
+        ('/sbin/ip6tables-save', '-t', 'filter'):
+            '*filter\n-A FIREWALL_LOGIN_ALLOW -s 2001:db8::/64 -j ACCEPT\nCOMMIT\n',
+    })
+    assert sorted(manager.list_allowed_ips()) == ['192.0.2.10', '2001:db8::/64']
+
+
+def test_persistence_debounce():
+    """Testa o agrupamento e a gravação atômica do ruleset"""
+    print("💾 Testando persistência agrupada...")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'rules.v4')
+        dump = ['sh', '-c', 'printf "# Generated at $(date +%N)\\n:INPUT ACCEPT [$$:100]\\n-A INPUT -j DROP\\n"']
+        persister = RulesetPersister()
+        persister.configure([(dump, path)], interval=0.2)
+
+        dumps = []
+        original_dump = persister._dump_to_file
+        persister._dump_to_file = lambda command, target: dumps.append(target) or original_dump(command, target)
+
+        # Muitas alterações dentro da janela resultam em uma única gravação
+        # (janela aberta por uma gravação recente, sem gravação imediata)
+        persister._last_flush = time.monotonic()
+        for _ in range(50):
+            persister.mark_dirty()
+        time.sleep(0.5)
+        assert len(dumps) == 1
+
+        with open(path) as f:
+            content = f.read()
+        assert content == ':INPUT ACCEPT [0:0]\n-A INPUT -j DROP\n'
+
+        # Conteúdo idêntico não reescreve o arquivo
+        mtime = os.stat(path).st_mtime_ns
+        persister.mark_dirty()
+        persister.shutdown()
+        assert os.stat(path).st_mtime_ns == mtime
+        assert not [name for name in os.listdir(directory) if name.startswith('.rules-')]
+
+        # Apenas os prazos restantes mudaram: arquivo mantido
+        ipset_path = os.path.join(directory, 'ipsets')
+        ipset_dump = ['sh', '-c', 'printf "create S hash:net timeout 0\\nadd S 192.0.2.10 timeout $$\\n"']
+        persister.configure([(ipset_dump, ipset_path)], interval=0)
+        persister.mark_dirty()
+        mtime = os.stat(ipset_path).st_mtime_ns
+        persister.mark_dirty()
+        assert os.stat(ipset_path).st_mtime_ns == mtime
+
+        # Falha no dump: a alteração continua pendente e é gravada na janela seguinte
+        failing = os.path.join(directory, 'rules.v6')
+        persister.configure([(['false'], failing)], interval=0.1)
+        persister.mark_dirty()
+        time.sleep(0.35)
+        assert dumps.count(failing) >= 2 and not os.path.exists(failing)
+        persister.configure([(dump, failing)], interval=0.1)
+        deadline = time.monotonic() + 2
+        while not os.path.exists(failing) and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert os.path.exists(failing)
+        persister.shutdown()
+    print("   ✅ Persistência OK")
+
+
+if __name__ == '__main__':
+    test_ipset_whitelist()
+    test_transaction()
+    test_transaction_payload()
+    test_rule_index_rehydration()
+    test_nftables_backend()
+    test_fake_backend()
+    test_shared_backend()
+    test_blacklist_compiler()
+    test_save_parser()
+    test_persistence_debounce()
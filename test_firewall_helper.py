@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Script para testar o processo auxiliar do firewall (socket Unix) sem executar comandos reais
+"""
+import os
+import sys
+import tempfile
+import threading
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.backends import FakeBackend, HelperBackend
+from app.firewall import FirewallManager
+from app.firewall_helper import FirewallHelperServer
+from app.ruleset import to_network
+
+
+def create_helper(directory, merge_window=0.05):
+    """Inicia o processo auxiliar (em thread) com backend em memória"""
+    helper_manager = FirewallManager()
+    helper_manager.backend = FakeBackend()
+    helper_manager._save_iptables_rules = lambda: True
+    helper_manager.exclusive = True
+    helper_manager.index.replace([])
+
+    server = FirewallHelperServer(os.path.join(directory, 'helper.sock'), helper_manager, merge_window=merge_window)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def create_client(server):
+    """FirewallManager de um worker apontando para o processo auxiliar"""
+    manager = FirewallManager()
+    manager.backend = HelperBackend()
+    manager.backend.socket_path = server.socket_path
+    return manager
+
+
+def test_firewall_helper():
+    """Testa fusão de lotes concorrentes e resultados por operação"""
+    print("🔌 Testando processo auxiliar do firewall...")
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = create_helper(directory)
+        try:
+            workers = [create_client(server) for _ in range(8)]
+            results = []
+
+            def login(manager, number):
+                results.append(manager.add_ip_to_firewall(f'192.0.2.{number}'))
+
+            threads = [threading.Thread(target=login, args=(manager, i + 1)) for i, manager in enumerate(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            backend = server.manager.backend
+            assert all(results) and len(results) == 8
+            # Requisições que chegam juntas são aplicadas em menos transações
+            assert len(backend.batches) < 8
+            assert len(backend.entries['whitelist']) == 8
+
+            # Resultado individual: IP inválido falha sem afetar os demais
+            success, op_results = workers[0].backend.apply_operations([
+                ('add', 'blacklist', '203.0.113.9'),
+                ('add', 'whitelist', 'ip-invalido'),
+            ])
+            assert not success and op_results == [True, False]
+
+            # Índice compartilhado: outro worker enxerga o estado aplicado pelo primeiro
+            assert workers[1].add_ip_to_firewall('192.0.2.1')
+            assert sorted(workers[1].list_allowed_ips())[:2] == ['192.0.2.1', '192.0.2.2']
+            workers[1].rehydrate_index()
+            assert workers[1].index.contains('BLACKLIST', '203.0.113.9')
+
+            # Falha do lote: o auxiliar reconstrói o índice e responde pelo estado real
+            backend.fail_next = True
+            assert not workers[2].remove_ip_from_firewall('192.0.2.3')
+            assert to_network('192.0.2.3') in backend.entries['whitelist']
+            assert workers[2].remove_ip_from_firewall('192.0.2.3')
+            assert to_network('192.0.2.3') not in backend.entries['whitelist']
+            print("   ✅ Processo auxiliar OK")
+        finally:
+            server.stop()
+            server.server_close()
+
+    # Processo auxiliar indisponível: falha sem exceção
+    manager = FirewallManager()
+    manager.backend = HelperBackend()
+    manager.backend.socket_path = '/nonexistent/helper.sock'
+    assert not manager.add_ip_to_firewall('192.0.2.10')
+
+
+if __name__ == '__main__':
+    test_firewall_helper()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Script para testar a gravação assíncrona e em lote dos logs do sistema
+"""
+import os
+import sys
+import threading
+from datetime import datetime
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_log_writer():
+    """Testa o agrupamento dos registros e as políticas com a fila cheia"""
+    from app import create_app
+    from app.models import db, SystemLog
+    from app.log_writer import SystemLogWriter
+
+    app = create_app('testing')
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        writer = app.system_log_writer
+        partitions = app.log_partitions
+
+        try:
+            print("📝 Testando gravação em lote dos logs...")
+            inserts = []
+            original_insert = writer._insert
+            writer._insert = lambda records: inserts.append(len(records)) or original_insert(records)
+
+            for i in range(250):
+                assert SystemLog.log(level='INFO', message=f'Requisição {i}', module='request') is None
+            # Nenhum commit no caminho da requisição: a sessão fica intacta
+            assert not db.session.new
+            writer.flush()
+
+            assert partitions.count() == 250
+            assert sum(inserts) == 250 and len(inserts) <= 5
+            assert writer.stats()['written'] == 250
+            print(f"   250 registros gravados em {len(inserts)} INSERTs")
+
+            # Fila cheia: DEBUG é descartado, ERROR é gravado diretamente
+            full = SystemLogWriter(app)
+            full.queue_size = 2
+            full.batch_size = 1
+            release = threading.Event()
+            full_insert = full._insert
+
+            def slow_insert(records):
+                if threading.current_thread().name == 'system-log-writer':
+                    release.wait(5)
+                return full_insert(records)
+
+            full._insert = slow_insert
+            for i in range(3):
+                full.write('WARNING', f'Ocupando fila {i}', 'teste')
+            full.write('DEBUG', 'Descartado', 'teste')
+            full.write('ERROR', 'Gravado diretamente', 'teste')
+            stats = full.stats()
+            assert stats['dropped'] == 1 and stats['sync_writes'] == 1
+
+            release.set()
+            full.shutdown()
+            assert partitions.count(where=lambda t: t.c.module == 'teste') == 4
+            assert partitions.count(where=lambda t: t.c.message == 'Descartado') == 0
+            print("   ✅ Gravação de logs OK")
+        finally:
+            writer.shutdown()
+            partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    test_log_writer()
@@ -18,7 +18,7 @@ def test_logging():
     print("=== Teste do Sistema de Logging ===")
     
     # Criar aplicação
-    app = create_app('development')
+    app = create_app('testing')
     
     with app.app_context():
         # Testar logs básicos
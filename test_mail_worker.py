@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Script para testar a outbox de emails e o pool de entrega
+"""
+import os
+import smtplib
+import sys
+import threading
+from datetime import datetime, timedelta
+from smtplib import SMTPServerDisconnected
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_mail_worker():
+    """Testa outbox transacional, reutilização da conexão, novas tentativas e lease vencido"""
+    from flask_mail import Connection
+    from app import create_app, mail
+    from app.models import db, EmailOutbox, User
+    from app.email import send_email
+    from app.tasks import cleanup_email_outbox
+    from app.captcha import captcha_manager
+
+    app = create_app('testing')
+    app.config.update(EMAIL_WORKERS=1, EMAIL_RETRY_BACKOFF_S=0.01, EMAIL_MAX_PER_CONNECTION=4,
+                      EMAIL_POLL_S=0.05, RATELIMIT_ENABLED=False)
+    worker = app.email_worker
+    worker.init_app(app)
+
+    original_send = Connection.send
+    original_smtp = smtplib.SMTP, smtplib.SMTP_SSL
+
+    def real_smtp(*args, **kwargs):
+        raise AssertionError('conexão SMTP real aberta durante os testes')
+
+    # TESTING suprime o envio: nenhuma conexão SMTP real é aberta
+    assert worker.suppress
+    smtplib.SMTP = smtplib.SMTP_SSL = real_smtp
+    failures = {'remaining': 1}
+
+    def flaky_send(connection, message, envelope_from=None):
+        if failures['remaining']:
+            failures['remaining'] -= 1
+            raise SMTPServerDisconnected('conexão encerrada pelo servidor')
+        return original_send(connection, message, envelope_from)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        try:
+            print("📬 Testando outbox e pool de entrega de emails...")
+            with mail.record_messages() as outbox:
+                # Desfeito junto com a transação: nada é enviado
+                send_email('Desfeito', 'sistema@exemplo.com', ['x@exemplo.com'], 'corpo', email_type='teste')
+                db.session.rollback()
+                assert EmailOutbox.query.count() == 0
+
+                for i in range(6):
+                    send_email(f'Assunto {i}', 'sistema@exemplo.com', [f'destino{i}@exemplo.com'],
+                               'corpo', email_type='teste')
+                db.session.commit()
+                assert worker.flush()
+                assert [msg.subject for msg in outbox] == [f'Assunto {i}' for i in range(6)]
+                assert EmailOutbox.query.filter_by(status='sent').count() == 6
+                stats = worker.stats()
+                # 6 mensagens, no máximo 4 por conexão: 2 conexões
+                assert stats['sent'] == 6 and stats['connections'] == 2 and stats['pending'] == 0
+                print(f"   Conexões reutilizadas: {stats['connections']} para {stats['sent']} emails")
+
+                # Falha no envio: reagendado com espera e entregue na nova tentativa
+                Connection.send = flaky_send
+                send_email('Com falha', 'sistema@exemplo.com', ['falha@exemplo.com'], 'corpo', email_type='teste')
+                db.session.commit()
+                deadline = datetime.utcnow() + timedelta(seconds=5)
+                while outbox[-1].subject != 'Com falha' and datetime.utcnow() < deadline:
+                    worker.flush()
+                row = EmailOutbox.query.filter_by(subject='Com falha').one()
+                assert row.status == 'sent' and row.attempts == 2
+                assert worker.stats()['retries'] == 1
+                print("   Nova tentativa após falha OK")
+
+                # Processo que morreu com o lote reivindicado: o lease vence e o email é entregue
+                now = datetime.utcnow()
+                db.session.add_all([
+                    EmailOutbox(subject='Lease vencido', sender='sistema@exemplo.com', recipients='a@exemplo.com', text_body='corpo',
+                                lease_owner='morto', lease_until=now - timedelta(seconds=1)),
+                    EmailOutbox(subject='Lease ativo', sender='sistema@exemplo.com', recipients='b@exemplo.com', text_body='corpo',
+                                lease_owner='outro', lease_until=now + timedelta(minutes=5)),
+                ])
+                db.session.commit()
+                assert worker.flush()
+                assert outbox[-1].subject == 'Lease vencido'
+                assert EmailOutbox.query.filter_by(subject='Lease ativo').one().status == 'pending'
+
+                # Registro: emails do usuário e do admin gravados com o usuário
+                captcha_manager.enabled = False
+                response = app.test_client().post('/auth/register', data={
+                    'email': 'outbox@exemplo.com', 'password': 'senha-segura-1', 'password2': 'senha-segura-1'
+                })
+                assert response.status_code == 302
+                assert User.query.filter_by(email='outbox@exemplo.com').count() == 1
+                types = {row.email_type for row in EmailOutbox.query.filter(EmailOutbox.id > row.id)}
+                assert {'registro recebido', 'notificação admin novo registro'} <= types
+
+            # Limpeza da outbox como no agendador: em outra thread, sem contexto da aplicação
+            result = []
+            thread = threading.Thread(target=lambda: result.append(cleanup_email_outbox(app, days=0)))
+            thread.start()
+            thread.join()
+            assert result[0] >= 8
+            assert EmailOutbox.query.filter(EmailOutbox.status.in_(['sent', 'failed'])).count() == 0
+            worker.shutdown()
+            assert not any(thread.is_alive() for thread in worker._threads)
+            print("   ✅ Outbox de emails OK")
+        finally:
+            Connection.send = original_send
+            smtplib.SMTP, smtplib.SMTP_SSL = original_smtp
+            captcha_manager.enabled = True
+            worker.shutdown()
+            app.request_log_policy.shutdown()
+            app.system_log_writer.shutdown()
+            app.log_partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+
+def test_connection_backoff():
+    """Testa a espera exponencial após falha de conexão e o lease renovado antes do envio"""
+    import time
+    from app import create_app, mail
+    from app.models import db, EmailOutbox
+    from app.email import send_email
+
+    app = create_app('testing')
+    app.config.update(EMAIL_WORKERS=1, EMAIL_RETRY_BACKOFF_S=1.0, EMAIL_RETRY_BACKOFF_MAX_S=1.0,
+                      EMAIL_POLL_S=0.05, RATELIMIT_ENABLED=False)
+    worker = app.email_worker
+    worker.init_app(app)
+    attempts = []
+
+    def failing_connect(mail):
+        attempts.append(time.monotonic())
+        raise ConnectionRefusedError('servidor SMTP fora do ar')
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        try:
+            print("🔌 Testando espera após falha de conexão SMTP...")
+            with mail.record_messages() as outbox:
+                # Servidor fora do ar: uma tentativa de conexão no ciclo, não uma por email
+                worker._connect = failing_connect
+                for i in range(3):
+                    send_email(f'Fora do ar {i}', 'sistema@exemplo.com', [f'destino{i}@exemplo.com'],
+                               'corpo', email_type='teste')
+                db.session.commit()
+
+                def outbox_state():
+                    db.session.expire_all()
+                    return [(row.attempts, row.status, row.lease_until)
+                            for row in EmailOutbox.query.order_by(EmailOutbox.id)]
+
+                # Os emails não tentados voltam para a fila sem lease
+                expected = [(1, 'pending', None), (0, 'pending', None), (0, 'pending', None)]
+                deadline = time.monotonic() + 5
+                while outbox_state() != expected and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                assert outbox_state() == expected
+                # Ainda dentro da espera do worker: nenhuma nova tentativa
+                assert len(attempts) == 1
+                assert worker.stats()['connection_failures'] == 1
+
+                # Servidor de volta: o worker reconecta após a espera e entrega tudo
+                del worker._connect
+                deadline = time.monotonic() + 5
+                while len(outbox) < 3 and time.monotonic() < deadline:
+                    worker.flush()
+                assert sorted(msg.subject for msg in outbox) == [f'Fora do ar {i}' for i in range(3)]
+                assert len(attempts) == 1
+
+                # Email reivindicado por outro worker depois do lease vencido: não é enviado de novo
+                worker.shutdown()
+                send_email('Reivindicado', 'sistema@exemplo.com', ['r@exemplo.com'], 'corpo', email_type='teste')
+                db.session.commit()
+                batch = worker._claim('lento')
+                assert [row.subject for row in batch] == ['Reivindicado']
+                EmailOutbox.query.filter_by(subject='Reivindicado').update({'lease_owner': 'outro'})
+                db.session.commit()
+                worker._close(worker._deliver(batch, 'lento', None)[0])
+                assert outbox[-1].subject != 'Reivindicado'
+                row = EmailOutbox.query.filter_by(subject='Reivindicado').one()
+                assert row.status == 'pending' and row.lease_owner == 'outro' and row.attempts == 0
+            print("   ✅ Espera após falha de conexão OK")
+        finally:
+            worker.__dict__.pop('_connect', None)
+            worker.shutdown()
+            app.request_log_policy.shutdown()
+            app.system_log_writer.shutdown()
+            app.log_partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    test_mail_worker()
+    test_connection_backoff()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Script para testar a paginação por cursor e as listagens em streaming da API
+"""
+import os
+import sys
+import json
+from datetime import datetime, timedelta
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_pagination():
+    """Testa cursor (created_at, id), empates de created_at e os modos JSON/NDJSON"""
+    from app import create_app
+    from app.models import db, User, UserSession, FirewallRule
+    from app.pagination import encode_cursor, decode_cursor
+
+    app = create_app('testing')
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        try:
+            print("📄 Testando paginação por cursor...")
+            stamp = datetime(2024, 5, 1, 12, 30)
+            assert decode_cursor(encode_cursor(stamp, 42)) == (stamp, 42)
+            try:
+                decode_cursor('nao-e-cursor')
+                assert False, 'cursor inválido aceito'
+            except ValueError:
+                pass
+
+            admin = User(email='paginas@exemplo.com', confirmed=True, status='approved', role='admin')
+            admin.set_password('teste123')
+            db.session.add(admin)
+            db.session.commit()
+            # Metade das sessões com o mesmo created_at: o id desempata
+            now = datetime.utcnow()
+            sessions = [UserSession(user_id=admin.id, ip_address=f'192.0.2.{i}', user_agent='pytest') for i in range(1, 8)]
+            for i, sess in enumerate(sessions):
+                sess.created_at = now - timedelta(minutes=i // 2)
+            db.session.add_all(sessions)
+            db.session.commit()
+            db.session.add_all([
+                FirewallRule(ip_address=s.ip_address, user_id=admin.id, session_id=s.id, created_at=s.created_at)
+                for s in sessions
+            ])
+            db.session.commit()
+            records = [{'level': 'INFO', 'message': f'Atividade {i}', 'module': 'teste', 'user_id': admin.id,
+                        'created_at': now - timedelta(days=i // 3, minutes=i)} for i in range(8)]
+            with db.engine.begin() as connection:
+                app.log_partitions.insert(connection, records)
+
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = admin.id
+                sess['session_token'] = sessions[0].session_token
+
+            def walk(path, key, limit):
+                ids, cursor = [], None
+                while True:
+                    query = f'{path}?limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+                    data = client.get(query).get_json()
+                    assert len(data[key]) <= limit
+                    ids.extend(row['id'] for row in data[key])
+                    cursor = data['next_cursor']
+                    if cursor is None:
+                        return ids
+
+            expected = [s.id for s in sorted(sessions, key=lambda s: (s.created_at, s.id), reverse=True)]
+            assert walk('/api/user/sessions', 'active_sessions', 3) == expected
+            rule_ids = walk('/api/firewall/rules', 'rules', 2)
+            assert len(rule_ids) == 7 and len(set(rule_ids)) == 7
+            activity = walk('/api/user/activity', 'activity', 3)
+            assert len(activity) == 8 and len(set(activity)) == 8
+            assert client.get('/api/user/sessions?cursor=xyz').status_code == 400
+            response = client.get('/api/user/sessions?limit=0')
+            assert response.status_code == 400 and 'Limite inválido' in response.get_json()['error']
+            assert client.get('/api/firewall/rules?limit=-1').status_code == 400
+            # total_active conta todas as sessões ativas, não só as da página
+            assert client.get('/api/user/sessions?limit=3').get_json()['total_active'] == 7
+            print("   Páginas completas, sem repetição nem lacunas")
+
+            # Streaming: JSON e NDJSON com a listagem completa
+            response = client.get('/api/user/sessions?stream=json')
+            assert response.is_streamed and response.mimetype == 'application/json'
+            assert [row['id'] for row in json.loads(response.get_data(as_text=True))['active_sessions']] == expected
+            response = client.get('/api/firewall/rules?stream=ndjson')
+            lines = response.get_data(as_text=True).splitlines()
+            assert response.mimetype == 'application/x-ndjson' and len(lines) == 7
+            assert json.loads(lines[0])['user_email'] == admin.email
+            lines = client.get('/api/user/activity?stream=ndjson').get_data(as_text=True).splitlines()
+            assert [json.loads(line)['id'] for line in lines] == activity
+            assert client.get('/api/user/activity?stream=xml').status_code == 400
+
+            # Painel do administrador pagina as regras
+            app.config['API_PAGE_SIZE'] = 5
+            page = client.get('/firewall_manager').get_data(as_text=True)
+            assert 'Próxima página' in page and page.count('name="acao" value="remover"') == 5
+            print("   ✅ Paginação e streaming OK")
+        finally:
+            app.request_log_policy.shutdown()
+            app.system_log_writer.shutdown()
+            app.log_partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    test_pagination()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Script para verificar os planos de execução das consultas frequentes (EXPLAIN QUERY PLAN)
+"""
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Tabelas que não podem ser lidas por inteiro nas consultas frequentes
+HOT_TABLES = re.compile(r'^(user_sessions|firewall_rules|system_logs(_p\d{8})?)$')
+
+
+def _full_scans(connection, statement, parameters, partial_indexes):
+    """Linhas do plano que leem uma tabela frequente inteira"""
+    plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        match = re.match(r'^SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?', detail)
+        # Percorrer um índice parcial (só regras/sessões ativas) é aceitável
+        if match and HOT_TABLES.match(match.group(1)) and match.group(2) not in partial_indexes:
+            scans.append(detail)
+    return scans
+
+
+def test_query_plans():
+    """Executa as rotas e tarefas frequentes e verifica o plano de cada consulta"""
+    from sqlalchemy import event
+    from app import create_app
+    from app.models import db, User, UserSession, FirewallRule
+    from app.migrations import upgrade_indexes
+    from app.pagination import encode_cursor
+    from app.tasks import cleanup_expired_sessions, sync_firewall_rules
+
+    app = create_app('testing')
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        assert upgrade_indexes() == []
+        # Banco antigo sem os índices novos: a migração os cria
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql('DROP INDEX ix_firewall_rules_session_active')
+            connection.exec_driver_sql('DROP INDEX ix_user_sessions_active_expires')
+        assert set(upgrade_indexes()) == {'ix_firewall_rules_session_active', 'ix_user_sessions_active_expires'}
+        firewall_manager = app.firewall_manager
+        firewall_manager._save_iptables_rules = lambda: True
+        partial_indexes = {
+            index.name for table in db.metadata.sorted_tables for index in table.indexes
+            if index.dialect_options['sqlite'].get('where') is not None
+        }
+
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and re.match(r'^\s*(SELECT|UPDATE|DELETE)', statement) \
+                    and re.search(r'\b(user_sessions|firewall_rules|system_logs)', statement):
+                statements.append((statement, parameters))
+
+        try:
+            print("🔎 Verificando planos das consultas frequentes...")
+            admin = User(email='planos@exemplo.com', confirmed=True, status='approved', role='admin')
+            admin.set_password('teste123')
+            db.session.add(admin)
+            db.session.commit()
+            sessions = [UserSession(user_id=admin.id, ip_address=f'192.0.2.{i}', user_agent='pytest') for i in range(1, 4)]
+            sessions[2].expires_at = datetime.utcnow() - timedelta(minutes=1)
+            db.session.add_all(sessions)
+            db.session.commit()
+            db.session.add_all([
+                FirewallRule(ip_address=s.ip_address, user_id=admin.id, session_id=s.id, iptables_rule_added=True)
+                for s in sessions
+            ] + [FirewallRule(ip_address='198.51.100.0/24', user_id=admin.id, session_id=sessions[0].id,
+                            tipo='blacklist', chain='BLACKLIST')])
+            db.session.commit()
+
+            event.listen(db.engine, 'before_cursor_execute', capture)
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = admin.id
+                sess['session_token'] = sessions[0].session_token
+
+            # Rotas
+            cursor = encode_cursor(datetime.utcnow(), 10 ** 12)
+            for path in ('/api/user/session', '/dashboard', '/auth/account', '/api/user/sessions',
+                         '/api/user/activity', '/firewall_manager', f'/api/user/sessions?cursor={cursor}',
+                         f'/api/user/activity?cursor={cursor}', f'/api/firewall/rules?cursor={cursor}',
+                         '/api/firewall/rules?stream=ndjson', f'/firewall_manager?cursor={cursor}'):
+                response = client.get(path)
+                assert response.status_code == 200, path
+                response.get_data()
+            client.get(f'/auth/end-session/{sessions[1].id}')
+            app.firewall_reconciler.flush()
+            client.get('/auth/logout')
+            app.firewall_reconciler.flush()
+
+            # Tarefas
+            cleanup_expired_sessions()
+            sync_firewall_rules()
+            firewall_manager.apply_blacklist()
+            event.remove(db.engine, 'before_cursor_execute', capture)
+
+            assert len(statements) >= 15
+            failures = []
+            with db.engine.connect() as connection:
+                for statement, parameters in statements:
+                    scans = _full_scans(connection, statement, parameters, partial_indexes)
+                    if scans:
+                        failures.append(f"{' '.join(statement.split())}\n      -> {scans}")
+            assert not failures, "Consultas com leitura completa da tabela:\n" + '\n'.join(failures)
+            print(f"   ✅ {len(statements)} consultas verificadas, nenhuma varredura completa")
+        finally:
+            if event.contains(db.engine, 'before_cursor_execute', capture):
+                event.remove(db.engine, 'before_cursor_execute', capture)
+            app.request_log_policy.shutdown()
+            app.system_log_writer.shutdown()
+            app.log_partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    test_query_plans()
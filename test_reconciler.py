@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Script para testar o reconciliador do firewall orientado a eventos
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_reconciler():
+    """Testa a aplicação imediata de eventos de login/logout no firewall"""
+    from app import create_app
+    from app.models import db, User, UserSession, FirewallRule
+
+    app = create_app('testing')
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        # Backend em memória (FIREWALL_BACKEND = 'fake' na configuração de testes)
+        firewall_manager = app.firewall_manager
+        commands = firewall_manager.backend.batches
+        firewall_manager._save_iptables_rules = lambda: True
+
+        try:
+            print("⚡ Testando reconciliador do firewall...")
+            user = User(email='reconciler@exemplo.com', confirmed=True, status='approved')
+            user.set_password('teste123')
+            db.session.add(user)
+            db.session.commit()
+
+            sessions = [UserSession(user_id=user.id, ip_address='192.0.2.50') for _ in range(2)]
+            db.session.add_all(sessions)
+            db.session.commit()
+            rules = [
+                FirewallRule(ip_address='192.0.2.50', user_id=user.id, session_id=s.id, tipo='whitelist')
+                for s in sessions
+            ]
+            db.session.add_all(rules)
+            db.session.commit()
+
+            reconciler = app.firewall_reconciler
+            for rule in rules:
+                reconciler.submit('add', 'whitelist', rule.ip_address, rule.id)
+            reconciler.flush()
+
+            # Duas sessões do mesmo IP geram uma única regra no firewall
+            assert len(commands) == 1
+            assert [change.action for change in commands[0]] == ['add']
+            db.session.expire_all()
+            assert all(rule.iptables_rule_added for rule in FirewallRule.query.all())
+
+            # A entrada expira no kernel junto com a sessão (24h)
+            assert 86000 < commands[0][0].timeout <= 86400
+
+            # Encerrar uma das sessões mantém o IP liberado pela outra (apenas renova o prazo)
+            commands.clear()
+            sessions[1].expires_at = datetime.utcnow() + timedelta(hours=1)
+            rules[0].mark_as_removed()
+            sessions[0].end_session()
+            db.session.commit()
+            reconciler.submit('remove', 'whitelist', rules[0].ip_address, rules[0].id)
+            reconciler.flush()
+            assert len(commands) == 1 and commands[0][0].action == 'add'
+            assert 3500 < commands[0][0].timeout <= 3600
+
+            # Estender a sessão renova o prazo da entrada existente
+            commands.clear()
+            sessions[1].extend_session(hours=24)
+            db.session.commit()
+            reconciler.submit('refresh', 'whitelist', sessions[1].ip_address)
+            reconciler.flush()
+            assert len(commands) == 1 and commands[0][0].timeout > 86000
+
+            # Encerrar a última sessão remove o IP
+            commands.clear()
+            rules[1].mark_as_removed()
+            db.session.commit()
+            reconciler.submit('remove', 'whitelist', rules[1].ip_address, rules[1].id)
+            reconciler.flush()
+            assert len(commands) == 1 and commands[0][0].action == 'remove'
+            print("   ✅ Reconciliador OK")
+        finally:
+            reconciler.shutdown()
+            db.session.remove()
+            db.drop_all()
+
+
+def test_login_blacklist():
+    """Testa a blacklist criada pelo login com senha errada (regra sem sessão) e a migração da coluna"""
+    from sqlalchemy import inspect
+    from app import create_app
+    from app.captcha import captcha_manager
+    from app.migrations import upgrade_nullable_columns
+    from app.models import db, User, FirewallRule
+
+    app = create_app('testing')
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        commands = app.firewall_manager.backend.batches
+        app.firewall_manager._save_iptables_rules = lambda: True
+        session_id = FirewallRule.__table__.c.session_id
+        nullable = session_id.nullable
+
+        try:
+            print("⛔ Testando blacklist pelo login com senha errada...")
+            # Banco antigo: session_id NOT NULL; a migração recria a tabela mantendo as regras
+            session_id.nullable = False
+            FirewallRule.__table__.drop(db.engine)
+            FirewallRule.__table__.create(db.engine)
+            session_id.nullable = nullable
+            user = User(email='blacklist@exemplo.com', confirmed=True, status='approved')
+            user.set_password('senha-correta')
+            db.session.add(user)
+            db.session.commit()
+            db.session.add(FirewallRule(ip_address='192.0.2.60', user_id=user.id, session_id=1))
+            db.session.commit()
+            assert upgrade_nullable_columns() == ['firewall_rules.session_id']
+            assert upgrade_nullable_columns() == []
+            columns = {column['name']: column for column in inspect(db.engine).get_columns('firewall_rules')}
+            assert columns['session_id']['nullable']
+            indexes = {index['name'] for index in inspect(db.engine).get_indexes('firewall_rules')}
+            assert {index.name for index in FirewallRule.__table__.indexes} <= indexes
+            assert FirewallRule.query.one().ip_address == '192.0.2.60'
+
+            # Cinco senhas erradas: usuário e IP na blacklist
+            captcha_manager.enabled = False
+            client = app.test_client()
+            for _ in range(5):
+                response = client.post('/auth/login', data={'email': user.email, 'password': 'senha-errada'},
+                                       environ_base={'REMOTE_ADDR': '198.51.100.7'})
+                assert response.status_code == 200
+            app.firewall_reconciler.flush()
+            db.session.expire_all()
+            assert db.session.get(User, user.id).status == 'blacklist'
+            rule = FirewallRule.query.filter_by(tipo='blacklist').one()
+            assert rule.ip_address == '198.51.100.7' and rule.session_id is None and rule.is_active
+            assert rule.iptables_rule_added
+            assert [(change.action, change.tipo, str(change.network)) for batch in commands for change in batch] == \
+                [('add', 'blacklist', '198.51.100.7/32')]
+            print("   ✅ Blacklist pelo login OK")
+        finally:
+            session_id.nullable = nullable
+            captcha_manager.enabled = True
+            app.firewall_reconciler.shutdown()
+            app.email_worker.shutdown()
+            app.request_log_policy.shutdown()
+            app.system_log_writer.shutdown()
+            app.log_partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    test_reconciler()
+    test_login_blacklist()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Script para testar a política de registro das requisições e os contadores por minuto
+"""
+import os
+import sys
+from datetime import datetime
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_request_logging():
+    """Testa nível mínimo, amostragem, endpoints sempre registrados e contadores"""
+    from app import create_app
+    from app.models import db, RequestCounter
+    from app.request_logging import parse_rates
+
+    app = create_app('testing')
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        policy = app.request_log_policy
+        writer = app.system_log_writer
+        partitions = app.log_partitions
+        client = app.test_client()
+
+        try:
+            print("📝 Testando política de registro das requisições...")
+            assert parse_rates('api.api_status=0, main.dashboard=0.1,invalido,x=abc') == {
+                'api.api_status': 0.0, 'main.dashboard': 0.1
+            }
+            assert policy.sample_rate('api.api_status') == 0.0
+            policy.rates['api.'] = 0.5
+            assert policy.sample_rate('api.user_session_info') == 0.5
+            del policy.rates['api.']
+
+            # Alto volume: /api/status só é contado, nunca gravado linha a linha
+            for _ in range(20):
+                assert client.get('/api/status').status_code == 200
+            # 401 (WARNING) atinge o nível INFO e é gravado
+            assert client.get('/api/user/session').status_code == 401
+            # Autenticação é sempre registrada, mesmo abaixo do nível mínimo
+            client.get('/auth/login')
+            writer.flush()
+
+            assert partitions.count(where=lambda t: t.c.message.like('%/api/status%')) == 0
+            rows = partitions.recent(100, where=lambda t: t.c.module.in_(['request', 'api_request']))
+            assert {(row.module, row.level) for row in rows} == {('api_request', 'WARNING'), ('request', 'DEBUG')}
+            print(f"   {len(rows)} requisições gravadas em system_logs")
+
+            assert policy.flush() == 3
+            counters = {(c.endpoint, c.status): c.count for c in RequestCounter.query.all()}
+            assert counters[('api.api_status', 200)] == 20
+            assert counters[('api.user_session_info', 401)] == 1
+
+            # Nova gravação no mesmo minuto soma ao contador existente
+            for _ in range(5):
+                client.get('/api/status')
+            policy.flush()
+            db.session.expire_all()
+            counter = RequestCounter.query.filter_by(endpoint='api.api_status', status=200).all()
+            assert sum(c.count for c in counter) == 25 and len(counter) <= 2
+            print("   ✅ Política de registro e contadores OK")
+        finally:
+            policy.shutdown()
+            writer.shutdown()
+            partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    test_request_logging()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Script para testar o cache das sessões validadas
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_session_cache():
+    """Testa validação em cache, limite pelo vencimento e invalidação explícita"""
+    from sqlalchemy import event
+    from app import create_app
+    from app.models import db, User, UserSession
+
+    app = create_app('testing')
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        cache = app.session_cache
+        cache.clear()
+
+        queries = []
+
+        def count_session_queries(conn, cursor, statement, parameters, context, executemany):
+            if 'FROM user_sessions' in statement:
+                queries.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_session_queries)
+        try:
+            print("🗂️  Testando cache das sessões validadas...")
+            user = User(email='cache@exemplo.com', confirmed=True, status='approved')
+            user.set_password('teste123')
+            db.session.add(user)
+            db.session.commit()
+            user_session = UserSession(user_id=user.id, ip_address='192.0.2.80')
+            db.session.add(user_session)
+            db.session.commit()
+            token = user_session.session_token
+
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = user.id
+                sess['session_token'] = token
+
+            queries.clear()
+            for _ in range(5):
+                response = client.get('/api/user/session')
+                assert response.status_code == 200
+            data = response.get_json()
+            assert data['email'] == 'cache@exemplo.com' and data['ip_address'] == '192.0.2.80'
+            # Uma única consulta para cinco requisições
+            assert len(queries) == 1
+            print(f"   5 requisições, {len(queries)} consulta (hits={cache.hits}, misses={cache.misses})")
+
+            # Outro usuário com o mesmo token não é aceito
+            assert cache.validate(user.id + 1, token) is None
+
+            # Extensão descarta a entrada: o novo vencimento é lido do banco
+            old_expiry = cache.get(token).expires_at
+            user_session.expires_at = datetime.utcnow() + timedelta(hours=1)
+            db.session.commit()
+            assert client.post('/api/session/extend').status_code == 200
+            assert cache.get(token) is None
+            client.get('/api/user/session')
+            assert cache.get(token).expires_at > old_expiry
+
+            # Status alterado pelo admin descarta as entradas do usuário
+            cache.invalidate_user(user.id)
+            assert len(cache) == 0
+
+            # A entrada nunca dura além do vencimento da sessão
+            user_session.expires_at = datetime.utcnow() + timedelta(seconds=1)
+            db.session.commit()
+            cache.clear()
+            assert cache.validate(user.id, token) is not None
+            deadline, _ = cache._entries[token]
+            assert deadline - time.monotonic() <= 1.0
+
+            # Consulta concorrente com o logout (load -> invalidate -> put): a
+            # sessão consultada antes do logout não volta ao cache
+            user_session.expires_at = datetime.utcnow() + timedelta(hours=1)
+            db.session.commit()
+            cache.clear()
+            stamp = cache.stamp(user.id)
+            entry = cache.load(token)
+            cache.invalidate(token, user.id)
+            cache.put(token, entry, stamp)
+            assert cache.get(token) is None
+            stamp = cache.stamp(user.id)
+            cache.invalidate(token)
+            cache.put(token, entry, stamp)
+            assert cache.get(token) is None
+
+            # Logout descarta a entrada e a sessão deixa de ser aceita
+            user_session.expires_at = datetime.utcnow() + timedelta(hours=1)
+            db.session.commit()
+            cache.clear()
+            client.get('/api/user/session')
+            assert cache.get(token) is not None
+            client.get('/auth/logout')
+            assert cache.get(token) is None
+            assert cache.validate(user.id, token) is None
+            print("   ✅ Cache das sessões OK")
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_session_queries)
+            app.request_log_policy.shutdown()
+            app.system_log_writer.shutdown()
+            app.log_partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    test_session_cache()
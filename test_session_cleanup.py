@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Script para testar a limpeza em lote das sessões expiradas
+"""
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_session_cleanup():
+    """Testa a limpeza por blocos com uma única transação do firewall"""
+    from app import create_app
+    from app.models import db, User, UserSession, FirewallRule
+    from app.tasks import cleanup_expired_sessions, sync_firewall_rules
+
+    app = create_app('testing')
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        firewall_manager = app.firewall_manager
+        firewall_manager.backend.session_timeouts = False
+        firewall_manager._save_iptables_rules = lambda: True
+        batches = firewall_manager.backend.batches
+
+        try:
+            print("🧹 Testando limpeza em lote das sessões expiradas...")
+            user = User(email='limpeza@exemplo.com', confirmed=True, status='approved')
+            user.set_password('teste123')
+            db.session.add(user)
+            db.session.commit()
+
+            ips = [f'192.0.2.{i}' for i in range(1, 7)]
+            sessions = [UserSession(user_id=user.id, ip_address=ip) for ip in ips]
+            # O IP .5 continua liberado por outra sessão ativa
+            active = UserSession(user_id=user.id, ip_address=ips[4])
+            for session in sessions:
+                session.expires_at = datetime.utcnow() - timedelta(minutes=1)
+            db.session.add_all(sessions + [active])
+            db.session.commit()
+            # A regra do IP .6 nunca chegou a ser aplicada
+            db.session.add_all([
+                FirewallRule(ip_address=s.ip_address, user_id=user.id, session_id=s.id,
+                             iptables_rule_added=s.ip_address != ips[5])
+                for s in sessions + [active]
+            ])
+            db.session.commit()
+            with firewall_manager.transaction() as tx:
+                for ip in ips[:5]:
+                    tx.add_ip(ip)
+            batches.clear()
+
+            # Executada pelo agendador: outra thread, sem contexto da aplicação
+            result = []
+            worker = threading.Thread(target=lambda: result.append(cleanup_expired_sessions(app, chunk_size=4)))
+            worker.start()
+            worker.join()
+            assert result == [6]
+
+            db.session.expire_all()
+            assert UserSession.query.filter_by(is_active=True).all() == [active]
+            assert {rule.session_id for rule in FirewallRule.query.filter_by(is_active=True)} == {active.id}
+            assert all(s.ended_at is not None for s in UserSession.query.filter_by(is_active=False))
+
+            # Uma única transação do firewall para todos os blocos
+            assert len(batches) == 1
+            assert sorted(str(change.network.network_address) for change in batches[0]) == ips[:4]
+            assert all(change.action == 'remove' for change in batches[0])
+
+            app.system_log_writer.flush()
+            logs = app.log_partitions.count(where=lambda t: t.c.message.like('Sessão expirada removida%'))
+            assert logs == 6
+
+            # Nada mais a limpar
+            batches.clear()
+            assert cleanup_expired_sessions(chunk_size=4) == 0
+            assert batches == []
+
+            # Sincronização completa (rede de segurança do reconciliador) também pelo agendador
+            worker = threading.Thread(target=sync_firewall_rules, args=(app,))
+            worker.start()
+            worker.join()
+            app.system_log_writer.flush()
+            assert app.log_partitions.count(
+                where=lambda t: t.c.message == 'Sincronização de regras do firewall concluída'
+            ) == 1
+            print("   ✅ Limpeza em lote OK")
+        finally:
+            app.request_log_policy.shutdown()
+            app.system_log_writer.shutdown()
+            app.log_partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    test_session_cleanup()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Script para testar o cache de sessões compartilhado entre processos
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def _entry(session_id, user_id=1, minutes=60):
+    from app.session_cache import CachedSession
+    now = datetime.utcnow().replace(microsecond=0)
+    return CachedSession(session_id, user_id, f'usuario{user_id}@exemplo.com', 'user', 'approved',
+                         f'192.0.2.{session_id % 250}', now, now + timedelta(minutes=minutes))
+
+
+def test_shared_cache():
+    """Testa visibilidade entre processos, invalidação por geração e validação pelo banco"""
+    from app.shared_cache import SharedSessionCache
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'session_cache.bin')
+        cache = SharedSessionCache(path=path, slots=256, stripes=8, user_slots=64)
+        cache.ttl = 30
+
+        print("🧠 Testando cache compartilhado de sessões...")
+        entry = _entry(7)
+        cache.put('token-a', entry)
+        assert cache.get('token-a') == entry
+        assert cache.get('token-b') is None
+
+        # Outro processo (worker) enxerga e invalida as mesmas entradas
+        cache.put('token-b', _entry(8, user_id=2))
+        pid = os.fork()
+        if pid == 0:
+            ok = cache.get('token-a') == entry
+            cache.invalidate('token-b')
+            cache.put('token-c', _entry(9, user_id=3))
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.WEXITSTATUS(status) == 0
+        assert cache.get('token-b') is None
+        assert cache.get('token-c').user_id == 3
+
+        # Novo mapeamento do mesmo arquivo (ex.: worker reiniciado) mantém as entradas
+        other = SharedSessionCache(path=path, slots=256, stripes=8, user_slots=64)
+        assert other.get('token-a') == entry
+
+        # Geração do usuário: invalida só as entradas dele
+        cache.invalidate_user(3)
+        assert cache.get('token-c') is None and other.get('token-a') == entry
+
+        # Marca tirada antes de uma invalidação concorrente: a entrada não vale
+        stamp = cache.stamp(1)
+        cache.invalidate_user(1)
+        cache.put('token-a', entry, stamp)
+        assert cache.get('token-a') is None
+
+        # Consulta concorrente com o logout (load -> invalidate -> put): a
+        # entrada consultada antes do logout não volta ao cache
+        stamp = cache.stamp(1)
+        cache.invalidate('token-a', user_id=1)
+        cache.put('token-a', entry, stamp)
+        assert cache.get('token-a') is None and other.get('token-a') is None
+
+        # Geração global: clear invalida tudo
+        cache.put('token-a', entry)
+        assert len(cache) == 1
+        other.clear()
+        assert cache.get('token-a') is None and len(cache) == 0
+
+        # Faixa cheia: as entradas de prazo mais curto são substituídas
+        for i in range(2000):
+            cache.put(f'token-{i}', _entry(i, user_id=10, minutes=1 + i))
+        assert cache.get('token-1999') is not None
+        assert len(cache) <= 256
+
+        # Entrada nunca dura além do vencimento da sessão
+        cache.put('token-curto', _entry(5, minutes=-1))
+        assert cache.get('token-curto') is None
+
+        # Layout diferente (ex.: nova configuração): arquivo novo no lugar, sem
+        # truncar o que os workers antigos mapearam (SIGBUS ao acessá-lo)
+        cache.put('token-layout', entry)
+        inode = os.stat(path).st_ino
+        smaller = SharedSessionCache(path=path, slots=64, stripes=8, user_slots=64)
+        assert os.stat(path).st_ino != inode and smaller.get('token-layout') is None
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if cache.get('token-layout') == entry else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+        assert sorted(os.listdir(directory)) == ['session_cache.bin']
+        smaller.close()
+        other.close()
+        cache.close()
+        print("   ✅ Cache compartilhado OK")
+
+
+def test_shared_cache_validate():
+    """Testa a validação pelo banco usando o cache compartilhado"""
+    from app import create_app
+    from app.models import db, User, UserSession
+    from app.shared_cache import SharedSessionCache
+
+    app = create_app('testing')
+
+    with app.app_context(), tempfile.TemporaryDirectory() as directory:
+        db.drop_all()
+        db.create_all()
+        app.config['SESSION_CACHE_PATH'] = os.path.join(directory, 'session_cache.bin')
+        app.config['SESSION_CACHE_SLOTS'] = 256
+        app.config['SESSION_CACHE_STRIPES'] = 8
+        cache = SharedSessionCache(app)
+
+        try:
+            user = User(email='compartilhado@exemplo.com', confirmed=True, status='approved')
+            user.set_password('teste123')
+            db.session.add(user)
+            db.session.commit()
+            user_session = UserSession(user_id=user.id, ip_address='192.0.2.90')
+            db.session.add(user_session)
+            db.session.commit()
+
+            validated = cache.validate(user.id, user_session.session_token)
+            assert validated.email == 'compartilhado@exemplo.com' and validated.ip_address == '192.0.2.90'
+            assert abs((validated.expires_at - user_session.expires_at).total_seconds()) < 0.001
+            assert cache.validate(user.id, user_session.session_token) == validated
+            assert (cache.hits, cache.misses) == (1, 1)
+            assert cache.validate(user.id + 1, user_session.session_token) is None
+        finally:
+            cache.close()
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    test_shared_cache()
+    test_shared_cache_validate()
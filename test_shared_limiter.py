@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Script para testar o armazenamento de rate limiting compartilhado entre processos
+"""
+import os
+import sys
+import time
+import tempfile
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_shared_limiter():
+    """Testa contadores globais entre processos, expiração, estratégias e substituição com a faixa cheia"""
+    from limits import parse
+    from limits.storage import storage_from_string
+    from limits.strategies import FixedWindowRateLimiter, SlidingWindowCounterRateLimiter
+    from app.shared_limiter import SharedLimiterStorage
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ratelimit.bin')
+        storage = storage_from_string(f'shared://{path}?slots=256&stripes=8')
+        assert isinstance(storage, SharedLimiterStorage) and storage.per_stripe == 32
+
+        print("🚦 Testando rate limiting compartilhado...")
+        assert storage.incr('chave', 60) == 1
+        assert storage.incr('chave', 60, amount=2) == 3
+        assert storage.get('chave') == 3 and storage.get('outra') == 0
+        assert storage.get_expiry('chave') > time.time() + 59
+
+        # Vários workers batendo no mesmo limite: o total é global e exato
+        limiter = FixedWindowRateLimiter(storage)
+        item = parse('10 per minute')
+        children = []
+        for _ in range(4):
+            read, write = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read)
+                allowed = sum(limiter.hit(item, '192.0.2.1') for _ in range(10))
+                os.write(write, bytes([allowed]))
+                os._exit(0)
+            os.close(write)
+            children.append((pid, read))
+        allowed = 0
+        for pid, read in children:
+            os.waitpid(pid, 0)
+            allowed += os.read(read, 1)[0]
+            os.close(read)
+        assert allowed == 10, allowed
+        assert not limiter.test(item, '192.0.2.1')
+        assert limiter.test(item, '192.0.2.2')
+
+        # Novo mapeamento do mesmo arquivo (ex.: worker reiniciado) mantém os contadores
+        other = SharedLimiterStorage(f'shared://{path}', slots=256, stripes=8)
+        assert other.get('chave') == 3
+        other.clear('chave')
+        assert storage.get('chave') == 0
+
+        # Expiração: o contador recomeça
+        storage.incr('curta', 0.05)
+        time.sleep(0.1)
+        assert storage.get('curta') == 0 and storage.incr('curta', 60) == 1
+
+        # Sliding window counter
+        sliding = SlidingWindowCounterRateLimiter(storage)
+        item = parse('3 per minute')
+        assert [sliding.hit(item, 'janela') for _ in range(4)] == [True, True, True, False]
+
+        # Tabela de tamanho fixo: chaves novas substituem as de expiração mais próxima
+        for i in range(2000):
+            storage.incr(f'ip-{i}', 60 + i)
+        assert storage.get('ip-1999') == 1 and storage.evictions > 0
+        assert storage.reset() <= 256 and storage.get('ip-1999') == 0
+
+        # Layout diferente: arquivo novo no lugar, sem truncar o que os workers
+        # antigos mapearam (SIGBUS ao acessá-lo)
+        storage.incr('layout', 60, amount=5)
+        inode = os.stat(path).st_ino
+        smaller = SharedLimiterStorage(f'shared://{path}', slots=64, stripes=8)
+        assert os.stat(path).st_ino != inode and smaller.get('layout') == 0
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if storage.get('layout') == 5 else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+        assert sorted(os.listdir(directory)) == ['ratelimit.bin']
+        smaller.close()
+        other.close()
+        storage.close()
+        print("   ✅ Rate limiting compartilhado OK")
+
+
+def test_shared_limiter_app():
+    """Testa o limite das rotas com o armazenamento compartilhado configurado na aplicação"""
+    from unittest import mock
+    from flask import Flask
+    from datetime import datetime
+    from app import create_app, limiter
+    from app.models import db
+    from app.shared_limiter import SharedLimiterStorage, shared_storage_uri
+    from config.config import TestingConfig
+
+    with tempfile.TemporaryDirectory() as directory:
+        # shared:// sem caminho: arquivo no diretório instance/ da aplicação
+        assert shared_storage_uri(Flask(__name__, instance_path=directory)) == \
+            f"shared://{os.path.join(directory, 'ratelimit.bin')}"
+
+        uri = f"shared://{os.path.join(directory, 'ratelimit.bin')}"
+        with mock.patch.object(TestingConfig, 'RATELIMIT_STORAGE_URI', uri):
+            app = create_app('testing')
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            try:
+                assert isinstance(limiter._storage, SharedLimiterStorage)
+                client = app.test_client()
+                # /auth/resend-confirmation: 3 por minuto
+                codes = [client.get('/auth/resend-confirmation').status_code for _ in range(4)]
+                assert codes == [200, 200, 200, 429], codes
+                print("   ✅ Limite das rotas com shared:// OK")
+            finally:
+                limiter._storage.close()
+                app.request_log_policy.shutdown()
+                app.system_log_writer.shutdown()
+                app.log_partitions.drop_before(datetime.max)
+                db.session.remove()
+                db.drop_all()
+
+
+if __name__ == '__main__':
+    test_shared_limiter()
+    test_shared_limiter_app()
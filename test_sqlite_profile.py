@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Script para testar o perfil do SQLite (WAL, PRAGMAs e manutenção periódica)
+"""
+import os
+import sys
+import threading
+from datetime import datetime
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def _in_scheduler_thread(task, *args, **kwargs):
+    """Executa a tarefa em outra thread, sem contexto da aplicação (como o agendador)"""
+    results = []
+    worker = threading.Thread(target=lambda: results.append(task(*args, **kwargs)))
+    worker.start()
+    worker.join()
+    return results[0]
+
+
+def test_sqlite_profile():
+    """Testa os PRAGMAs por conexão, o checkpoint do WAL e a métrica de tamanho"""
+    from sqlalchemy import text
+    from app import create_app
+    from app.models import db, User, sqlite_wal_size
+    from app.tasks import checkpoint_database, optimize_database, health_check
+
+    app = create_app('testing')
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        try:
+            print("🗄️  Testando perfil do SQLite...")
+            with db.engine.connect() as connection:
+                pragma = lambda name: connection.execute(text(f'PRAGMA {name}')).scalar()
+                assert pragma('journal_mode') == 'wal'
+                assert pragma('synchronous') == 1  # NORMAL
+                assert pragma('busy_timeout') == 5000
+                assert pragma('temp_store') == 2  # MEMORY
+                assert pragma('cache_size') == -20000
+            assert db.engine.pool.size() == app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size']
+
+            # Escritas vão para o WAL até o checkpoint
+            for i in range(20):
+                user = User(email=f'wal{i}@exemplo.com')
+                user.password_hash = 'x'
+                db.session.add(user)
+                db.session.commit()
+            assert sqlite_wal_size() > 0
+            print(f"   WAL com {sqlite_wal_size()} bytes antes do checkpoint")
+
+            # Executadas pelo agendador: outra thread, sem contexto da aplicação
+            result = _in_scheduler_thread(checkpoint_database, app, mode='TRUNCATE')
+            assert result is not None and not result['busy']
+            assert result['checkpointed'] == result['log_frames']
+            db.session.remove()
+            assert sqlite_wal_size() == 0
+
+            assert _in_scheduler_thread(optimize_database, app) is True
+            health = health_check()
+            assert health['database'] is True and 'wal_size_bytes' in health
+            print("   ✅ Perfil do SQLite OK")
+        finally:
+            app.system_log_writer.shutdown()
+            app.log_partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+
+def test_in_memory_engine_options():
+    """Testa TEST_DATABASE_URL=sqlite:// (StaticPool) e o registro único do perfil por engine"""
+    from sqlalchemy.pool import StaticPool
+    from app import create_app
+    from app.models import db, configure_sqlite_engine, _sqlite_engines
+    from config.config import TestingConfig
+
+    original = TestingConfig.SQLALCHEMY_DATABASE_URI
+    TestingConfig.SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    try:
+        app = create_app('testing')
+    finally:
+        TestingConfig.SQLALCHEMY_DATABASE_URI = original
+
+    try:
+        options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+        assert not {'pool_size', 'max_overflow', 'pool_timeout'} & set(options)
+        assert options['pool_recycle'] == TestingConfig.SQLALCHEMY_ENGINE_OPTIONS['pool_recycle']
+        # As opções da classe de configuração não são alteradas
+        assert 'pool_size' in TestingConfig.SQLALCHEMY_ENGINE_OPTIONS
+
+        with app.app_context():
+            assert isinstance(db.engine.pool, StaticPool)
+            assert db.engine in _sqlite_engines
+            listeners = len(db.engine.pool.dispatch.connect)
+            configure_sqlite_engine(app)
+            assert len(db.engine.pool.dispatch.connect) == listeners
+    finally:
+        app.system_log_writer.shutdown()
+
+
+if __name__ == '__main__':
+    test_sqlite_profile()
+    test_in_memory_engine_options()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Script para testar os contadores das estatísticas (tabela stat_counters)
+"""
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+# Adicionar o diretório atual ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_stats_counters():
+    """Testa os contadores nos caminhos de escrita, na limpeza e na reconciliação"""
+    from app import create_app
+    from app.models import db, User, UserSession, FirewallRule, SystemLog, StatCounter
+    from app.stats import real_counts, logs_today
+    from app.tasks import cleanup_expired_sessions, reconcile_stats
+
+    app = create_app('testing')
+    app.config['RATELIMIT_ENABLED'] = False
+    # Nenhuma tarefa agendada gravando no banco durante as comparações
+    app.scheduler.shutdown()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        partitions = app.log_partitions
+        app.firewall_manager._save_iptables_rules = lambda: True
+        names = ['users.total', 'users.confirmed', 'sessions.active', 'rules.total',
+                 'rules.active', 'logs.total', logs_today()]
+        table = StatCounter.__table__
+
+        def assert_consistent():
+            app.system_log_writer.flush()
+            partitions.refresh()
+            # Contagens e contadores lidos na mesma transação (com o lock de escrita, como a reconciliação)
+            with db.engine.begin() as connection:
+                connection.execute(table.update().where(table.c.name == '').values(value=table.c.value))
+                expected = real_counts(partitions, connection)
+                values = StatCounter.values(names, connection)
+            assert values == {name: expected[name] for name in names}
+
+        try:
+            print("📊 Testando contadores das estatísticas...")
+            users = [User(email=f'contador{i}@exemplo.com', confirmed=i < 2) for i in range(3)]
+            for user in users:
+                user.set_password('senha123')
+            db.session.add_all(users)
+            db.session.commit()
+            users[2].confirmed = True
+            db.session.commit()
+            assert StatCounter.values(['users.total', 'users.confirmed']) == {'users.total': 3, 'users.confirmed': 3}
+
+            sessions = [UserSession(user_id=users[0].id, ip_address=f'192.0.2.{i}') for i in range(1, 5)]
+            db.session.add_all(sessions)
+            db.session.commit()
+            db.session.add_all([
+                FirewallRule(ip_address=s.ip_address, user_id=users[0].id, session_id=s.id) for s in sessions
+            ])
+            sessions[0].end_session()
+            db.session.commit()
+            rule = FirewallRule.query.filter_by(ip_address='192.0.2.1').first()
+            rule.mark_as_removed()
+            db.session.commit()
+            db.session.delete(users[1])
+            db.session.commit()
+            assert_consistent()
+            print("   Usuários, sessões e regras contados no flush")
+
+            # Logs gravados pela fila, pelo ORM e diretamente nas partições
+            SystemLog.log(level='INFO', message='Contador', module='teste')
+            app.system_log_writer.flush()
+            db.session.add(SystemLog(level='INFO', message='Antigo', module='teste',
+                                     created_at=datetime.utcnow() - timedelta(days=60)))
+            db.session.commit()
+            with db.engine.begin() as connection:
+                partitions.insert(connection, [
+                    {'level': 'INFO', 'message': f'Dia -{age}', 'module': 'teste',
+                     'created_at': datetime.utcnow() - timedelta(days=age)}
+                    for age in (0, 0, 1, 40)
+                ])
+            assert_consistent()
+            assert StatCounter.values([logs_today()])[logs_today()] >= 3
+
+            # Limpeza em massa das sessões expiradas ajusta os contadores
+            for session in sessions[1:3]:
+                session.expires_at = datetime.utcnow() - timedelta(minutes=1)
+            db.session.commit()
+            assert cleanup_expired_sessions() == 2
+            assert_consistent()
+
+            # Retenção dos logs
+            partitions.drop_before(datetime.utcnow() - timedelta(days=30))
+            assert_consistent()
+            print("   Logs e limpezas refletidos nos contadores")
+
+            # As rotas de estatísticas leem os contadores
+            with app.test_client() as client:
+                with client.session_transaction() as sess:
+                    sess['user_id'] = users[0].id
+                stats = client.get('/api/system/stats').get_json()
+                assert stats['users'] == {'total': 2, 'confirmed': 2, 'active_sessions': 1}
+                assert stats['firewall']['total_rules'] == 4
+                assert stats['logs']['total'] == partitions.count()
+                assert client.get('/status').status_code == 200
+
+            # Reconciliação corrige o desvio
+            with db.engine.begin() as connection:
+                StatCounter.increment(connection, {'users.total': 5, 'logs.total': -2})
+            assert reconcile_stats() == {'users.total': -5, 'logs.total': 2}
+            assert reconcile_stats() == {}
+            assert_consistent()
+
+            # Gravação concorrente com a reconciliação: espera o fim da transação
+            # em vez de ser contada e depois descontada como desvio
+            from app import stats
+
+            def register():
+                with app.app_context():
+                    user = User(email='concorrente@exemplo.com')
+                    user.password_hash = 'x'
+                    db.session.add(user)
+                    db.session.commit()
+
+            writer = threading.Thread(target=register)
+            original = stats.real_counts
+
+            def racing_counts(log_partitions, connection=None):
+                counts = original(log_partitions, connection)
+                writer.start()
+                writer.join(0.3)
+                return counts
+
+            stats.real_counts = racing_counts
+            try:
+                reconcile_stats()
+            finally:
+                stats.real_counts = original
+            writer.join()
+            assert_consistent()
+            print("   ✅ Contadores das estatísticas OK")
+        finally:
+            app.request_log_policy.shutdown()
+            app.system_log_writer.shutdown()
+            app.email_worker.shutdown()
+            partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+
+def test_upgrade_existing_database():
+    """Testa a criação das tabelas novas em um banco de versão anterior, com contadores reconciliados"""
+    from sqlalchemy import inspect
+    from app import create_app
+    from app.models import db, User, StatCounter
+
+    new_tables = ['stat_counters', 'email_outbox', 'request_counters', 'admin_digest_events']
+    app = create_app('testing')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        users = [User(email=f'antigo{i}@exemplo.com', confirmed=True) for i in range(2)]
+        for user in users:
+            user.password_hash = 'x'
+        db.session.add_all(users)
+        db.session.commit()
+        # Banco criado antes das tabelas novas
+        for name in new_tables:
+            db.metadata.tables[name].drop(db.engine)
+        db.session.remove()
+    app.request_log_policy.shutdown()
+    app.system_log_writer.shutdown()
+
+    upgraded = create_app('testing')
+    with upgraded.app_context():
+        try:
+            print("🆙 Testando atualização de banco existente...")
+            assert set(new_tables) <= set(inspect(db.engine).get_table_names())
+            # Contadores partem das contagens reais
+            assert StatCounter.values(['users.total', 'users.confirmed']) == {'users.total': 2, 'users.confirmed': 2}
+            user = User(email='novo@exemplo.com')
+            user.password_hash = 'x'
+            db.session.add(user)
+            db.session.commit()
+            assert StatCounter.values(['users.total'])['users.total'] == 3
+
+            # Emails gravados na outbox na transação do chamador
+            from app.email import send_email
+            from app.models import EmailOutbox
+            send_email('Atualizado', 'sistema@exemplo.com', ['novo@exemplo.com'], 'corpo', email_type='teste')
+            db.session.commit()
+            assert EmailOutbox.query.filter_by(subject='Atualizado').count() == 1
+
+            # Contadores de requisições por minuto
+            upgraded.request_log_policy.count('main.index', 200)
+            assert upgraded.request_log_policy.flush() == 1
+
+            # Eventos dos resumos do administrador
+            from app.models import AdminDigestEvent
+            sent = []
+            upgraded.admin_digest.record('admin_new_registration', 'novo@exemplo.com', None, lambda: sent.append(1))
+            db.session.commit()
+            assert sent == [1] and AdminDigestEvent.query.count() == 1
+            print("   ✅ Atualização de banco existente OK")
+        finally:
+            upgraded.request_log_policy.shutdown()
+            upgraded.system_log_writer.shutdown()
+            upgraded.log_partitions.drop_before(datetime.max)
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    test_stats_counters()
+    test_upgrade_existing_database()